@@ -0,0 +1,219 @@
+"""Admission control for encodes based on their predicted cost.
+
+Before any work starts, each request's peak memory, encoder threads and run
+time are estimated from its images, audio length and encoder profile. An
+encode is admitted while the committed totals of everything in flight stay
+inside the budget. Otherwise it waits its turn in a bounded line. Requests
+that could never fit, or that find the line full, are rejected.
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+from preprocess import MAX_HEIGHT, MAX_WIDTH, PREPROCESS_WORKERS
+from probe import probe
+from resources import cpu_count, memory_limit
+
+try:
+    from PIL import Image
+except ImportError:  # Without Pillow image sizes are assumed to be large
+    Image = None
+
+MB = 1024 * 1024
+
+# Rough cost model for libx264 on a MAX_WIDTH x MAX_HEIGHT canvas; compare
+# with `python benchmark.py` when tuning. Per preset: frames of lookahead
+# x264 buffers, and seconds to encode one still.
+PRESET_COSTS = {
+    'ultrafast': (0, 0.02), 'superfast': (0, 0.03), 'veryfast': (10, 0.04),
+    'faster': (20, 0.06), 'fast': (30, 0.08), 'medium': (40, 0.12),
+    'slow': (50, 0.25), 'slower': (60, 0.5), 'veryslow': (60, 1.0),
+}
+FFMPEG_BASE_BYTES = 40 * MB      # FFmpeg, x264 and AAC before any frames
+REFERENCE_FRAMES = 4             # Reference and reconstruction buffers
+AUDIO_SECONDS_PER_SECOND = 0.01  # AAC encodes about 100x realtime
+UNKNOWN_IMAGE_PIXELS = 24000000  # Assumed when an image's size can't be read
+
+
+# By default encodes may commit 60% of the memory limit, leaving the rest for
+# the server itself, upload buffers and the page cache
+MEMORY_BUDGET = int(os.environ.get('MEMORY_BUDGET_MB', 0)) * MB or int(memory_limit() * 0.6)
+THREAD_BUDGET = int(os.environ.get('THREAD_BUDGET', cpu_count()))
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', 8))
+
+
+class AdmissionError(Exception):
+    """Raised when an encode is not admitted"""
+
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class EncodeCost:
+    """Predicted peak memory, encoder threads and run time of one encode"""
+
+    def __init__(self, memory_bytes, threads, seconds):
+        self.memory_bytes = memory_bytes
+        self.threads = threads
+        self.seconds = seconds
+
+    def to_dict(self):
+        return {
+            'memory_mb': round(self.memory_bytes / MB, 1),
+            'threads': self.threads,
+            'seconds': round(self.seconds, 2),
+        }
+
+
+def image_pixels(path):
+    """Pixel count from the image header, without decoding it"""
+    return probe(path).pixels or UNKNOWN_IMAGE_PIXELS
+
+
+def estimate_cost(image_paths, output_seconds, profile, threads, processes=1):
+    """Predict what encoding these images for ``output_seconds`` will need.
+
+    Peak memory is the larger of the preprocessing stage (the biggest images
+    decoded side by side) and the encode (x264's frame buffers in each of
+    ``processes`` parallel FFmpeg processes sharing ``threads``). Run time
+    grows with the number of stills and the audio length.
+    """
+    lookahead, seconds_per_frame = PRESET_COSTS.get(profile.preset, PRESET_COSTS['medium'])
+    frame_bytes = MAX_WIDTH * MAX_HEIGHT * 3 // 2  # One yuv420p frame
+    process_threads = max(1, threads // processes)
+    encode_memory = processes * (FFMPEG_BASE_BYTES
+                                 + (lookahead + 2 * process_threads + REFERENCE_FRAMES) * frame_bytes)
+
+    # Pillow's draft mode decodes JPEGs at no more than about twice the frame
+    # box in each dimension
+    decode_limit = 4 * MAX_WIDTH * MAX_HEIGHT if Image else UNKNOWN_IMAGE_PIXELS
+    pixels = sorted((min(image_pixels(path), decode_limit) for path in image_paths), reverse=True)
+    preprocess_memory = sum(count * 3 for count in pixels[:PREPROCESS_WORKERS])
+
+    seconds = len(image_paths) * seconds_per_frame / processes + output_seconds * AUDIO_SECONDS_PER_SECOND
+    return EncodeCost(max(encode_memory, preprocess_memory), threads, seconds)
+
+
+class Ticket:
+    """An encode waiting for, or holding, its share of the budget"""
+
+    def __init__(self, cost):
+        self.cost = cost
+        self.admitted_at = None
+
+
+class AdmissionController:
+    """Tracks the memory and threads committed to in-flight encodes.
+
+    Encodes are admitted in arrival order; one that does not fit waits until
+    enough earlier encodes release their share. An encode is always admitted
+    when nothing else is running, so a thread budget smaller than one
+    encode's threads only serializes encodes.
+    """
+
+    def __init__(self, memory_budget=MEMORY_BUDGET, thread_budget=THREAD_BUDGET,
+                 max_waiting=ADMISSION_MAX_WAITING):
+        self.memory_budget = memory_budget
+        self.thread_budget = thread_budget
+        self.max_waiting = max_waiting
+        self.committed_memory = 0
+        self.committed_threads = 0
+        self.rejected = 0
+        self._active = []
+        self._waiting = deque()
+        self._condition = threading.Condition()
+
+    def _fits(self, cost):
+        if not self._active:
+            return True
+        return (self.committed_memory + cost.memory_bytes <= self.memory_budget
+                and self.committed_threads + cost.threads <= self.thread_budget)
+
+    def retry_after(self):
+        """Seconds until the first in-flight encode is predicted to finish"""
+        with self._condition:
+            remaining = [ticket.admitted_at + ticket.cost.seconds - time.time() for ticket in self._active]
+        return min(300, max(5, math.ceil(min(remaining)))) if remaining else 5
+
+    def _reject(self, message, status):
+        self.rejected += 1
+        return AdmissionError(message, status, self.retry_after())
+
+    def check(self, cost):
+        """Raise AdmissionError (413) if the encode could never fit the memory budget"""
+        if cost.memory_bytes > self.memory_budget:
+            self.rejected += 1
+            raise AdmissionError(f'Request needs about {cost.memory_bytes // MB} MB to encode, '
+                                 f'more than the {self.memory_budget // MB} MB budget', 413)
+
+    def acquire(self, cost, timeout=None):
+        """Wait for room in the budget and return a Ticket; release it when done.
+
+        Raises AdmissionError when the line is full (429) or ``timeout``
+        seconds pass without the encode being admitted (503).
+        """
+        self.check(cost)
+        ticket = Ticket(cost)
+        with self._condition:
+            if len(self._waiting) >= self.max_waiting:
+                raise self._reject(f'Too many encodes waiting ({len(self._waiting)})', 429)
+
+            self._waiting.append(ticket)
+            try:
+                with STAGE_SECONDS.time(stage='admission'):
+                    admitted = self._condition.wait_for(
+                        lambda: self._waiting[0] is ticket and self._fits(cost), timeout)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()  # The next in line may fit now
+
+            if not admitted:
+                raise self._reject(f'Server busy, encode not admitted within {timeout:g}s', 503)
+
+            ticket.admitted_at = time.time()
+            self._active.append(ticket)
+            self.committed_memory += cost.memory_bytes
+            self.committed_threads += cost.threads
+        return ticket
+
+    def release(self, ticket):
+        with self._condition:
+            if ticket in self._active:
+                self._active.remove(ticket)
+                self.committed_memory -= ticket.cost.memory_bytes
+                self.committed_threads -= ticket.cost.threads
+                self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, cost, timeout=None):
+        """Hold a share of the budget for the body of a with block"""
+        ticket = self.acquire(cost, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def waiting(self):
+        with self._condition:
+            return len(self._waiting)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'memory_budget_mb': self.memory_budget // MB,
+                'thread_budget': self.thread_budget,
+                'committed_memory_mb': round(self.committed_memory / MB, 1),
+                'committed_threads': self.committed_threads,
+                'active': len(self._active),
+                'waiting': len(self._waiting),
+                'rejected': self.rejected,
+            }
+
+
+admission = AdmissionController()
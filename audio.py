@@ -0,0 +1,162 @@
+"""Audio stage: get an upload's audio into the MP4 with as little work as possible.
+
+AAC uploads whose bitrate suits the encoder profile are stream copied into
+the MP4 untouched. Anything else is transcoded to AAC once, in its own short
+FFmpeg run, and the result is cached by content hash and settings. Either
+way, the video encode only copies the prepared audio. Loudness normalization
+is optional: a two-pass EBU R128 loudnorm whose first-pass analysis is cached
+too, so a repeated upload goes straight to the second pass or to the cached
+result.
+"""
+import json
+import logging
+import math
+import os
+
+from cache import file_digest, make_key, media_cache
+from probe import probe
+from progress import run_ffmpeg
+
+logger = logging.getLogger(__name__)
+
+COPY_CODECS = {'aac'}  # Audio the MP4 can carry as it is
+COPY_HEADROOM = 1.5    # Copy AAC up to this multiple of the profile's audio bitrate
+LOUDNORM_TARGET = 'I=-16:TP=-1.5:LRA=11'  # Integrated loudness, true peak and range for streaming
+# First-pass measurements and the second-pass options they are passed back as
+LOUDNORM_FIELDS = {'input_i': 'measured_I', 'input_tp': 'measured_TP', 'input_lra': 'measured_LRA',
+                   'input_thresh': 'measured_thresh', 'target_offset': 'offset'}
+NORMALIZED_SAMPLE_RATE = 48000  # loudnorm works at 192 kHz; the output is resampled to this
+AUDIO_TIMEOUT = 120
+
+
+def _bits_per_second(rate):
+    # Profile bitrates are FFmpeg strings such as '128k'
+    multipliers = {'k': 1000, 'M': 1000000}
+    if rate and rate[-1] in multipliers:
+        return float(rate[:-1]) * multipliers[rate[-1]]
+    return float(rate)
+
+
+class AudioPlan:
+    """How one request's audio gets into the MP4.
+
+    ``output_path`` is the file the video encode reads, and ``mux_args`` are
+    its audio arguments; the work to create the file is done by
+    prepare_audio.
+    """
+
+    def __init__(self, source_path, output_path, mode, digest, encoder_args=(), normalize=False):
+        self.source_path = source_path
+        self.output_path = output_path
+        self.mode = mode  # 'copy' or 'transcode'
+        self.digest = digest
+        self.encoder_args = list(encoder_args)
+        self.normalize = normalize
+
+    def mux_args(self):
+        return ['-c:a', 'copy']
+
+    def key_parts(self):
+        """What distinguishes the prepared audio in a cache key"""
+        return [self.mode, *self.encoder_args, *([f'loudnorm={LOUDNORM_TARGET}'] if self.normalize else [])]
+
+    def to_dict(self):
+        return {'mode': self.mode, 'normalize': self.normalize}
+
+
+def plan_audio(audio_path, folder, profile, encoder='aac', normalize=False):
+    """Decide whether the audio can be copied or has to be transcoded (or normalized).
+
+    Only the file header is read; nothing is encoded until prepare_audio.
+    """
+    digest = file_digest(audio_path)
+    info = probe(audio_path, digest)
+    if not normalize and info.codec in COPY_CODECS and info.duration:
+        bitrate = os.path.getsize(audio_path) * 8 / info.duration
+        if bitrate <= _bits_per_second(profile.audio_bitrate) * COPY_HEADROOM:
+            return AudioPlan(audio_path, audio_path, 'copy', digest)
+
+    encoder_args = profile.audio_args(encoder)
+    if normalize:
+        sample_rate = min(info.sample_rate or NORMALIZED_SAMPLE_RATE, NORMALIZED_SAMPLE_RATE)
+        encoder_args += ['-ar', str(sample_rate)]
+    name = f'audio_{"normalized_" if normalize else ""}{profile.name}.m4a'
+    return AudioPlan(audio_path, os.path.join(folder, name), 'transcode', digest, encoder_args, normalize)
+
+
+def _finite(value):
+    try:
+        return math.isfinite(float(value))
+    except (TypeError, ValueError):
+        return False
+
+
+def _parse_loudnorm(stderr):
+    # loudnorm prints its measurements as a JSON object at the end of the log
+    start, end = stderr.rfind('{'), stderr.rfind('}')
+    if start < 0 or end < start:
+        return None
+    try:
+        measured = json.loads(stderr[start:end + 1])
+    except ValueError:
+        return None
+    if not all(_finite(measured.get(field)) for field in LOUDNORM_FIELDS):
+        return None  # Silence measures as -inf and can't be normalized
+    return {field: measured[field] for field in LOUDNORM_FIELDS}
+
+
+def measure_loudness(plan, timeout=AUDIO_TIMEOUT):
+    """First loudnorm pass: the audio's loudness, cached by content.
+
+    Returns (measurements or None, the FFmpegRun or None when cached).
+    """
+    key = make_key('loudness', plan.digest, LOUDNORM_TARGET)
+    analysis_path = os.path.join(os.path.dirname(plan.output_path), 'loudness.json')
+    if media_cache.get(key, analysis_path):
+        with open(analysis_path, encoding='utf-8') as f:
+            return json.load(f), None
+
+    run = run_ffmpeg(['ffmpeg', '-y', '-i', plan.source_path, '-vn',
+                      '-af', f'loudnorm={LOUDNORM_TARGET}:print_format=json', '-f', 'null', '-'],
+                     timeout=timeout)
+    measured = _parse_loudnorm(run.stderr_tail()) if run.returncode == 0 else None
+    if measured:
+        with open(analysis_path, 'w', encoding='utf-8') as f:
+            json.dump(measured, f)
+        media_cache.put(key, analysis_path)
+    return measured, run
+
+
+def prepare_audio(plan, timeout=AUDIO_TIMEOUT):
+    """Create ``plan.output_path`` unless it exists or is cached.
+
+    Returns the last FFmpegRun, or None when nothing had to run, so callers
+    can check its returncode like any other encode.
+    """
+    if plan.mode == 'copy' or os.path.exists(plan.output_path):
+        return None
+
+    key = make_key('audio', plan.digest, *plan.key_parts())
+    if media_cache.get(key, plan.output_path):
+        logger.info(f'Using cached audio for {plan.source_path}')
+        return None
+
+    audio_filter = []
+    if plan.normalize:
+        measured, run = measure_loudness(plan, timeout)
+        if run and run.returncode != 0:
+            return run
+        if measured:
+            options = ':'.join(f'{option}={measured[field]}' for field, option in LOUDNORM_FIELDS.items())
+            audio_filter = ['-af', f'loudnorm={LOUDNORM_TARGET}:{options}:linear=true']
+        else:
+            logger.info(f'Loudness of {plan.source_path} could not be measured, not normalizing it')
+
+    # Written under a temporary name so a failed run never leaves a partial file behind
+    tmp_path = f'{plan.output_path}.tmp.m4a'
+    run = run_ffmpeg(['ffmpeg', '-y', '-i', plan.source_path, '-vn', *audio_filter, *plan.encoder_args,
+                      tmp_path], timeout=timeout)
+    if run.returncode == 0:
+        os.replace(tmp_path, plan.output_path)
+        media_cache.put(key, plan.output_path)
+    return run
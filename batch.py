@@ -0,0 +1,144 @@
+"""Variants of one upload for the batch endpoint.
+
+A batch sends the audio and images once, together with a list of variants
+that differ in image order, durations, encoder profile or subtitles. The
+shared images are preprocessed and the audio probed a single time, and every
+variant is then encoded from the same session folder.
+"""
+import json
+import os
+import re
+import uuid
+import zipfile
+
+from profiles import get_profile
+from subtitles import get_style, get_subtitle_mode, subtitle_track
+from timeline import clip_timeline, parse_durations
+
+BATCH_MAX_VARIANTS = int(os.environ.get('BATCH_MAX_VARIANTS', 20))
+
+_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')  # Also used as the file name in the ZIP
+_FIELDS = {'name', 'images', 'durations', 'profile', 'subtitle_text', 'subtitle_mode', 'subtitle_style'}
+
+
+class Variant:
+    """One video to render from the batch's shared audio and images"""
+
+    def __init__(self, index, name, image_indices, durations, profile, subtitle_text='',
+                 subtitle_mode='burn', style=None):
+        self.index = index
+        self.name = name
+        self.image_indices = image_indices
+        self.durations = durations
+        self.profile = profile
+        self.subtitle_text = subtitle_text
+        self.subtitle_mode = subtitle_mode
+        self.style = style or get_style()
+
+    def image_paths(self, shared_paths):
+        return [shared_paths[i] for i in self.image_indices]
+
+    def clip(self, seconds):
+        """Drop the images that would show after ``seconds``, the end of the audio"""
+        self.image_indices, self.durations = clip_timeline(self.image_indices, self.durations, seconds)
+
+    def output_seconds(self, audio_seconds=None):
+        """Length of the video: the images' durations, or less if the audio is shorter"""
+        length = sum(self.durations)
+        return min(length, audio_seconds) if audio_seconds else length
+
+    def subtitles(self, audio_seconds=None, can_burn=True):
+        """The variant's cues timed over the audio, or None without subtitle text.
+
+        Burned-in subtitles become a soft track when ``can_burn`` is false.
+        """
+        return subtitle_track(self.subtitle_text, self.style, self.subtitle_mode,
+                              audio_seconds or sum(self.durations), self.output_seconds(audio_seconds), can_burn)
+
+    def to_dict(self):
+        return {
+            'index': self.index,
+            'name': self.name,
+            'images': self.image_indices,
+            'durations': self.durations,
+            'profile': self.profile.name,
+            'subtitle_mode': self.subtitle_mode if self.subtitle_text else None,
+        }
+
+
+def _text(spec, field):
+    # Text fields may be left out or null, but anything else has to be a string
+    value = spec.get(field)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f'{field} must be a string')
+    return value
+
+
+def _parse_variant(index, spec, image_count):
+    if not isinstance(spec, dict):
+        raise ValueError('must be an object')
+    unknown = set(spec) - _FIELDS
+    if unknown:
+        raise ValueError(f'unknown fields {", ".join(sorted(unknown))}')
+
+    name = str(spec.get('name', f'variant{index:03d}'))
+    if not _NAME.match(name):
+        raise ValueError('name may only contain letters, digits, - and _ (up to 64)')
+
+    images = spec.get('images', list(range(image_count)))
+    if (not isinstance(images, list) or not images
+            or not all(type(i) is int and 0 <= i < image_count for i in images)):
+        raise ValueError(f'images must be a list of image numbers from 0 to {image_count - 1}')
+
+    durations = spec.get('durations', '')
+    durations = parse_durations(json.dumps(durations) if isinstance(durations, list) else str(durations),
+                                len(images))
+
+    subtitle_mode = get_subtitle_mode(_text(spec, 'subtitle_mode'))
+    return Variant(index, name, images, durations, get_profile(_text(spec, 'profile')),
+                   (_text(spec, 'subtitle_text') or '').strip(), subtitle_mode,
+                   get_style(_text(spec, 'subtitle_style')))
+
+
+def parse_variants(value, image_count, max_variants=BATCH_MAX_VARIANTS):
+    """Parse the variants form field, a JSON list of variant objects.
+
+    Each object may set name, images (image numbers in display order),
+    durations, profile, subtitle_text, subtitle_mode and subtitle_style.
+    Raises ValueError naming the first variant that is invalid.
+    """
+    try:
+        specs = json.loads(value or '')
+    except ValueError:
+        raise ValueError('variants must be a JSON list of objects')
+    if not isinstance(specs, list) or not specs:
+        raise ValueError('variants must be a non-empty JSON list of objects')
+    if len(specs) > max_variants:
+        raise ValueError(f'Too many variants ({len(specs)}). Maximum: {max_variants}')
+
+    variants = []
+    for index, spec in enumerate(specs):
+        try:
+            variants.append(_parse_variant(index, spec, image_count))
+        except ValueError as e:
+            raise ValueError(f'Variant {index}: {str(e)}')
+
+    names = [variant.name for variant in variants]
+    if len(set(names)) != len(names):
+        raise ValueError('Variant names must be unique')
+    return variants
+
+
+def write_zip(path, files):
+    """Write (name, path) pairs into a ZIP and return its path.
+
+    MP4 is already compressed, so entries are stored as they are. The archive
+    is written under a temporary name and moved into place, so concurrent
+    readers never see a partial file.
+    """
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, file_path in files:
+            archive.write(file_path, name)
+    os.replace(tmp_path, path)
+    return path
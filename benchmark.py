@@ -0,0 +1,301 @@
+"""Benchmark the /create-video pipeline of main.py and server.py.
+
+Synthetic audio and images are generated locally with FFmpeg's lavfi sources
+and posted in-process, through Flask's test client for main.py and as ASGI
+messages for server.py, so no server needs to be running.
+Each pipeline stage is timed by wrapping the function that implements it, and
+every configuration runs in a fresh Python process so peak RSS figures are
+not polluted by earlier runs.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --apps server --subtitles --images 5,20 --resolutions 1920x1080,3840x2160 --audio 30 --runs 5
+    python benchmark.py --json > bench.json
+
+Run it from the repository root with ffmpeg on PATH.
+"""
+import argparse
+import asyncio
+import functools
+import importlib
+import inspect
+import itertools
+import json
+import math
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+# Stages of the shared pipeline, as (module, attribute, stage name), in the
+# order a request runs through them
+PIPELINE_STAGES = [
+    ('pipeline', 'media_duration', 'probe'),
+    ('pipeline', 'subtitle_track', 'subtitles'),
+    ('pipeline', 'optimize_images', 'preprocess'),
+    ('pipeline', 'run_audio', 'audio'),
+    ('pipeline', 'run_encode', 'encode'),
+]
+
+# Functions timed for each app; only reading the upload differs between them
+STAGES = {
+    'main': [('main', 'receive_multipart', 'upload'), *PIPELINE_STAGES],
+    'server': [('server', 'receive_multipart_async', 'upload'), *PIPELINE_STAGES],
+}
+
+SUBTITLE_TEXT = ('This is a benchmark run. It renders a short slideshow! '
+                 'Each sentence becomes one subtitle. Timing is spread over the audio.')
+ASGI_CHUNK_SIZE = 64 * 1024  # Body bytes per http.request message, as uvicorn sends them
+
+def generate_media(folder, image_count, resolution, audio_seconds):
+    """Create an AAC audio bed and a set of distinct JPEG test images"""
+    audio_path = os.path.join(folder, 'audio.m4a')
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={audio_seconds}',
+        '-c:a', 'aac', '-b:a', '128k', audio_path
+    ], check=True)
+
+    # One frame per second of testsrc2 gives visibly different images
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-f', 'lavfi', '-i', f'testsrc2=size={resolution}:rate=1:duration={image_count}',
+        '-q:v', '2', os.path.join(folder, 'bench%03d.jpg')
+    ], check=True)
+    image_paths = [os.path.join(folder, f'bench{i:03d}.jpg') for i in range(1, image_count + 1)]
+    return audio_path, image_paths
+
+
+class StageTimer:
+    """Temporarily wrap module functions (or coroutine functions) to record how long each call takes"""
+
+    def __init__(self):
+        self.samples = {}
+        self._originals = []
+
+    def wrap(self, module, attribute, stage):
+        original = getattr(module, attribute)
+
+        if inspect.iscoroutinefunction(original):
+            @functools.wraps(original)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            @functools.wraps(original)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+
+        setattr(module, attribute, timed)
+        self._originals.append((module, attribute, original))
+
+    def record(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def restore(self):
+        for module, attribute, original in reversed(self._originals):
+            setattr(module, attribute, original)
+        self._originals = []
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p90': percentile(values, 90),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+def multipart_body(audio_path, image_paths, fields):
+    """Encode an upload once; returns (body, content type)"""
+    files = [open(path, 'rb') for path in [audio_path] + image_paths]
+    try:
+        form = MultiDict(fields)
+        form.add('audio', FileStorage(files[0], 'audio.m4a'))
+        for f in files[1:]:
+            form.add('images', FileStorage(f, os.path.basename(f.name)))
+        boundary, body = encode_multipart(form)
+    finally:
+        for f in files:
+            f.close()
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def wsgi_poster(module):
+    """Post to a Flask app through its test client; returns (status, body)"""
+    client = module.app.test_client()
+
+    def post(path, body, content_type):
+        response = client.post(path, data=body, content_type=content_type)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+    return post
+
+
+def asgi_poster(module):
+    """Post to an ASGI app in-process; the body arrives in chunks as from a server"""
+    async def request(path, body, content_type):
+        chunks = [body[i:i + ASGI_CHUNK_SIZE] for i in range(0, len(body), ASGI_CHUNK_SIZE)] or [b'']
+        messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                    for i, chunk in enumerate(chunks)]
+        sent = []
+        finished = asyncio.Event()
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await finished.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': path, 'query_string': b'', 'headers': [
+            (b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('latin-1'))]}
+        await module.app(scope, receive, send)
+        finished.set()
+        return sent[0]['status'], b''.join(message.get('body', b'') for message in sent[1:])
+
+    return lambda path, body, content_type: asyncio.run(request(path, body, content_type))
+
+
+def run_config(config):
+    """Run one configuration in this process and return its measurements"""
+    if not config['cache']:
+        os.environ['CACHE_MAX_MB'] = '0'
+    module = importlib.import_module(config['app'])
+
+    timer = StageTimer()
+    for module_name, attribute, stage in STAGES[config['app']]:
+        timer.wrap(importlib.import_module(module_name), attribute, stage)
+
+    folder = tempfile.mkdtemp(prefix='bench-')
+    errors = 0
+    try:
+        audio_path, image_paths = generate_media(
+            folder, config['images'], config['resolution'], config['audio'])
+        fields = {'subtitle_text': SUBTITLE_TEXT, 'spread_over_audio': 'true'} if config['subtitles'] else {}
+        upload, content_type = multipart_body(audio_path, image_paths, fields)
+        post = asgi_poster(module) if config['app'] == 'server' else wsgi_poster(module)
+
+        wall_start = time.perf_counter()
+        for _ in range(config['runs']):
+            start = time.perf_counter()
+            status, body = post('/create-video', upload, content_type)
+            timer.record('total', time.perf_counter() - start)
+            if status != 200 or not body:
+                errors += 1
+                print(f'Request failed ({status}): {body[:500]!r}', file=sys.stderr)
+        wall = time.perf_counter() - wall_start
+    finally:
+        timer.restore()
+        shutil.rmtree(folder, ignore_errors=True)
+
+    # ru_maxrss is reported in kilobytes on Linux
+    return {
+        'config': config,
+        'stages': {stage: summarize(values) for stage, values in timer.samples.items()},
+        'throughput_rps': config['runs'] / wall if wall else None,
+        'errors': errors,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def run_isolated(config):
+    """Run one configuration in a fresh interpreter and parse its JSON result"""
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--single', json.dumps(config)],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'Benchmark run failed for {config}:\n{result.stderr[-2000:]}')
+    return json.loads(result.stdout)
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.0f}'
+
+
+def print_report(results):
+    for result in results:
+        config = result['config']
+        print(f"\n{config['app']}.py  images={config['images']}  resolution={config['resolution']}  "
+              f"audio={config['audio']}s  runs={config['runs']}{'  subtitles' if config['subtitles'] else ''}")
+        print(f"  throughput {result['throughput_rps']:.3f} req/s, errors {result['errors']}, "
+              f"peak RSS {result['peak_rss_mb']:.0f} MB (ffmpeg children {result['peak_child_rss_mb']:.0f} MB)")
+        print(f"  {'stage':<12}{'n':>5}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for stage, stats in result['stages'].items():
+            print(f"  {stage:<12}{stats['count']:>5}{format_ms(stats['p50']):>10}{format_ms(stats['p90']):>10}"
+                  f"{format_ms(stats['p99']):>10}{format_ms(stats['max']):>10}")
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the /create-video pipeline')
+    parser.add_argument('--apps', default='main,server', help='Apps to benchmark (main, server)')
+    parser.add_argument('--images', default='3,10', help='Comma separated image counts')
+    parser.add_argument('--resolutions', default='1280x720,3840x2160', help='Comma separated WxH image sizes')
+    parser.add_argument('--audio', default='10,60', help='Comma separated audio lengths in seconds')
+    parser.add_argument('--runs', type=int, default=3, help='Requests per configuration')
+    parser.add_argument('--subtitles', action='store_true',
+                        help='Send subtitle text and spread the images over the audio')
+    parser.add_argument('--cache', action='store_true', help='Leave the media cache enabled')
+    parser.add_argument('--json', action='store_true', help='Print raw JSON results')
+    parser.add_argument('--single', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        # The apps print progress to stdout, so keep it clear for the result
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_config(json.loads(args.single))
+        sys.stdout = stdout
+        print(json.dumps(result))
+        return
+
+    results = []
+    for app_name, images, resolution, audio in itertools.product(
+            parse_list(args.apps), parse_list(args.images, int),
+            parse_list(args.resolutions), parse_list(args.audio, int)):
+        config = {'app': app_name, 'images': images, 'resolution': resolution,
+                  'audio': audio, 'runs': args.runs, 'subtitles': args.subtitles, 'cache': args.cache}
+        print(f'Running {config}', file=sys.stderr)
+        results.append(run_isolated(config))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_FOLDER = os.environ.get('CACHE_FOLDER', 'cache')
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_MB', 512)) * 1024 * 1024  # 0 disables caching
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(namespace, *parts):
+    """Build a cache key from a namespace and any number of string parts"""
+    digest = hashlib.sha256(namespace.encode())
+    for part in parts:
+        digest.update(b'\0')
+        digest.update(str(part).encode())
+    return f'{namespace}-{digest.hexdigest()}'
+
+
+def _link_or_copy(src, dest):
+    # Hard links make hits free; fall back to a copy across filesystems
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+
+class ContentCache:
+    """Size-bounded, least-recently-used store of files keyed by content hash.
+
+    Files are hard linked in and out of the cache, so callers must replace
+    files (write elsewhere and rename) rather than modify them in place.
+    """
+
+    def __init__(self, root=CACHE_FOLDER, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._index = OrderedDict()  # key -> size in bytes, oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def _load(self):
+        # Rebuild the LRU index from whatever survived a restart, once
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.root):
+            path = self._path(name)
+            if name.startswith('.tmp-'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._index[name] = size
+            self._size += size
+
+    def get(self, key, dest):
+        """Materialize the cached file for ``key`` at ``dest``; return True on a hit"""
+        if not self.enabled:
+            return False
+
+        namespace = key.split('-', 1)[0]
+        path = self._path(key)
+        with self._lock:
+            self._load()
+            hit = key in self._index
+            if hit:
+                self._index.move_to_end(key)
+
+        # The link or copy runs outside the lock, so a copy across
+        # filesystems doesn't hold up every other hit and put. An entry
+        # evicted meanwhile stays readable until it is unlinked.
+        if hit:
+            try:
+                _link_or_copy(path, dest)
+                os.utime(path)
+            except FileNotFoundError:
+                hit = False
+
+        with self._lock:
+            if hit:
+                self.hits[namespace] += 1
+            else:
+                if key in self._index and not os.path.exists(path):
+                    self._size -= self._index.pop(key)
+                self.misses[namespace] += 1
+        return hit
+
+    def put(self, key, src):
+        """Store ``src`` under ``key`` and evict old entries beyond the size limit"""
+        if not self.enabled:
+            return
+
+        size = os.path.getsize(src)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._load()
+            if key in self._index:
+                self._index.move_to_end(key)
+                return
+
+        # Copied under a temporary name outside the lock; only the rename
+        # into place and the index update are done while holding it
+        tmp_path = self._path(f'.tmp-{uuid.uuid4().hex}')
+        try:
+            _link_or_copy(src, tmp_path)
+            with self._lock:
+                if key in self._index:
+                    # Another put of the same content won the race
+                    self._index.move_to_end(key)
+                    os.remove(tmp_path)
+                    return
+                os.replace(tmp_path, self._path(key))
+                self._index[key] = size
+                self._size += size
+                self._evict()
+        except OSError as e:
+            logger.warning(f'Could not cache {src}: {str(e)}')
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._index),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+            }
+
+
+media_cache = ContentCache()
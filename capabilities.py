@@ -0,0 +1,144 @@
+"""Detect what the installed FFmpeg can do, once per process.
+
+The version, encoder and filter lists are read when the app starts and kept
+in memory, so requests consult a table instead of forking ``ffmpeg -version``.
+The table is probed again when the ffmpeg binary can't be started, and
+periodically while FFmpeg is missing, so a fixed install is picked up without
+a restart. An encode that merely fails (bad input) leaves it alone.
+"""
+import logging
+import re
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROBE_TIMEOUT = 10
+RETRY_INTERVAL = 30  # Seconds between probes while FFmpeg is unavailable
+
+# Software encoders in order of preference. mpeg4 is built into every FFmpeg
+# and is the last resort when no H.264 encoder was compiled in.
+VIDEO_ENCODERS = ('libx264', 'libopenh264', 'mpeg4')
+AUDIO_ENCODERS = ('aac', 'libfdk_aac')
+
+# Filters the pipeline uses when they are available
+OPTIONAL_FILTERS = ('subtitles', 'ass', 'loudnorm')
+
+# Rows of `ffmpeg -encoders` / `ffmpeg -filters`: a block of flags, then the name
+_LIST_ROW = re.compile(r'^\s*[A-Z.|]{3,6}\s+(\S+)\s')
+
+
+class Capabilities:
+    """What one probe of the ffmpeg and ffprobe binaries found"""
+
+    def __init__(self, ffmpeg_version=None, ffprobe_version=None, encoders=(), filters=(), error=None):
+        self.ffmpeg_version = ffmpeg_version
+        self.ffprobe_version = ffprobe_version
+        self.encoders = frozenset(encoders)
+        self.filters = frozenset(filters)
+        self.error = error
+        self.probed_at = time.time()
+
+    @property
+    def ffmpeg_available(self):
+        return self.ffmpeg_version is not None
+
+    @property
+    def ffprobe_available(self):
+        return self.ffprobe_version is not None
+
+    def has_encoder(self, name):
+        return name in self.encoders
+
+    def has_filter(self, name):
+        return name in self.filters
+
+    def video_encoder(self):
+        """The preferred video encoder this build has (libx264 if unknown)"""
+        return next((name for name in VIDEO_ENCODERS if self.has_encoder(name)), VIDEO_ENCODERS[0])
+
+    def audio_encoder(self):
+        """The preferred AAC encoder this build has (aac if unknown)"""
+        return next((name for name in AUDIO_ENCODERS if self.has_encoder(name)), AUDIO_ENCODERS[0])
+
+    def to_dict(self):
+        return {
+            'ffmpeg_available': self.ffmpeg_available,
+            'ffmpeg_version': self.ffmpeg_version,
+            'ffprobe_version': self.ffprobe_version,
+            'video_encoder': self.video_encoder() if self.ffmpeg_available else None,
+            'audio_encoder': self.audio_encoder() if self.ffmpeg_available else None,
+            'encoders': {name: self.has_encoder(name) for name in VIDEO_ENCODERS + AUDIO_ENCODERS},
+            'filters': {name: self.has_filter(name) for name in OPTIONAL_FILTERS},
+            'probed_at': self.probed_at,
+            'error': self.error,
+        }
+
+
+def _run(cmd):
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(cmd)} exited with {result.returncode}')
+    return result.stdout
+
+
+def _first_line(output):
+    return output.strip().split('\n')[0] if output.strip() else None
+
+
+def _list_names(output):
+    names = set()
+    for line in output.splitlines():
+        match = _LIST_ROW.match(line)
+        if match and match.group(1) != '=':
+            names.add(match.group(1))
+    return names
+
+
+def probe_capabilities():
+    """Run the ffmpeg and ffprobe binaries and collect what they support"""
+    try:
+        ffmpeg_version = _first_line(_run(['ffmpeg', '-version']))
+        encoders = _list_names(_run(['ffmpeg', '-hide_banner', '-encoders']))
+        filters = _list_names(_run(['ffmpeg', '-hide_banner', '-filters']))
+    except Exception as e:
+        logger.error(f'FFmpeg not available: {str(e)}')
+        return Capabilities(error=str(e))
+
+    try:
+        ffprobe_version = _first_line(_run(['ffprobe', '-version']))
+    except Exception as e:
+        logger.warning(f'ffprobe not available: {str(e)}')
+        ffprobe_version = None
+
+    capabilities = Capabilities(ffmpeg_version, ffprobe_version, encoders, filters)
+    logger.info(f'{ffmpeg_version}; video encoder {capabilities.video_encoder()}, '
+                f'audio encoder {capabilities.audio_encoder()}, '
+                f'filters {", ".join(name for name in OPTIONAL_FILTERS if name in filters) or "none"}')
+    return capabilities
+
+
+_capabilities = None
+_stale = False
+_lock = threading.Lock()
+
+
+def get_capabilities(refresh=False):
+    """Return the cached capability table, probing first if it is missing or stale"""
+    global _capabilities, _stale
+    with _lock:
+        capabilities = _capabilities
+        retry_due = (capabilities is not None and not capabilities.ffmpeg_available
+                     and time.time() - capabilities.probed_at > RETRY_INTERVAL)
+        if refresh or _stale or capabilities is None or retry_due:
+            _capabilities = capabilities = probe_capabilities()
+            _stale = False
+        return capabilities
+
+
+def invalidate():
+    """Probe again on the next lookup, e.g. after the ffmpeg binary could not be started"""
+    global _stale
+    with _lock:
+        _stale = True
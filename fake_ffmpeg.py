@@ -0,0 +1,239 @@
+"""A stand-in for the ffmpeg binary with a tunable cost, for load tests.
+
+It accepts the command lines the server builds and behaves like FFmpeg from
+the outside: it answers the capability probes, reports ``-progress`` blocks
+on the requested pipe, writes the output file (or streams bytes to stdout)
+and exits 0. Instead of encoding, it takes as long, burns as much CPU and
+holds as much memory as the selected profile says, so queueing and
+scheduling can be measured without real encodes and without noise from the
+codec.
+
+The output length comes from the ``duration`` lines of a concat script, a
+WAV input's header or ``-t``, and the run takes that length divided by the
+profile's speed. Image conversions copy the input, so the server's image
+handling keeps working.
+
+Settings, read from the environment:
+    FAKE_FFMPEG_PROFILE        one of PROFILES (default ``standard``)
+    FAKE_FFMPEG_SPEED          times realtime for video (0 for no delay)
+    FAKE_FFMPEG_AUDIO_SPEED    times realtime for audio-only runs and stream copies
+    FAKE_FFMPEG_STARTUP        fixed seconds before any output
+    FAKE_FFMPEG_CPU            share of one core kept busy, 0 to 1
+    FAKE_FFMPEG_MEMORY_MB      memory held for the whole run
+    FAKE_FFMPEG_FAILURE_RATE   share of runs that exit with an error
+    FAKE_FFMPEG_SECONDS        output length when the inputs don't say
+
+Failures are picked by a hash of the command line, so the same request mix
+fails the same way every time. The load test puts a wrapper named ``ffmpeg``
+on PATH; by hand:
+    printf '#!/bin/sh\\nexec python %s "$@"\\n' "$PWD/fake_ffmpeg.py" > bin/ffmpeg
+"""
+import hashlib
+import json
+import os
+import shutil
+import sys
+import time
+import wave
+
+# speed: times realtime for video encodes, None to finish at once;
+# audio_speed: the same for audio-only runs and stream copies;
+# hang: never finish, to exercise encode timeouts
+PROFILES = {
+    'instant': {'speed': None, 'audio_speed': None, 'startup': 0, 'cpu': 0, 'memory_mb': 0},
+    'fast': {'speed': 30, 'audio_speed': 200, 'startup': 0.05, 'cpu': 0.5, 'memory_mb': 40},
+    'standard': {'speed': 8, 'audio_speed': 100, 'startup': 0.1, 'cpu': 1, 'memory_mb': 150},
+    'slow': {'speed': 1.5, 'audio_speed': 40, 'startup': 0.3, 'cpu': 1, 'memory_mb': 300},
+    'hog': {'speed': 4, 'audio_speed': 40, 'startup': 0.1, 'cpu': 1, 'memory_mb': 450},
+    'flaky': {'speed': 8, 'audio_speed': 100, 'startup': 0.1, 'cpu': 1, 'memory_mb': 150, 'failure_rate': 0.1},
+    'hang': {'speed': 8, 'audio_speed': 100, 'startup': 0.1, 'cpu': 0, 'memory_mb': 50, 'hang': True},
+}
+
+DEFAULT_SECONDS = 10
+TICK = 0.5  # Seconds between progress blocks, as FFmpeg's default
+OUTPUT_BYTES_PER_SECOND = 16 * 1024  # Size of the placeholder output
+
+VERSION = 'ffmpeg version 6.0-fake Copyright (c) 2000-2023 the FFmpeg developers (load test stand-in)'
+ENCODERS = [
+    ' V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)',
+    ' V....D mpeg4                MPEG-4 part 2',
+    ' A....D aac                  AAC (Advanced Audio Coding)',
+    ' S..... mov_text             3GPP Timed Text subtitle',
+]
+FILTERS = [
+    ' ... ass               V->V       Render ASS subtitles onto input video using the libass library.',
+    ' ... subtitles         V->V       Render text subtitles onto input video using the libass library.',
+    ' ... loudnorm          A->A       EBU R128 loudness normalization',
+]
+LOUDNESS = {'input_i': '-23.00', 'input_tp': '-5.00', 'input_lra': '4.00', 'input_thresh': '-33.00',
+            'output_i': '-16.00', 'output_tp': '-1.50', 'output_lra': '4.00', 'output_thresh': '-26.00',
+            'normalization_type': 'dynamic', 'target_offset': '0.00'}
+
+
+def load_profile(environ=os.environ):
+    """The selected profile with any FAKE_FFMPEG_* overrides applied"""
+    name = environ.get('FAKE_FFMPEG_PROFILE', 'standard')
+    if name not in PROFILES:
+        raise ValueError(f'Unknown fake ffmpeg profile: {name}')
+    profile = {'failure_rate': 0, 'hang': False, **PROFILES[name]}
+    for key in ('speed', 'audio_speed', 'startup', 'cpu', 'memory_mb', 'failure_rate'):
+        value = environ.get(f'FAKE_FFMPEG_{key.upper()}')
+        if value is not None:
+            profile[key] = float(value)
+            if key.endswith('speed') and not profile[key]:
+                profile[key] = None
+    return profile
+
+
+def _option(args, name):
+    values = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == name]
+    return values[-1] if values else None
+
+
+def _inputs(args):
+    # (format, path) of every -i, with the -f that came before it
+    inputs, input_format = [], None
+    for i, arg in enumerate(args[:-1]):
+        if arg == '-f':
+            input_format = args[i + 1]
+        elif arg == '-i':
+            inputs.append((input_format, args[i + 1]))
+            input_format = None
+    return inputs
+
+
+def _concat_seconds(path):
+    seconds = 0.0
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.startswith('duration '):
+                seconds += float(line.split()[1])
+    return seconds
+
+
+def _wav_seconds(path):
+    with wave.open(path, 'rb') as f:
+        return f.getnframes() / f.getframerate()
+
+
+def output_seconds(args):
+    """How long the output would be, from the inputs as far as they tell"""
+    limit = _option(args, '-t')
+    if limit:
+        return float(limit)
+    for input_format, path in _inputs(args):
+        try:
+            if input_format == 'concat':
+                seconds = _concat_seconds(path)
+                if seconds:
+                    return seconds
+            elif path.lower().endswith('.wav'):
+                return _wav_seconds(path)
+        except (OSError, ValueError, wave.Error):
+            continue
+    return float(os.environ.get('FAKE_FFMPEG_SECONDS', DEFAULT_SECONDS))
+
+
+def _fails(args, rate):
+    if rate <= 0:
+        return False
+    digest = hashlib.sha1(' '.join(args).encode('utf-8')).digest()
+    return int.from_bytes(digest[:4], 'big') / 2 ** 32 < rate
+
+
+def _hold_memory(megabytes):
+    buffer = bytearray(int(megabytes * 1024 * 1024))
+    buffer[::4096] = b'\x01' * len(range(0, len(buffer), 4096))  # Touch every page so it is resident
+    return buffer
+
+
+def _spend(seconds, cpu):
+    # Busy-wait for the cpu share of the interval and sleep for the rest
+    busy_until = time.perf_counter() + seconds * cpu
+    while time.perf_counter() < busy_until:
+        pass
+    time.sleep(seconds * (1 - cpu))
+
+
+def _progress_block(seconds, frame, speed, done):
+    microseconds = int(seconds * 1000000)
+    whole, fraction = divmod(microseconds, 1000000)
+    out_time = f'{whole // 3600:02d}:{whole // 60 % 60:02d}:{whole % 60:02d}.{fraction:06d}'
+    return (f'frame={frame}\nfps=0.00\nout_time_us={microseconds}\nout_time_ms={microseconds}\n'
+            f'out_time={out_time}\nspeed={speed:.3g}x\nprogress={"end" if done else "continue"}\n')
+
+
+def _open_progress(args):
+    target = _option(args, '-progress')
+    if target and target.startswith('pipe:'):
+        return os.fdopen(int(target[5:]), 'w', buffering=1)
+    return None
+
+
+def _write_output(args, path, seconds):
+    if path in ('-', os.devnull) or _option(args, '-f') == 'null':
+        return
+    if _option(args, '-f') == 'image2' or path.lower().endswith(('.jpg', '.jpeg', '.png')):
+        shutil.copyfile(_inputs(args)[0][1], path)
+        return
+    with open(path, 'wb') as f:
+        f.write(b'\0' * int(seconds * OUTPUT_BYTES_PER_SECOND))
+
+
+def encode(args, profile):
+    """Pretend to run one FFmpeg command; returns the exit code"""
+    output = args[-1]
+    light = '-vn' in args or _option(args, '-c') == 'copy'  # No video encode, e.g. audio or a segment join
+    seconds = output_seconds(args)
+    speed = profile['audio_speed'] if light else profile['speed']
+    wall = seconds / speed if speed else 0
+    progress = _open_progress(args)
+    to_stdout = output == 'pipe:1'
+    memory = _hold_memory(profile['memory_mb']) if profile['memory_mb'] else None
+
+    print(f'Input #0, fake, from {_inputs(args)[0][1] if _inputs(args) else "?"}:', file=sys.stderr)
+    _spend(profile['startup'], profile['cpu'])
+    started = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - started
+        done = elapsed >= wall and not profile['hang']
+        position = seconds if done else min(seconds, seconds * elapsed / wall if wall else 0)
+        if progress:
+            progress.write(_progress_block(position, int(position * 25), speed or 0, done))
+        if to_stdout:
+            sys.stdout.buffer.write(b'\0' * int(TICK * OUTPUT_BYTES_PER_SECOND))
+            sys.stdout.buffer.flush()
+        if done:
+            break
+        _spend(min(TICK, wall - elapsed) if wall > elapsed else TICK, profile['cpu'])
+    del memory
+
+    if _fails(args, profile['failure_rate']):
+        print(f'{output}: Conversion failed! (fake ffmpeg failure)', file=sys.stderr)
+        return 1
+    if any('print_format=json' in arg for arg in args):
+        print('[Parsed_loudnorm_0 @ 0x0]\n' + json.dumps(LOUDNESS, indent=1), file=sys.stderr)
+    if not to_stdout:
+        _write_output(args, output, seconds)
+    return 0
+
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
+    if '-version' in args:
+        print(VERSION)
+        return 0
+    if '-encoders' in args:
+        print('Encoders:\n ------\n' + '\n'.join(ENCODERS))
+        return 0
+    if '-filters' in args:
+        print('Filters:\n ---\n' + '\n'.join(FILTERS))
+        return 0
+    if not args:
+        print('fake ffmpeg: no command given', file=sys.stderr)
+        return 1
+    return encode(args, load_profile())
+
+
+if __name__ == '__main__':
+    sys.exit(main())
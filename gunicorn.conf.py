@@ -3,7 +3,11 @@ bind = "0.0.0.0:10000"
 workers = 1  # Single worker to minimize memory usage
 timeout = 300  # 5 minutes for video processing
 keepalive = 2
-max_requests = 50  # Restart worker after 50 requests to prevent memory leaks
-max_requests_jitter = 10
-worker_class = "sync"
-worker_connections = 50  # Limit concurrent connections
+# Background jobs live in worker memory, so recycling the worker after a fixed
+# number of requests would drop queued encodes (status polls count as requests)
+max_requests = 0
+# Threads let status polls, SSE progress streams and downloads be served while
+# another request is encoding. Each open SSE stream holds a thread, so main.py
+# keeps at most MAX_EVENT_STREAMS of them open
+worker_class = "gthread"
+threads = 4
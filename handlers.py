@@ -0,0 +1,323 @@
+"""The HTTP API, shared by main.py (Flask over WSGI) and server.py (ASGI).
+
+Each handler takes a request and returns a Reply; a front end only adapts
+its own request object and sends the Reply back. Handlers block while they
+wait for admission and FFmpeg, so server.py runs them in worker threads.
+Routes registered with ``upload=True`` get the multipart upload already
+received, as ``upload``: main.py reads it with ``receive_upload`` and
+server.py on its event loop. The request object a handler gets has:
+
+    args                                the query string, as a MultiDict
+    content_length                      the declared body size, or None
+
+and receive_upload also needs:
+
+    receive_multipart(folder, rules)    stream the multipart body into
+                                        ``folder``; returns (form, files)
+"""
+import json
+import logging
+
+from werkzeug.datastructures import CombinedMultiDict
+
+from admission import admission
+from cache import media_cache
+from capabilities import get_capabilities
+from jobs import JobQueue
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import REGISTRY, REQUESTS, STAGE_SECONDS
+from pipeline import (ADMISSION_TIMEOUT, ENCODE_TIMEOUT, EVENTS_KEEPALIVE, FFMPEG_WORKERS, JOB_QUEUE_SIZE, JOB_TTL,
+                      MAX_REQUEST_SIZE, UPLOAD_RULES, RequestError, batch_zip, debug_info, error_response,
+                      index_page, job_download, job_event, job_links, job_status, plan_batch, plan_render,
+                      prepare_stream, prepare_stream_inputs, profiles_info, register_job_metrics, render_plan,
+                      run_batch, session_job, sessions)
+from progress import Progress
+from streaming import stream_ffmpeg
+from uploads import UploadError
+
+logger = logging.getLogger(__name__)
+
+# Each worker thread runs one FFmpeg encode at a time
+job_queue = JobQueue(workers=FFMPEG_WORKERS, max_pending=JOB_QUEUE_SIZE, ttl=JOB_TTL)
+register_job_metrics(job_queue)
+
+
+class Reply:
+    """What a handler answers: a status, headers and a body.
+
+    The body is ``body`` (text or bytes), the file at ``path`` or the items
+    of the iterator ``chunks``. ``async_chunks`` is the same body as an async
+    iterator that waits on the event loop, which server.py sends instead of
+    ``chunks``. ``download_name`` sends it as an attachment.
+    ``on_close`` runs once the response has been sent or the client has gone
+    away, even if the body was never started.
+    """
+
+    def __init__(self, body='', status=200, headers=None, mimetype='text/html; charset=utf-8', path=None,
+                 chunks=None, async_chunks=None, download_name=None, on_close=None):
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+        self.mimetype = mimetype
+        self.path = path
+        self.chunks = chunks
+        self.async_chunks = async_chunks
+        self.download_name = download_name
+        self.on_close = on_close
+
+
+def json_reply(data, status=200, headers=None):
+    return Reply(json.dumps(data) + '\n', status, headers, 'application/json')
+
+
+def failed(error):
+    """JSON error reply for a request that failed with ``error``"""
+    body, status, headers = error_response(error)
+    return json_reply(body, status, headers)
+
+
+def file_reply(path, download_name, on_close=None, mimetype='video/mp4'):
+    """Send a file from disk and run ``on_close`` once the response is closed"""
+    return Reply(mimetype=mimetype, path=path, download_name=download_name, on_close=on_close)
+
+
+ROUTES = []
+
+
+def route(rule, methods=('GET',), upload=False):
+    """Register a handler for a URL rule; ``<name>`` and ``<int:name>`` parts become arguments.
+
+    With ``upload`` the handler is also passed the received upload as
+    (session, options, files); a request whose upload fails gets the error
+    without the handler being called.
+    """
+    def register(handler):
+        ROUTES.append((rule, methods, handler, upload))
+        return handler
+    return register
+
+
+def begin_upload(request):
+    """Check that an upload can be rendered and create the session folder it goes into"""
+    # Check if FFmpeg is available (probed at startup, not per request)
+    if not get_capabilities().ffmpeg_available:
+        raise RequestError('FFmpeg not available on server', status=500)
+    if (request.content_length or 0) > MAX_REQUEST_SIZE:
+        raise UploadError('Request too large', status=413)
+    # Reserve room for the upload and the video
+    return sessions.create(2 * (request.content_length or 0))
+
+
+def upload_options(request, form):
+    """The query string and form fields of an upload, the query string first"""
+    return CombinedMultiDict([request.args, form])
+
+
+def receive_upload(request):
+    """Create a session folder and stream the multipart upload into it.
+
+    Returns (session, options, files).
+    """
+    session = begin_upload(request)
+    try:
+        # Stream uploads straight into the session folder, enforcing size
+        # limits chunk by chunk and checking formats by their magic bytes
+        with STAGE_SECONDS.time(stage='upload'):
+            form, files = request.receive_multipart(session.path, UPLOAD_RULES)
+    except BaseException:
+        sessions.release(session)
+        raise
+    return session, upload_options(request, form), files
+
+
+def stream_video(session, plan):
+    """Encode to fragmented MP4 and send it to the client while FFmpeg runs.
+
+    The reply takes over the caller's reference to ``session``.
+    """
+    ffmpeg_cmd, video_key, output_video_path = prepare_stream(session, plan)
+    download_name = f'video_{session.id}.mp4'
+
+    if media_cache.get(video_key, output_video_path):
+        logger.info(f'Serving cached video for {session.path}')
+        return file_reply(output_video_path, download_name, on_close=lambda: sessions.release(session))
+
+    # The admission ticket is held until the stream is closed and FFmpeg has exited
+    ticket = admission.acquire(plan.cost, ADMISSION_TIMEOUT)
+    try:
+        prepare_stream_inputs(plan)
+    except Exception:
+        admission.release(ticket)
+        raise
+
+    def finish():
+        admission.release(ticket)
+        sessions.release(session)
+
+    logger.info(f'Streaming FFmpeg command: {" ".join(ffmpeg_cmd)}')
+    body = stream_ffmpeg(
+        ffmpeg_cmd,
+        ENCODE_TIMEOUT,
+        copy_path=output_video_path,
+        on_success=lambda: media_cache.put(video_key, output_video_path)
+    )
+    return Reply(mimetype='video/mp4', chunks=body, download_name=download_name, on_close=finish)
+
+
+@route('/')
+def hello_world(request):
+    return Reply(index_page())
+
+
+@route('/create-video', methods=('POST',), upload=True)
+def create_video(request, upload):
+    session, options, files = upload
+    try:
+        plan = plan_render(session, options, files)
+
+        if plan.mode == 'async':
+            REQUESTS.inc(mode='async')
+            progress = Progress(total_seconds=plan.output_seconds)
+            job = job_queue.submit(
+                session_job, render_plan, session, plan, progress,
+                on_expire=lambda job: sessions.discard(session),
+                progress=progress
+            )
+            return json_reply(job_links(job), 202)
+
+        if plan.mode == 'stream':
+            REQUESTS.inc(mode='stream')
+            return stream_video(session, plan)
+
+        REQUESTS.inc(mode='sync')
+        output_video_path = render_plan(session.path, plan, admission_timeout=ADMISSION_TIMEOUT)
+
+        # Send the video file; the session folder goes when the body is closed
+        sessions.measure(session)
+        return file_reply(output_video_path, f'video_{session.id}.mp4',
+                          on_close=lambda: sessions.release(session))
+    except Exception as e:
+        sessions.release(session)
+        return failed(e)
+
+
+@route('/batch', methods=('POST',), upload=True)
+def create_batch(request, upload):
+    """Render several variants of one uploaded set of audio and images"""
+    # The shared audio and images arrive once for every variant
+    session, options, files = upload
+    try:
+        plan = plan_batch(options, files)
+
+        if plan.output == 'zip':
+            REQUESTS.inc(mode='batch_zip')
+            records = run_batch(session.path, plan, admission_timeout=ADMISSION_TIMEOUT)
+            zip_path = batch_zip(session.path, records)
+            sessions.measure(session)
+            return file_reply(zip_path, f'videos_{session.id}.zip',
+                              on_close=lambda: sessions.release(session), mimetype='application/zip')
+
+        REQUESTS.inc(mode='batch')
+        progress = Progress(total_seconds=plan.output_seconds)
+        job = job_queue.submit(
+            session_job, run_batch, session, plan, progress,
+            on_expire=lambda job: sessions.discard(session),
+            progress=progress
+        )
+        return json_reply(job_links(job, plan), 202)
+    except Exception as e:
+        sessions.release(session)
+        return failed(e)
+
+
+@route('/jobs/<job_id>')
+def get_job(request, job_id):
+    """Report the state of a background encode job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return json_reply({'error': 'Job not found'}, 404)
+    return json_reply(job_status(job, job_queue))
+
+
+def events(job):
+    """A job's progress events, waiting for each update in the calling thread"""
+    while True:
+        version = job.progress.version
+        state = job.state
+        event, finished = job_event(job)
+        yield event
+        if finished:
+            return
+
+        # Wait for the next update; the comments keep idle connections open
+        # and the state check picks up a queued job starting to run
+        while job.progress.wait(version, timeout=EVENTS_KEEPALIVE) == version and job.state == state:
+            yield ': keepalive\n\n'
+
+
+async def events_async(job):
+    """``events`` for an event loop, where waiting for an update holds no thread"""
+    while True:
+        version = job.progress.version
+        state = job.state
+        event, finished = job_event(job)
+        yield event
+        if finished:
+            return
+        while await job.progress.wait_async(version, timeout=EVENTS_KEEPALIVE) == version and job.state == state:
+            yield ': keepalive\n\n'
+
+
+@route('/jobs/<job_id>/events')
+def job_events(request, job_id):
+    """Server-Sent Events stream of a job's progress, ending when the job finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return json_reply({'error': 'Job not found'}, 404)
+
+    return Reply(mimetype='text/event-stream', chunks=events(job), async_chunks=events_async(job), headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering events
+    })
+
+
+def download(job, index=None):
+    """Send a finished job's file, holding its session until the download is closed"""
+    try:
+        path, download_name, mimetype, session = job_download(job, index)
+    except RequestError as e:
+        return failed(e)
+    return file_reply(path, download_name, on_close=lambda: sessions.release(session), mimetype=mimetype)
+
+
+@route('/jobs/<job_id>/result')
+def job_result(request, job_id):
+    """Download the MP4 produced by a finished job, or a batch job's ZIP"""
+    return download(job_queue.get(job_id))
+
+
+@route('/jobs/<job_id>/variants/<int:index>')
+def job_variant(request, job_id, index):
+    """Download one variant's MP4 from a finished batch job"""
+    return download(job_queue.get(job_id), index)
+
+
+@route('/profiles')
+def list_profiles(request):
+    """List the encoder profiles that can be passed as the profile parameter"""
+    return json_reply(profiles_info())
+
+
+@route('/metrics')
+def metrics(request):
+    """Prometheus metrics for the pipeline, job queue, FFmpeg and temp storage"""
+    return Reply(REGISTRY.render(), mimetype=METRICS_CONTENT_TYPE)
+
+
+@route('/debug')
+def debug(request):
+    """Debug endpoint to check server status"""
+    try:
+        return json_reply(debug_info())
+    except Exception as e:
+        return json_reply({'error': f'Debug error: {str(e)}'}, 500)
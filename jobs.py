@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Job states
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+PRUNE_INTERVAL = 60  # Seconds between sweeps for expired jobs
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot accept another job"""
+
+
+class Job:
+    """A single unit of background work and its outcome"""
+
+    def __init__(self, func, args, kwargs, on_expire=None, progress=None):
+        self.id = str(uuid.uuid4())
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_expire = on_expire
+        self.progress = progress
+        self.state = JOB_QUEUED
+        self.result = None
+        self.error = None
+        self.details = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.state in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self):
+        info = {
+            'job_id': self.id,
+            'state': self.state,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.error:
+            info['error'] = self.error
+        if self.details:
+            info['details'] = self.details
+        if self.progress:
+            info['progress'] = self.progress.to_dict()
+        return info
+
+
+class JobQueue:
+    """Bounded queue feeding a fixed pool of worker threads.
+
+    Each worker drives one FFmpeg process at a time, so ``workers`` caps the
+    number of concurrent encodes and ``max_pending`` caps how many jobs may
+    wait for a free worker before submissions are rejected.
+    """
+
+    def __init__(self, workers=1, max_pending=4, ttl=1800):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        # Threads are started lazily so they are created inside the gunicorn
+        # worker process rather than in a parent that forks afterwards
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            # Expired jobs are swept on a timer too, so their session folders
+            # are deleted even when no new jobs arrive
+            threading.Thread(target=self._prune_periodically, name='job-pruner', daemon=True).start()
+
+    def _prune_periodically(self):
+        while True:
+            time.sleep(PRUNE_INTERVAL)
+            self.prune()
+
+    def submit(self, func, *args, on_expire=None, progress=None, **kwargs):
+        """Queue ``func(*args, **kwargs)`` and return its Job, or raise QueueFullError.
+
+        ``progress`` is an optional object that ``func`` reports to; it is
+        exposed on the job and told when the job finishes.
+        """
+        self._ensure_started()
+        self.prune()
+
+        job = Job(func, args, kwargs, on_expire=on_expire, progress=progress)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFullError(f'Job queue is full ({self.max_pending} pending)')
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def pending(self):
+        """Number of jobs waiting for a free worker"""
+        return self._queue.qsize()
+
+    def running(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.state == JOB_RUNNING)
+
+    def prune(self):
+        """Forget finished jobs older than the TTL and run their expiry hooks"""
+        now = time.time()
+        with self._lock:
+            expired = [job for job in self._jobs.values()
+                       if job.finished and now - job.finished_at > self.ttl]
+            for job in expired:
+                del self._jobs[job.id]
+
+        for job in expired:
+            if job.on_expire:
+                try:
+                    job.on_expire(job)
+                except Exception as e:
+                    logger.error(f'Job {job.id} expiry hook failed: {str(e)}')
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.state = JOB_RUNNING
+            job.started_at = time.time()
+            try:
+                job.result = job.func(*job.args, **job.kwargs)
+                job.state = JOB_DONE
+            except Exception as e:
+                logger.error(f'Job {job.id} failed: {str(e)}')
+                job.error = str(e)
+                job.details = getattr(e, 'details', None)
+                job.state = JOB_FAILED
+            finally:
+                job.finished_at = time.time()
+                if job.progress:
+                    job.progress.finish(job.state == JOB_DONE)
+                self._queue.task_done()
@@ -0,0 +1,381 @@
+"""Load test: concurrent multipart uploads against a running server.
+
+For every combination of server, FFmpeg profile, request mode and concurrency
+a fresh server process is started on a free local port and ``--requests``
+uploads are fired at it, ``--concurrency`` at a time. Unless the profile is
+``real``, the server's PATH starts with a directory whose ``ffmpeg`` runs
+fake_ffmpeg.py, so encodes cost exactly what the profile says and queueing,
+admission and timeouts can be profiled without real encodes. The report has
+throughput, p50/p95/p99 latency, the error rate and status codes per
+configuration, plus the session folders still on disk once the load is over.
+
+Servers:
+    main    gunicorn main:app with gunicorn.conf.py
+    server  uvicorn server:app
+
+Usage:
+    python loadtest.py
+    python loadtest.py --servers main --concurrency 1,4,16 --ffmpeg-profiles standard,slow --requests 40
+    python loadtest.py --servers main --server-args "--worker-class sync --timeout 30" --ffmpeg-profiles hang
+    python loadtest.py --url http://localhost:8080 --concurrency 8
+    python loadtest.py --json > load.json
+
+The uploads are a WAV tone and PNG images generated in pure Python, so
+nothing but the server's own dependencies is needed. Run it from the
+repository root.
+"""
+import argparse
+import concurrent.futures
+import http.client
+import itertools
+import json
+import math
+import os
+import shlex
+import shutil
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+import wave
+import zlib
+
+from benchmark import parse_list, percentile
+from fake_ffmpeg import PROFILES as FFMPEG_PROFILES
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+MODES = ('sync', 'stream', 'async')
+STARTUP_TIMEOUT = 30  # Seconds for a server to answer its first request
+SETTLE_SECONDS = 2    # Wait after the load before counting leftover session folders
+POLL_INTERVAL = 0.5   # Seconds between status polls of async jobs
+
+
+def server_command(name, port, extra_args=()):
+    """The command that starts server ``name`` on ``port``"""
+    if name == 'main':
+        return [sys.executable, '-m', 'gunicorn', f'{name}:app', '--bind', f'127.0.0.1:{port}',
+                '--config', os.path.join(REPO, 'gunicorn.conf.py'), *extra_args]
+    if name == 'server':
+        return [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port),
+                *extra_args]
+    raise ValueError(f'Unknown server: {name}')
+
+
+def write_wav(path, seconds, rate=8000):
+    """A mono 16-bit sine tone"""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        frames += struct.pack('<h', int(8000 * math.sin(2 * math.pi * 440 * i / rate)))
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(frames))
+
+
+def write_png(path, width, height, color):
+    """A solid RGB image"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    row = b'\0' + bytes(color) * width
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(row * height)))
+        f.write(chunk(b'IEND', b''))
+
+
+def generate_upload(folder, image_count, resolution, audio_seconds):
+    """Write the test media and return it as a list of (field, filename, bytes)"""
+    width, height = (int(value) for value in resolution.split('x'))
+    audio_path = os.path.join(folder, 'audio.wav')
+    write_wav(audio_path, audio_seconds)
+    paths = [('audio', audio_path)]
+    for i in range(image_count):
+        path = os.path.join(folder, f'image{i:03d}.png')
+        write_png(path, width, height, ((i * 67) % 256, (i * 131) % 256, (i * 29) % 256))
+        paths.append(('images', path))
+
+    upload = []
+    for field, path in paths:
+        with open(path, 'rb') as f:
+            upload.append((field, os.path.basename(path), f.read()))
+    return upload
+
+
+def multipart_body(fields, files):
+    """Encode form fields and (field, filename, bytes) files; returns (body, content type)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for field, filename, data in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Client:
+    """Plain http.client requests against one base URL, one connection each"""
+
+    def __init__(self, base_url, timeout):
+        parsed = urllib.parse.urlsplit(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and read the whole response; returns (status, body)"""
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            # Read in chunks so streamed responses are consumed as they arrive
+            data = bytearray()
+            while chunk := response.read(64 * 1024):
+                data += chunk
+            return response.status, bytes(data)
+        finally:
+            connection.close()
+
+
+def create_video(client, mode, upload, fields, deadline):
+    """One /create-video request in ``mode``, followed through to the video; returns the final status"""
+    body, content_type = multipart_body({**fields, **({mode: 'true'} if mode != 'sync' else {})}, upload)
+    status, data = client.request('POST', '/create-video', body, {'Content-Type': content_type})
+    if mode != 'async' or status != 202:
+        return status, len(data)
+
+    links = json.loads(data)
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        status, data = client.request('GET', links['status_url'])
+        if status != 200:
+            return status, 0
+        if json.loads(data)['state'] in ('done', 'failed'):
+            break
+    else:
+        raise TimeoutError('Job did not finish in time')
+    status, data = client.request('GET', links['result_url'])
+    return status, len(data)
+
+
+def run_load(base_url, mode, concurrency, requests, upload, fields, timeout):
+    """Fire ``requests`` uploads, ``concurrency`` at a time; returns the per-request records"""
+    client = Client(base_url, timeout)
+    records = []
+    lock = threading.Lock()
+
+    def one(_):
+        start = time.perf_counter()
+        try:
+            status, size = create_video(client, mode, upload, fields, time.monotonic() + timeout)
+            outcome = 'empty' if status == 200 and not size else status
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            outcome = 'timeout' if isinstance(e, TimeoutError) else type(e).__name__
+        record = {'outcome': outcome, 'seconds': time.perf_counter() - start, 'ok': outcome == 200}
+        with lock:
+            records.append(record)
+
+    wall_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests)))
+    return records, time.perf_counter() - wall_start
+
+
+def summarize(records, wall):
+    latencies = [record['seconds'] for record in records if record['ok']]
+    outcomes = {}
+    for record in records:
+        outcomes[str(record['outcome'])] = outcomes.get(str(record['outcome']), 0) + 1
+    return {
+        'requests': len(records),
+        'ok': len(latencies),
+        'error_rate': 1 - len(latencies) / len(records) if records else None,
+        'outcomes': outcomes,
+        'throughput_rps': len(latencies) / wall if wall else None,
+        'wall_seconds': wall,
+        'latency': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': max(latencies) if latencies else None,
+        },
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def fake_ffmpeg_dir(folder):
+    """A directory holding an ``ffmpeg`` that runs fake_ffmpeg.py"""
+    bin_dir = os.path.join(folder, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    wrapper = os.path.join(bin_dir, 'ffmpeg')
+    with open(wrapper, 'w') as f:
+        f.write(f'#!/bin/sh\nexec {shlex.quote(sys.executable)} '
+                f'{shlex.quote(os.path.join(REPO, "fake_ffmpeg.py"))} "$@"\n')
+    os.chmod(wrapper, 0o755)
+    return bin_dir
+
+
+class ServerProcess:
+    """A server started for one configuration in its own working directory.
+
+    The process gets its own session so it can be stopped together with any
+    FFmpeg processes it left running.
+    """
+
+    def __init__(self, name, ffmpeg_profile, extra_args=(), env=None):
+        self.folder = tempfile.mkdtemp(prefix='load-')
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        environ = {**os.environ, 'PYTHONPATH': REPO, 'CACHE_MAX_MB': '0', **(env or {})}
+        if ffmpeg_profile != 'real':
+            environ['PATH'] = fake_ffmpeg_dir(self.folder) + os.pathsep + environ.get('PATH', '')
+            environ['FAKE_FFMPEG_PROFILE'] = ffmpeg_profile
+        self.log_path = os.path.join(self.folder, 'server.log')
+        with open(self.log_path, 'wb') as log:
+            self.process = subprocess.Popen(server_command(name, self.port, extra_args), cwd=self.folder,
+                                            env=environ, stdout=log, stderr=subprocess.STDOUT,
+                                            start_new_session=True)
+
+    def wait_ready(self):
+        client = Client(self.url, timeout=5)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if client.request('GET', '/metrics')[0] == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f'Server did not start:\n{self.log_tail()}')
+
+    def session_folders(self):
+        """Session folders left in temp_uploads"""
+        try:
+            return len(os.listdir(os.path.join(self.folder, 'temp_uploads')))
+        except FileNotFoundError:
+            return 0
+
+    def log_tail(self, characters=2000):
+        with open(self.log_path, 'rb') as f:
+            return f.read().decode('utf-8', 'replace')[-characters:]
+
+    def stop(self):
+        for sig, wait in ((signal.SIGTERM, 10), (signal.SIGKILL, 5)):
+            try:
+                os.killpg(self.process.pid, sig)
+                self.process.wait(timeout=wait)
+                break
+            except ProcessLookupError:
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def run_config(config, upload, args):
+    """Start a server for ``config``, load it and return the report"""
+    fields = {'profile': args.profile} if args.profile else {}
+    if args.url:
+        records, wall = run_load(args.url, config['mode'], config['concurrency'], args.requests, upload,
+                                 fields, args.timeout)
+        return {'config': config, **summarize(records, wall), 'sessions_left': None}
+
+    server = ServerProcess(config['server'], config['ffmpeg'], shlex.split(args.server_args),
+                           dict(item.split('=', 1) for item in args.env))
+    try:
+        server.wait_ready()
+        records, wall = run_load(server.url, config['mode'], config['concurrency'], args.requests, upload,
+                                 fields, args.timeout)
+        # Session folders should be gone once every response is closed;
+        # async job results are kept on purpose until they expire
+        time.sleep(SETTLE_SECONDS)
+        return {'config': config, **summarize(records, wall), 'sessions_left': server.session_folders()}
+    finally:
+        server.stop()
+
+
+def format_ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.0f}'
+
+
+def print_report(results):
+    print(f"{'server':<8}{'ffmpeg':<10}{'mode':<8}{'conc':>5}{'reqs':>6}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{'p99 ms':>9}{'errors':>8}{'left':>6}  outcomes")
+    for result in results:
+        config, latency = result['config'], result['latency']
+        outcomes = ', '.join(f'{outcome}: {count}' for outcome, count in sorted(result['outcomes'].items()))
+        left = '-' if result['sessions_left'] is None else result['sessions_left']
+        print(f"{config['server']:<8}{config['ffmpeg']:<10}{config['mode']:<8}{config['concurrency']:>5}"
+              f"{result['requests']:>6}{result['throughput_rps']:>8.2f}{format_ms(latency['p50']):>9}"
+              f"{format_ms(latency['p95']):>9}{format_ms(latency['p99']):>9}{result['error_rate']:>8.1%}"
+              f"{left:>6}  {outcomes}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /create-video with concurrent uploads')
+    parser.add_argument('--servers', default='main', help='Servers to start (main, server)')
+    parser.add_argument('--url', help='Load an already running server instead of starting one')
+    parser.add_argument('--ffmpeg-profiles', default='standard',
+                        help=f'Comma separated fake FFmpeg profiles ({", ".join(FFMPEG_PROFILES)}) or real')
+    parser.add_argument('--modes', default='sync', help=f'Comma separated request modes ({", ".join(MODES)})')
+    parser.add_argument('--concurrency', default='1,4', help='Comma separated numbers of requests in flight')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per configuration')
+    parser.add_argument('--images', type=int, default=5, help='Images per upload')
+    parser.add_argument('--resolution', default='1280x720', help='WxH of the uploaded images')
+    parser.add_argument('--audio', type=float, default=10, help='Seconds of uploaded audio')
+    parser.add_argument('--profile', help='Encoder profile requested from the server')
+    parser.add_argument('--timeout', type=float, default=330, help='Seconds before a request counts as timed out')
+    parser.add_argument('--server-args', default='', help='Extra arguments for gunicorn or uvicorn')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='Environment variable for the server, e.g. ENCODE_TIMEOUT=20 (repeatable)')
+    parser.add_argument('--json', action='store_true', help='Print raw JSON results')
+    args = parser.parse_args()
+
+    modes = parse_list(args.modes)
+    for mode in modes:
+        if mode not in MODES:
+            parser.error(f'Unknown mode: {mode}')
+    for profile in parse_list(args.ffmpeg_profiles):
+        if profile not in FFMPEG_PROFILES and profile != 'real':
+            parser.error(f'Unknown ffmpeg profile: {profile}')
+
+    folder = tempfile.mkdtemp(prefix='load-media-')
+    try:
+        upload = generate_upload(folder, args.images, args.resolution, args.audio)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    servers = ['external'] if args.url else parse_list(args.servers)
+    profiles = ['external'] if args.url else parse_list(args.ffmpeg_profiles)
+    results = []
+    for server, ffmpeg, mode, concurrency in itertools.product(
+            servers, profiles, modes, parse_list(args.concurrency, int)):
+        config = {'server': server, 'ffmpeg': ffmpeg, 'mode': mode, 'concurrency': concurrency}
+        print(f'Running {config}', file=sys.stderr)
+        results.append(run_config(config, upload, args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Metrics live in the memory of the worker process that serves /metrics, which
+matches the single gunicorn worker this service runs with.
+"""
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up"""
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Gauge(_Metric):
+    """A value that can go up and down"""
+    type = 'gauge'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the body of a with block as in progress"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets"""
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._counts = {}
+        self._sums = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the body of a with block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            counts = {key: list(value) for key, value in self._counts.items()}
+            sums = dict(self._sums)
+        lines = []
+        for key in sorted(counts):
+            for bound, count in zip(self.buckets, counts[key]):
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(sums[key])}')
+            lines.append(f'{self.name}_count{labels} {counts[key][-1]}')
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A metric whose value is read from a function at scrape time.
+
+    The function returns either a number or a dict mapping label value tuples
+    to numbers.
+    """
+
+    def __init__(self, name, help, type, function, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.function = function
+
+    def _samples(self):
+        value = self.function()
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(sample)}'
+                for key, sample in sorted(value.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} unavailable: {str(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def gauge(name, help, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+def callback(name, help, type, function, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, help, type, function, labelnames))
+
+
+def folder_size(path):
+    """Total size in bytes of the files under ``path``"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+# Pipeline metrics shared by both apps
+STAGE_SECONDS = histogram(
+    'video_stage_duration_seconds', 'Time spent in each stage of /create-video', ['stage'])
+REQUESTS = counter('video_requests_total', 'Video requests accepted, by output mode', ['mode'])
+FAILURES = counter('video_failures_total', 'Video requests that failed, by reason', ['reason'])
+FFMPEG_ACTIVE = gauge('ffmpeg_active_processes', 'FFmpeg processes currently running')
+PROBES = counter('media_probes_total', 'Media files probed, by where the details came from', ['source'])
+
+# Reaped child processes (FFmpeg and ffprobe) as reported by getrusage
+# (ru_maxrss is in kilobytes on Linux)
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {('user',): usage.ru_utime, ('system',): usage.ru_stime}
+
+
+callback('ffmpeg_children_cpu_seconds_total', 'CPU time of finished child processes',
+         'counter', _children_cpu, ['mode'])
+callback('ffmpeg_children_max_rss_bytes', 'Largest resident set size of any finished child process',
+         'gauge', lambda: resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+callback('process_max_rss_bytes', 'Peak resident set size of this server process',
+         'gauge', lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
@@ -0,0 +1,740 @@
+"""The video pipeline behind the HTTP handlers.
+
+handlers.py serves it to both front ends, main.py over WSGI with Flask and
+server.py over ASGI. This module holds the upload rules, request parsing,
+admission control, caching and the FFmpeg encodes; a handler only turns a
+request into calls here and the results into a reply. Encodes block the
+calling thread until FFmpeg exits.
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import AdmissionError, admission, estimate_cost
+from audio import plan_audio, prepare_audio
+from batch import parse_variants, write_zip
+from cache import file_digest, make_key, media_cache
+from capabilities import get_capabilities, invalidate as invalidate_capabilities
+from jobs import QueueFullError
+from metrics import FAILURES, FFMPEG_ACTIVE, STAGE_SECONDS, callback
+from preprocess import MAX_HEIGHT, MAX_WIDTH, preprocess_images
+from probe import media_duration
+from profiles import PROFILES, encoder_threads, get_profile
+from progress import run_ffmpeg
+from segments import encode_segmented, segment_count
+from sessions import SessionManager, SessionQuotaError, session_root
+from streaming import FRAGMENTED_MP4_ARGS
+from subtitles import cue_boundaries, get_style, get_subtitle_mode, subtitle_track, write_ass, write_srt
+from timeline import (clip_timeline, cut_timeline, frame_filter, parse_durations, spread_durations,
+                      timeline_input_args, timeline_video_args, write_concat_script)
+from uploads import UploadError
+
+logger = logging.getLogger(__name__)
+
+MAX_REQUEST_SIZE = 50 * 1024 * 1024  # 50MB max request size
+
+# Configure upload settings
+UPLOAD_FOLDER = 'temp_uploads'
+ALLOWED_IMAGE_FORMATS = {'png', 'jpg', 'webp'}
+ALLOWED_AUDIO_FORMATS = {'mp3', 'wav', 'aac', 'm4a'}
+
+# Memory optimization - limit file sizes
+MAX_AUDIO_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_IMAGE_SIZE = 5 * 1024 * 1024   # 5MB per image
+MAX_IMAGES_COUNT = 20              # Maximum 20 images
+
+# Accepted multipart file fields and where each one is written
+UPLOAD_RULES = {
+    'audio': {'max_size': MAX_AUDIO_SIZE, 'max_count': 1,
+              'formats': ALLOWED_AUDIO_FORMATS, 'name': 'audio.{ext}'},
+    'images': {'max_size': MAX_IMAGE_SIZE, 'max_count': MAX_IMAGES_COUNT,
+               'formats': ALLOWED_IMAGE_FORMATS, 'name': 'img{index:03d}.jpg'},
+}
+
+# Background job settings - each worker runs one FFmpeg encode at a time, and
+# admission control holds encodes back when they would not fit in memory
+FFMPEG_WORKERS = int(os.environ.get('FFMPEG_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 4))
+JOB_TTL = 1800  # Keep finished jobs and their videos for 30 minutes
+ADMISSION_TIMEOUT = int(os.environ.get('ADMISSION_TIMEOUT', 60))  # Seconds a sync or stream request waits for its turn
+EVENTS_KEEPALIVE = 5  # Seconds between SSE comments while a job makes no progress
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', FFMPEG_WORKERS))  # Variants of one batch encoded at once
+ENCODE_TIMEOUT = int(os.environ.get('ENCODE_TIMEOUT', 300))  # 5 minutes per encode
+
+# Session folders share a disk quota; retained job results are evicted
+# oldest first to make room. SESSION_TMPFS=1 keeps them in /dev/shm.
+SESSION_QUOTA_MB = int(os.environ.get('SESSION_QUOTA_MB', 1024))
+SESSION_TMPFS = os.environ.get('SESSION_TMPFS', '').lower() in ('1', 'true', 'yes')
+
+sessions = SessionManager(session_root(UPLOAD_FOLDER, SESSION_TMPFS), SESSION_QUOTA_MB * 1024 * 1024)
+
+# Probe FFmpeg's version, encoders and filters once at startup
+get_capabilities()
+
+# Values read from the cache, admission control and disk whenever /metrics is scraped
+callback('admission_committed_memory_bytes', 'Predicted memory of admitted encodes', 'gauge',
+         lambda: admission.committed_memory)
+callback('admission_committed_threads', 'Encoder threads of admitted encodes', 'gauge',
+         lambda: admission.committed_threads)
+callback('admission_waiting', 'Encodes waiting to be admitted', 'gauge', admission.waiting)
+callback('temp_uploads_bytes', 'Disk space used by session folders', 'gauge', sessions.used_bytes)
+callback('sessions_active', 'Session folders in use or retained', 'gauge', sessions.count)
+callback('sessions_evicted_total', 'Retained session folders evicted to stay in quota', 'counter',
+         lambda: sessions.evicted)
+callback('media_cache_bytes', 'Disk space used by the media cache', 'gauge',
+         lambda: media_cache.stats()['size_bytes'])
+callback('media_cache_hits_total', 'Media cache hits', 'counter',
+         lambda: {(kind,): count for kind, count in media_cache.stats()['hits'].items()}, ['kind'])
+callback('media_cache_misses_total', 'Media cache misses', 'counter',
+         lambda: {(kind,): count for kind, count in media_cache.stats()['misses'].items()}, ['kind'])
+
+
+def register_job_metrics(job_queue):
+    """Report a front end's job queue in /metrics"""
+    callback('job_queue_depth', 'Background jobs waiting for a free worker', 'gauge', job_queue.pending)
+    callback('jobs_running', 'Background jobs currently encoding', 'gauge', job_queue.running)
+
+
+class FFmpegError(Exception):
+    """Raised when an FFmpeg encode fails"""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.details = details
+
+
+class RequestError(Exception):
+    """Raised when a request is incomplete, invalid or asks for something that isn't there"""
+
+    def __init__(self, message, status=400, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def is_enabled(options, name):
+    """Check whether a boolean option is set in a request's options"""
+    return options.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+def error_response(error):
+    """The JSON body, status and headers that answer a request that failed with ``error``"""
+    headers = {}
+    if isinstance(error, UploadError):
+        FAILURES.inc(reason='upload')
+        body, status = {'error': str(error)}, error.status
+    elif isinstance(error, RequestError):
+        body, status = {'error': str(error), **(error.details or {})}, error.status
+    elif isinstance(error, SessionQuotaError):
+        FAILURES.inc(reason='quota')
+        body, status = {'error': str(error)}, 507
+    elif isinstance(error, AdmissionError):
+        FAILURES.inc(reason='admission')
+        body, status = {'error': str(error)}, error.status
+        if error.retry_after:
+            headers['Retry-After'] = str(error.retry_after)
+    elif isinstance(error, QueueFullError):
+        FAILURES.inc(reason='queue_full')
+        body, status = {'error': f'Server busy: {str(error)}'}, 429
+        headers['Retry-After'] = '30'
+    elif isinstance(error, FFmpegError):
+        body, status = {'error': str(error), **(error.details or {})}, 500
+    elif isinstance(error, subprocess.TimeoutExpired):
+        body, status = {'error': 'FFmpeg processing timed out'}, 500
+    else:
+        FAILURES.inc(reason='error')
+        logger.error(f'Processing error: {str(error)}')
+        body, status = {'error': f'Processing error: {str(error)}'}, 500
+    return body, status, headers
+
+
+def video_encode_args(profile, threads, overlay=None):
+    """Filter, encoder and pixel format arguments for the slideshow video"""
+    video_filter = frame_filter(MAX_WIDTH, MAX_HEIGHT)  # Same canvas for every image
+    if overlay:
+        video_filter += f',{overlay}'
+    return [
+        '-vf', video_filter,
+        *profile.video_args(threads, get_capabilities().video_encoder()),  # Best available H.264 encoder
+        *timeline_video_args(),  # Encode each still once, long GOPs
+        '-pix_fmt', 'yuv420p',  # Pixel format for compatibility
+    ]
+
+
+def request_audio(audio_path, session_path, profile, normalize=False):
+    """Plan how the uploaded audio gets into the MP4: copied as it is, or AAC at the profile's bitrate"""
+    audio = plan_audio(audio_path, session_path, profile, get_capabilities().audio_encoder(), normalize)
+    logger.info(f'Audio plan for {audio_path}: {audio.to_dict()}')
+    return audio
+
+
+def encode_command(session_path, audio, timeline_path, profile, output_args, overlay=None,
+                   subtitle_inputs=(), subtitle_args=()):
+    """Build the FFmpeg command that encodes the session images and muxes the prepared audio"""
+    return [
+        'ffmpeg',
+        '-y',  # Overwrite output file
+        *timeline_input_args(timeline_path),  # One frame per image, timed by the concat script
+        '-i', audio.output_path,  # Input audio, ready to be copied
+        *subtitle_inputs,
+        # A copied upload may be an MP4 with a video track of its own, which
+        # FFmpeg would otherwise pick over the slideshow
+        '-map', '0:v', '-map', '1:a',
+        *subtitle_args,  # Soft subtitle track, if any
+        *video_encode_args(profile, encoder_threads(FFMPEG_WORKERS), overlay),
+        *audio.mux_args(),
+        '-shortest',  # End when audio ends
+        *output_args
+    ]
+
+
+def prepare_encode(session_path, audio, image_paths, durations, profile, output_args, segments=1,
+                   name='timeline', subtitles=None):
+    """Write the session timeline (and subtitles) and return (ffmpeg_cmd, cache key)"""
+    overlay = None
+    subtitle_inputs, subtitle_args = [], []
+    timeline_paths, timeline_durations = image_paths, durations
+    if subtitles and subtitles.mode == 'burn':
+        # Each image is cut wherever a cue starts or ends, so a new frame (and
+        # one libass render) happens only when the picture actually changes
+        ass_path = write_ass(subtitles.cues, os.path.abspath(os.path.join(session_path, f'{name}.ass')),
+                             subtitles.style)
+        timeline_paths, timeline_durations = cut_timeline(image_paths, durations, cue_boundaries(subtitles.cues))
+        overlay = f"ass='{ass_path}'"
+    elif subtitles:
+        # A mov_text track is muxed next to the video, which is encoded as without subtitles
+        srt_path = write_srt(subtitles.cues, os.path.join(session_path, f'{name}.srt'))
+        subtitle_inputs = ['-i', srt_path]
+        subtitle_args = ['-map', '2:s', '-c:s', 'mov_text']
+
+    timeline_path = write_concat_script(os.path.join(session_path, f'{name}.txt'),
+                                        timeline_paths, timeline_durations)
+    ffmpeg_cmd = encode_command(session_path, audio, timeline_path, profile, output_args,
+                                overlay, subtitle_inputs, subtitle_args)
+
+    # Identical inputs encoded with identical settings give an identical video
+    session_id = os.path.basename(os.path.normpath(session_path))
+    encode_settings = [arg for arg in ffmpeg_cmd if session_id not in arg]
+    if segments > 1:
+        encode_settings.append(f'segments={segments}')  # Segmented encodes differ bit for bit
+    if subtitles:
+        encode_settings += subtitles.key_parts()
+    video_key = make_key('video', audio.digest, *audio.key_parts(),
+                         *[file_digest(path) for path in image_paths],
+                         *durations, *encode_settings)
+    return ffmpeg_cmd, video_key
+
+
+def predict_cost(audio_path, image_paths, durations, profile, segments=1, audio_seconds=None):
+    """Estimate the memory, threads and time the encode of this request will need"""
+    # The timeline is clipped to the audio, and -shortest ends the video
+    # early if the images run out first
+    output_seconds = sum(durations)
+    if audio_seconds is None:
+        audio_seconds = media_duration(audio_path)
+    if audio_seconds:
+        output_seconds = min(output_seconds, audio_seconds)
+    threads = encoder_threads(FFMPEG_WORKERS)
+    if profile.max_threads:
+        threads = min(threads, profile.max_threads)
+    return estimate_cost(image_paths, output_seconds, profile, threads, processes=segments)
+
+
+class RenderPlan:
+    """One /create-video request, parsed, checked and costed before any encoding starts"""
+
+    def __init__(self, audio, image_paths, durations, profile, cost, audio_seconds=None, segments=1,
+                 subtitles=None, mode='sync'):
+        self.audio = audio
+        self.image_paths = image_paths
+        self.durations = durations
+        self.profile = profile
+        self.cost = cost
+        self.audio_seconds = audio_seconds
+        self.segments = segments
+        self.subtitles = subtitles
+        self.mode = mode  # 'sync', 'stream' or 'async'
+
+    @property
+    def output_seconds(self):
+        """The video runs for the images' durations, or less if the audio is shorter"""
+        return min(sum(self.durations), self.audio_seconds or sum(self.durations))
+
+
+def plan_render(session, options, files):
+    """Turn a /create-video request's files and options into a RenderPlan.
+
+    Without a durations option every image gets DEFAULT_IMAGE_DURATION, or
+    with the spread_over_audio option an even share of the audio. Raises
+    RequestError for a bad request and AdmissionError for an encode that
+    could never fit the memory budget.
+    """
+    if 'audio' not in files:
+        raise RequestError('No audio file provided')
+    if 'images' not in files:
+        raise RequestError('No image files provided')
+    audio_path = files['audio'].path
+    image_paths = [f.path for f in files.getlist('images')]
+    audio_seconds = media_duration(audio_path)
+
+    # Optional per-image display durations in seconds
+    if options.get('durations', '').strip() or not is_enabled(options, 'spread_over_audio'):
+        try:
+            durations = parse_durations(options.get('durations', ''), len(image_paths))
+        except ValueError as e:
+            raise RequestError(f'Invalid durations: {str(e)}')
+    elif audio_seconds is None:
+        raise RequestError('Could not read the audio duration; send durations for the images')
+    else:
+        durations = spread_durations(audio_seconds, len(image_paths))
+
+    # -shortest can't stop the video in the middle of a still, so images
+    # that would show after the audio has ended are cut off here
+    if audio_seconds:
+        image_paths, durations = clip_timeline(image_paths, durations, audio_seconds)
+
+    # Encoder speed/quality profile (draft, standard, archive) and subtitle options
+    try:
+        profile = get_profile(options.get('profile'))
+        style = get_style(options.get('subtitle_style'))
+        subtitle_mode = get_subtitle_mode(options.get('subtitle_mode'))
+    except ValueError as e:
+        raise RequestError(str(e))
+
+    # Subtitles are timed over the audio and cut off where the video ends;
+    # without libass they are muxed as a track instead of burned in
+    timeline_seconds = audio_seconds or sum(durations)
+    subtitles = subtitle_track(options.get('subtitle_text', '').strip(), style, subtitle_mode, timeline_seconds,
+                               min(sum(durations), timeline_seconds), get_capabilities().has_filter('ass'))
+
+    mode = 'async' if is_enabled(options, 'async') else 'stream' if is_enabled(options, 'stream') else 'sync'
+
+    # Long timelines can be encoded as parallel segments (streamed output has
+    # to come from a single FFmpeg process, and so do subtitles)
+    segments = 1
+    if is_enabled(options, 'chunked') and not is_enabled(options, 'stream') and subtitles is None:
+        segments = segment_count(len(image_paths), sum(durations), encoder_threads(FFMPEG_WORKERS))
+
+    # Compatible AAC is copied into the MP4; anything else is transcoded once
+    audio = request_audio(audio_path, session.path, profile, is_enabled(options, 'normalize'))
+
+    # Predict the encode's memory and CPU needs before doing any work,
+    # and turn away requests that could never fit
+    cost = predict_cost(audio_path, image_paths, durations, profile, segments, audio_seconds)
+    if segments > 1 and cost.memory_bytes > admission.memory_budget:
+        segments = 1  # Parallel segments need more memory than there is
+        cost = predict_cost(audio_path, image_paths, durations, profile, audio_seconds=audio_seconds)
+    logger.info(f'Predicted encode cost for {session.id}: {cost.to_dict()}')
+    admission.check(cost)
+    return RenderPlan(audio, image_paths, durations, profile, cost, audio_seconds, segments, subtitles, mode)
+
+
+class BatchPlan:
+    """One /batch request: the shared uploads, the variants to render and what each will cost"""
+
+    def __init__(self, audio_path, image_paths, variants, audio_seconds, costs, normalize=False, output='urls'):
+        self.audio_path = audio_path
+        self.image_paths = image_paths
+        self.variants = variants
+        self.audio_seconds = audio_seconds
+        self.costs = costs
+        self.normalize = normalize
+        self.output = output  # 'urls' for a background job, 'zip' to wait for the archive
+
+    @property
+    def output_seconds(self):
+        return sum(variant.output_seconds(self.audio_seconds) for variant in self.variants)
+
+
+def plan_batch(options, files):
+    """Turn a /batch request's files and options into a BatchPlan.
+
+    Raises RequestError for a bad request and AdmissionError if a variant
+    could never fit the memory budget.
+    """
+    if 'audio' not in files or 'images' not in files:
+        raise RequestError('Missing audio or images')
+    audio_path = files['audio'].path
+    image_paths = [f.path for f in files.getlist('images')]
+
+    try:
+        variants = parse_variants(options.get('variants'), len(image_paths))
+    except ValueError as e:
+        raise RequestError(f'Invalid variants: {str(e)}')
+
+    output = options.get('output', 'urls').lower()
+    if output not in ('urls', 'zip'):
+        raise RequestError(f'Unknown output: {output}. Use urls or zip')
+
+    # Probe the audio once, clip every variant to it and predict its cost
+    audio_seconds = media_duration(audio_path)
+    if audio_seconds:
+        for variant in variants:
+            variant.clip(audio_seconds)
+    costs = [predict_cost(audio_path, variant.image_paths(image_paths), variant.durations,
+                          variant.profile, audio_seconds=audio_seconds) for variant in variants]
+    for cost in costs:
+        admission.check(cost)
+    return BatchPlan(audio_path, image_paths, variants, audio_seconds, costs, is_enabled(options, 'normalize'),
+                     output)
+
+
+def optimize_images(image_paths):
+    """Optimize all images concurrently to reduce encode memory usage"""
+    with STAGE_SECONDS.time(stage='preprocess'):
+        records = preprocess_images(image_paths)
+    for record in records:
+        logger.info(f'Preprocessed {os.path.basename(record["path"])} in {record["seconds"]}s')
+
+
+def run_encode(ffmpeg_cmd, progress=None):
+    """Run an FFmpeg encode to completion, reporting to ``progress``, and return the finished run"""
+    logger.info(f'Running FFmpeg command: {" ".join(ffmpeg_cmd)}')
+    try:
+        with FFMPEG_ACTIVE.track(), STAGE_SECONDS.time(stage='encode'):
+            return run_ffmpeg(ffmpeg_cmd, progress, timeout=ENCODE_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        FAILURES.inc(reason='timeout')
+        raise
+    except OSError:
+        invalidate_capabilities()  # The binary went missing since it was probed
+        raise
+
+
+def run_audio(audio):
+    """Copy, fetch from the cache or transcode the audio; return the FFmpegRun if it failed"""
+    with STAGE_SECONDS.time(stage='audio'):
+        run = prepare_audio(audio)
+    if run and run.returncode != 0:
+        return run
+    return None
+
+
+def ffmpeg_failed(result):
+    """Log a failed FFmpeg run and return the FFmpegError to raise for it"""
+    FAILURES.inc(reason='ffmpeg')
+    logger.error(f'FFmpeg failed with return code {result.returncode}')
+    logger.error(f'FFmpeg stderr: {result.stderr_tail()}')
+    return FFmpegError('FFmpeg processing failed', {
+        'details': result.stderr_tail(40),
+        'command': ' '.join(result.args)
+    })
+
+
+def run_segmented(session_path, audio, image_paths, durations, profile, output_path, segments,
+                  progress=None):
+    """Encode the timeline as parallel segments joined by stream copy; return the last run"""
+    logger.info(f'Encoding {session_path} in {segments} parallel segments')
+    processes = segments + 1  # Plus the audio encode
+    FFMPEG_ACTIVE.inc(processes)
+    try:
+        with STAGE_SECONDS.time(stage='encode'):
+            return encode_segmented(
+                session_path, image_paths, durations, audio.output_path, output_path,
+                lambda threads: video_encode_args(profile, threads), audio.mux_args(),
+                segments, encoder_threads(FFMPEG_WORKERS), progress, timeout=ENCODE_TIMEOUT
+            )
+    except subprocess.TimeoutExpired:
+        FAILURES.inc(reason='timeout')
+        raise
+    finally:
+        FFMPEG_ACTIVE.dec(processes)
+
+
+def finish_render(result, output_video_path, video_key):
+    """Check a finished encode and cache its video; raise FFmpegError if it failed"""
+    if result.returncode != 0:
+        raise ffmpeg_failed(result)
+
+    # Check if output video was created
+    if not os.path.exists(output_video_path):
+        raise FFmpegError('Video creation failed - output file not found')
+
+    media_cache.put(video_key, output_video_path)
+    return output_video_path
+
+
+def render_video(session_path, audio, image_paths, durations, profile, cost, progress=None,
+                 admission_timeout=None, segments=1, name=None, subtitles=None, preprocessed=False):
+    """Optimize the saved images, prepare the audio and encode them into an MP4.
+
+    The work waits for admission control to make room for ``cost`` first.
+    With ``segments`` above 1 the timeline is encoded in parallel pieces.
+    ``name`` keeps the files of several encodes in one session apart.
+    """
+    output_video_path = os.path.join(session_path, f'{name}.mp4' if name else 'output_video.mp4')
+    ffmpeg_cmd, video_key = prepare_encode(
+        session_path, audio, image_paths, durations, profile, [output_video_path], segments,
+        name or 'timeline', subtitles)
+
+    if media_cache.get(video_key, output_video_path):
+        logger.info(f'Serving cached video for {output_video_path}')
+        return output_video_path
+
+    with admission.admit(cost, admission_timeout):
+        if not preprocessed:
+            optimize_images(image_paths)
+        result = run_audio(audio)
+        if result is None and segments > 1:
+            result = run_segmented(session_path, audio, image_paths, durations, profile,
+                                   output_video_path, segments, progress)
+        elif result is None:
+            result = run_encode(ffmpeg_cmd, progress)
+
+    return finish_render(result, output_video_path, video_key)
+
+
+def render_plan(session_path, plan, progress=None, admission_timeout=None):
+    """Render the video a RenderPlan describes and return its path"""
+    return render_video(session_path, plan.audio, plan.image_paths, plan.durations, plan.profile, plan.cost,
+                        progress, admission_timeout, plan.segments, subtitles=plan.subtitles)
+
+
+def session_job(func, session, *args, **kwargs):
+    """Run ``func(session.path, ...)`` as a background job; a finished result is kept for JOB_TTL"""
+    result = None
+    try:
+        result = func(session.path, *args, **kwargs)
+        return result
+    finally:
+        sessions.measure(session)
+        sessions.release(session, retain=JOB_TTL if result else None)
+
+
+def prepare_batch(session_path, plan, admission_timeout=None):
+    """Preprocess the shared images and the audio of every profile once; return the audio plans"""
+    # Variants with the same profile share one prepared audio file
+    audio_plans = {}
+    for variant in plan.variants:
+        if variant.profile.name not in audio_plans:
+            audio_plans[variant.profile.name] = request_audio(plan.audio_path, session_path, variant.profile,
+                                                              plan.normalize)
+
+    # The largest variant's share of the budget covers decoding the images and the audio
+    with admission.admit(max(plan.costs, key=lambda cost: cost.memory_bytes), admission_timeout):
+        optimize_images(plan.image_paths)
+        failed = [run for run in map(run_audio, audio_plans.values()) if run]
+    if failed:
+        raise ffmpeg_failed(failed[0])
+    return audio_plans
+
+
+def _variant_kwargs(session_path, plan, audio_plans, variant, progress, admission_timeout):
+    # Arguments of render_video for one variant of a batch
+    can_burn = get_capabilities().has_filter('ass')
+    return dict(
+        session_path=session_path, audio=audio_plans[variant.profile.name],
+        image_paths=variant.image_paths(plan.image_paths), durations=variant.durations,
+        profile=variant.profile, cost=plan.costs[variant.index],
+        progress=progress.child(variant.output_seconds(plan.audio_seconds)) if progress else None,
+        admission_timeout=admission_timeout, name=f'variant{variant.index:03d}',
+        subtitles=variant.subtitles(plan.audio_seconds, can_burn), preprocessed=True)
+
+
+def _variant_failed(record, error):
+    if isinstance(error, FFmpegError):
+        record['error'] = str(error)
+        record.update(error.details or {})
+    else:
+        logger.error(f'Variant {record["name"]} failed: {str(error)}')
+        record['error'] = str(error)
+    return record
+
+
+def _batch_records(records):
+    if not any('path' in record for record in records):
+        raise FFmpegError('All variants failed', {'variants': records})
+    return records
+
+
+def run_batch(session_path, plan, progress=None, admission_timeout=None):
+    """Preprocess the shared images and audio once, then encode the variants concurrently.
+
+    Returns one record per variant with its output path or error, and raises
+    FFmpegError if no variant could be encoded.
+    """
+    audio_plans = prepare_batch(session_path, plan, admission_timeout)
+
+    def render(variant):
+        record = {'index': variant.index, 'name': variant.name}
+        try:
+            record['path'] = render_video(**_variant_kwargs(session_path, plan, audio_plans, variant, progress,
+                                                            admission_timeout))
+        except Exception as e:
+            _variant_failed(record, e)
+        return record
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(plan.variants))) as executor:
+        records = list(executor.map(render, plan.variants))
+    return _batch_records(records)
+
+
+def batch_zip(session_path, records):
+    """ZIP the videos a batch produced, with an errors.json for the variants that failed"""
+    zip_path = os.path.join(session_path, 'batch.zip')
+    if os.path.exists(zip_path):
+        return zip_path
+    failed = [record for record in records if 'error' in record]
+    files = [(f'{record["name"]}.mp4', record['path']) for record in records if 'path' in record]
+    if failed:
+        errors_path = os.path.join(session_path, 'errors.json')
+        with open(errors_path, 'w', encoding='utf-8') as f:
+            json.dump(failed, f, indent=2)
+        files.append(('errors.json', errors_path))
+    return write_zip(zip_path, files)
+
+
+def job_session(path):
+    """Take a reference to the session holding a job's output, or None if it has expired"""
+    session = sessions.get(os.path.basename(os.path.dirname(path)))
+    if session is None or not sessions.acquire(session):
+        return None
+    return session
+
+
+def job_links(job, plan=None):
+    """The 202 response body for a submitted job; a BatchPlan adds a link per variant"""
+    links = {
+        'job_id': job.id,
+        'state': job.state,
+        'status_url': f'/jobs/{job.id}',
+        'events_url': f'/jobs/{job.id}/events',
+        'result_url': f'/jobs/{job.id}/result'
+    }
+    if isinstance(plan, BatchPlan):
+        links['variants'] = [{
+            **variant.to_dict(),
+            'result_url': f'/jobs/{job.id}/variants/{variant.index}'
+        } for variant in plan.variants]
+    return links
+
+
+def job_status(job, job_queue):
+    """The state of a background job as reported by /jobs/<id>"""
+    info = job.to_dict()
+    info['queue_depth'] = job_queue.pending()
+    if job.state == 'done':
+        info['result_url'] = f'/jobs/{job.id}/result'
+        if isinstance(job.result, list):
+            info['variants'] = [{
+                'index': record['index'],
+                'name': record['name'],
+                **({'error': record['error']} if 'error' in record
+                   else {'result_url': f'/jobs/{job.id}/variants/{record["index"]}'})
+            } for record in job.result]
+    return info
+
+
+def job_event(job):
+    """One Server-Sent Event with the job's state; returns (event, whether the job has finished)"""
+    info = job.to_dict()
+    state = info['state']
+    finished = state in ('done', 'failed')
+    return f'event: {state if finished else "progress"}\ndata: {json.dumps(info)}\n\n', finished
+
+
+def job_download(job, index=None):
+    """The file a finished job produced, as (path, download name, mimetype, session).
+
+    ``index`` picks one variant of a batch job. The session is held so the
+    file can't be evicted during the download; release it once the response
+    is closed. Raises RequestError when there is nothing to download.
+    """
+    if job is None or (index is not None and job.finished and not isinstance(job.result, list)):
+        raise RequestError('Job not found' if index is None else 'Batch job not found', 404)
+
+    if job.state == 'failed':
+        raise RequestError(job.error, 500, job.details)
+
+    if job.state != 'done':
+        raise RequestError('Job not finished', 409, {'state': job.state})
+
+    batch = isinstance(job.result, list)
+    if index is not None:
+        if not 0 <= index < len(job.result):
+            raise RequestError('Variant not found', 404)
+        record = job.result[index]
+        if 'error' in record:
+            raise RequestError(record['error'], 500, record)
+        path, download_name, mimetype = record['path'], f'{record["name"]}.mp4', 'video/mp4'
+    elif batch:
+        # A batch's result is every variant's video in one ZIP
+        path, download_name, mimetype = None, f'videos_{job.id}.zip', 'application/zip'
+    else:
+        path, download_name, mimetype = job.result, f'video_{job.id}.mp4', 'video/mp4'
+
+    # Hold the session while the download runs so it can't be evicted midway
+    session = job_session(path or next(record['path'] for record in job.result if 'path' in record))
+    if session is None:
+        raise RequestError('Job result has expired', 410)
+    if path is None:
+        try:
+            path = batch_zip(session.path, job.result)
+        except Exception:
+            sessions.release(session)
+            raise
+    return path, download_name, mimetype, session
+
+
+def prepare_stream(session, plan):
+    """Write the timeline of a streamed encode; return (ffmpeg_cmd, cache key, copy path)"""
+    output_video_path = os.path.join(session.path, 'output_stream.mp4')
+    ffmpeg_cmd, video_key = prepare_encode(
+        session.path, plan.audio, plan.image_paths, plan.durations, plan.profile,
+        [*FRAGMENTED_MP4_ARGS, 'pipe:1'], subtitles=plan.subtitles)
+    return ffmpeg_cmd, video_key, output_video_path
+
+
+def prepare_stream_inputs(plan):
+    """Preprocess the images and prepare the audio, so the stream only muxes it"""
+    optimize_images(plan.image_paths)
+    failed = run_audio(plan.audio)
+    if failed:
+        raise ffmpeg_failed(failed)
+
+
+def profiles_info():
+    """The encoder profiles that can be passed as the profile parameter"""
+    return {
+        'default': get_profile().name,
+        'profiles': [profile.to_dict() for profile in PROFILES.values()]
+    }
+
+
+def debug_info():
+    """Server status for /debug"""
+    # FFmpeg availability from the cached capability probe
+    capabilities = get_capabilities()
+    return {
+        'ffmpeg_available': capabilities.ffmpeg_available,
+        'ffmpeg_version': capabilities.ffmpeg_version or 'Not available',
+        'capabilities': capabilities.to_dict(),
+        'upload_folder_exists': os.path.exists(sessions.root),
+        'upload_folder_path': sessions.root,
+        'sessions': sessions.stats(),
+        'cache': media_cache.stats(),
+        'admission': admission.stats(),
+        'current_working_directory': os.getcwd(),
+        'python_version': f'Python {platform.python_version()}'
+    }
+
+
+def index_page():
+    """The HTML served at /"""
+    try:
+        with open('index.html', 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return '''
+        <h1>Video Creator API</h1>
+        <p>Use POST /create-video with audio file and images to create a video.</p>
+        <p>Send multipart/form-data with:</p>
+        <ul>
+            <li>audio: MP3/WAV audio file</li>
+            <li>images: Multiple image files (JPEG/PNG/WebP)</li>
+        </ul>
+        <p>Use POST /batch with the same files and a variants JSON list to render several videos at once.</p>
+        '''
@@ -0,0 +1,118 @@
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import file_digest, make_key, media_cache
+from metrics import FFMPEG_ACTIVE
+from resources import cpu_count
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional, fall back to one ffmpeg process per image
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Target frame box - images are scaled to fit inside it, keeping aspect ratio
+MAX_WIDTH = 1920
+MAX_HEIGHT = 1080
+JPEG_QUALITY = 90  # Roughly matches ffmpeg -q:v 3
+
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', cpu_count()))
+
+
+def fit_size(width, height, max_width=MAX_WIDTH, max_height=MAX_HEIGHT):
+    """Scale (width, height) to fit the box, rounded to even numbers for yuv420p"""
+    scale = min(max_width / width, max_height / height)
+    new_width = max(2, int(width * scale) // 2 * 2)
+    new_height = max(2, int(height * scale) // 2 * 2)
+    return new_width, new_height
+
+
+def _normalize_with_pillow(src, dest):
+    with Image.open(src) as img:
+        size = fit_size(*img.size)
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while loading,
+        # which skips most of the IDCT work for large photos
+        img.draft('RGB', size)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != size:
+            img = img.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        img.save(dest, format='JPEG', quality=JPEG_QUALITY)
+        return size
+
+
+def _normalize_with_ffmpeg(src, dest):
+    optimize_cmd = [
+        'ffmpeg', '-y', '-i', src,
+        '-vf', f'scale={MAX_WIDTH}:{MAX_HEIGHT}:force_original_aspect_ratio=decrease,'
+               'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+        '-q:v', '3',  # Good quality but compressed
+        '-f', 'image2', dest
+    ]
+    with FFMPEG_ACTIVE.track():
+        result = subprocess.run(optimize_cmd, capture_output=True, text=True, timeout=30)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'ffmpeg failed')
+    return None
+
+
+def normalize_image(path):
+    """Convert one image in place to an RGB JPEG that fits the frame box.
+
+    Previously normalized inputs are served from the media cache. Returns a
+    timing record; on failure the original file is left untouched.
+    """
+    start = time.perf_counter()
+    tmp_path = path + '_opt.jpg'
+    record = {'path': path, 'method': 'pillow' if Image else 'ffmpeg'}
+    try:
+        key = make_key('image', file_digest(path), MAX_WIDTH, MAX_HEIGHT, JPEG_QUALITY, record['method'])
+        if media_cache.get(key, tmp_path):
+            os.replace(tmp_path, path)
+            record['cached'] = True
+        else:
+            if Image:
+                size = _normalize_with_pillow(path, tmp_path)
+            else:
+                size = _normalize_with_ffmpeg(path, tmp_path)
+            os.replace(tmp_path, path)
+            media_cache.put(key, path)
+            record['cached'] = False
+            if size:
+                record['width'], record['height'] = size
+    except Exception as e:
+        record['error'] = str(e)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+
+def preprocess_images(image_paths, max_workers=None):
+    """Normalize all images concurrently and return per-image timing records"""
+    if not image_paths:
+        return []
+
+    start = time.perf_counter()
+    workers = max(1, min(max_workers or PREPROCESS_WORKERS, len(image_paths)))
+    if workers == 1:
+        records = [normalize_image(path) for path in image_paths]
+    else:
+        # Pillow releases the GIL while decoding and resizing, and the ffmpeg
+        # fallback waits on subprocesses, so threads scale across cores here
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            records = list(executor.map(normalize_image, image_paths))
+
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for record in records if 'error' in record)
+    cached = sum(1 for record in records if record.get('cached'))
+    logger.info(f'Preprocessed {len(records)} images in {elapsed:.3f}s '
+                f'with {workers} workers ({cached} cached, {failed} failed)')
+    for record in records:
+        if 'error' in record:
+            logger.warning(f'Image optimization failed for {record["path"]}: {record["error"]}')
+    return records
@@ -0,0 +1,459 @@
+"""Media details from file headers, without a process per file.
+
+One call returns an upload's duration, codec, sample rate, channels and
+image dimensions. The formats the server accepts are read directly from
+their headers: WAV chunks, MPEG audio and ADTS frames, MP4 boxes, and the
+PNG, JPEG and WebP headers. Anything else, or a header that does not parse,
+costs a single ffprobe JSON call. Results are memoized by content digest,
+so the same upload is never probed twice.
+"""
+import json
+import logging
+import os
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+
+from cache import file_digest
+from capabilities import get_capabilities
+from metrics import PROBES, STAGE_SECONDS
+from uploads import SNIFF_SIZE, sniff_format
+
+logger = logging.getLogger(__name__)
+
+PROBE_CACHE_SIZE = 1024  # Memoized results kept in memory
+FFPROBE_TIMEOUT = 10
+
+
+class MediaInfo:
+    """What a probe found out about one file; fields it could not find are None"""
+
+    def __init__(self, format=None, duration=None, codec=None, sample_rate=None, channels=None,
+                 width=None, height=None, source=None):
+        self.format = format
+        self.duration = duration  # Seconds, for audio
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.width = width
+        self.height = height
+        self.source = source  # 'header', 'ffprobe', or None when nothing could be read
+
+    @property
+    def pixels(self):
+        if self.width and self.height:
+            return self.width * self.height
+        return None
+
+    def to_dict(self):
+        return {
+            'format': self.format,
+            'duration': round(self.duration, 3) if self.duration is not None else None,
+            'codec': self.codec,
+            'sample_rate': self.sample_rate,
+            'channels': self.channels,
+            'width': self.width,
+            'height': self.height,
+            'source': self.source,
+        }
+
+
+def _read(f, size):
+    data = f.read(size)
+    if len(data) < size:
+        raise ValueError('file ends inside a header')
+    return data
+
+
+# WAV: a RIFF list of chunks; 'fmt ' describes the samples, 'data' holds them
+
+WAV_CODECS = {1: 'pcm_{sign}{bits}le', 3: 'pcm_f{bits}le', 6: 'pcm_alaw', 7: 'pcm_mulaw'}
+
+
+def _parse_wav(f, size):
+    f.seek(12)
+    fmt = None
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError('no data chunk')
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            data = _read(f, chunk_size)
+            tag, channels, rate, byte_rate, _, bits = struct.unpack('<HHIIHH', data[:16])
+            if tag == 0xFFFE and len(data) >= 26:  # WAVE_FORMAT_EXTENSIBLE names the real format
+                tag = struct.unpack('<H', data[24:26])[0]
+            fmt = (tag, channels, rate, byte_rate, bits)
+            f.seek(chunk_size % 2, 1)
+        elif chunk_id == b'data':
+            if fmt is None or not fmt[3]:
+                raise ValueError('data chunk without a format')
+            tag, channels, rate, byte_rate, bits = fmt
+            # Streaming writers leave the size at 0 or 0xFFFFFFFF; the data runs to the end
+            available = size - f.tell()
+            data_size = available if chunk_size in (0, 0xFFFFFFFF) else min(chunk_size, available)
+            codec = WAV_CODECS.get(tag, f'wav_{tag:#06x}').format(sign='u' if bits == 8 else 's', bits=bits)
+            return MediaInfo('wav', data_size / byte_rate, codec, rate, channels, source='header')
+        else:
+            f.seek(chunk_size + chunk_size % 2, 1)
+
+
+# MPEG audio (MP3): a run of frames, each with a 4 byte header
+
+MPEG_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+MPEG_BITRATES = {  # kbit/s by (MPEG version, layer)
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # Also layer 3
+}
+MPEG_CODECS = {1: 'mp1', 2: 'mp2', 3: 'mp3'}
+MPEG_RESYNC_BYTES = 4096  # How far to look for the next frame after junk
+
+
+class MpegFrame:
+    """A parsed MPEG audio frame header"""
+
+    def __init__(self, header):
+        b1, b2, b3 = header[1], header[2], header[3]
+        version_bits, layer_bits = (b1 >> 3) & 3, (b1 >> 1) & 3
+        bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+        if (header[0] != 0xFF or b1 & 0xE0 != 0xE0 or version_bits == 1 or layer_bits == 0
+                or bitrate_index in (0, 15) or rate_index == 3):
+            raise ValueError('not an MPEG audio frame')  # Free-format bitrates are not supported
+        self.version = 1 if version_bits == 3 else 2
+        self.layer = 4 - layer_bits
+        self.sample_rate = MPEG_SAMPLE_RATES[version_bits][rate_index]
+        bitrate = MPEG_BITRATES[(self.version, self.layer if self.version == 1 else min(self.layer, 2))]
+        self.bitrate = bitrate[bitrate_index] * 1000
+        self.channels = 1 if b3 >> 6 == 3 else 2
+        padding = (b2 >> 1) & 1
+        if self.layer == 1:
+            self.samples = 384
+            self.length = (12 * self.bitrate // self.sample_rate + padding) * 4
+        else:
+            self.samples = 1152 if self.layer == 2 or self.version == 1 else 576
+            self.length = self.samples // 8 * self.bitrate // self.sample_rate + padding
+
+    @property
+    def side_info_size(self):
+        if self.version == 1:
+            return 17 if self.channels == 1 else 32
+        return 9 if self.channels == 1 else 17
+
+
+def _find_frame(f, position, end, frame_class):
+    # The first offset from ``position`` holding a valid frame header
+    f.seek(position)
+    data = f.read(min(MPEG_RESYNC_BYTES, end - position) + 8)
+    for offset in range(len(data) - 7):
+        if data[offset] == 0xFF:
+            try:
+                return position + offset, frame_class(data[offset:offset + 8])
+            except ValueError:
+                continue
+    return None, None
+
+
+def _count_frames(f, position, end, frame_class):
+    # Walk the frames from header to header, skipping junk between them
+    frames = samples = 0
+    while position + 8 <= end:
+        f.seek(position)
+        try:
+            frame = frame_class(f.read(8))
+        except ValueError:
+            position, frame = _find_frame(f, position + 1, end, frame_class)
+            if frame is None:
+                break
+        frames += 1
+        samples += frame.samples
+        position += frame.length
+    return frames, samples
+
+
+def _parse_mp3(f, size):
+    start, end = 0, size
+    header = _read(f, 10)
+    if header[:3] == b'ID3':
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        start = 10 + tag_size + (10 if header[5] & 0x10 else 0)  # Footer flag
+    if size >= 128:
+        f.seek(size - 128)
+        if f.read(3) == b'TAG':
+            end = size - 128
+
+    position, first = _find_frame(f, start, end, MpegFrame)
+    if first is None:
+        raise ValueError('no MPEG audio frame')
+
+    # VBR encoders put the frame count in a Xing/Info or VBRI header inside the first frame
+    frames = None
+    f.seek(position + 4 + first.side_info_size)
+    xing = f.read(12)
+    if xing[:4] in (b'Xing', b'Info') and struct.unpack('>I', xing[4:8])[0] & 1:
+        frames = struct.unpack('>I', xing[8:12])[0]
+    else:
+        f.seek(position + 36)
+        vbri = f.read(18)
+        if vbri[:4] == b'VBRI' and len(vbri) == 18:
+            frames = struct.unpack('>I', vbri[14:18])[0]
+    if frames:
+        samples = frames * first.samples
+    else:
+        frames, samples = _count_frames(f, position, end, MpegFrame)
+
+    return MediaInfo('mp3', samples / first.sample_rate, MPEG_CODECS[first.layer], first.sample_rate,
+                     first.channels, source='header')
+
+
+# ADTS AAC: frames with a 7 byte header that carries their length
+
+ADTS_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+
+
+class AdtsFrame:
+    """A parsed ADTS frame header"""
+
+    def __init__(self, header):
+        rate_index = (header[2] >> 2) & 0xF
+        if header[0] != 0xFF or header[1] & 0xF6 != 0xF0 or rate_index >= len(ADTS_SAMPLE_RATES):
+            raise ValueError('not an ADTS frame')
+        self.sample_rate = ADTS_SAMPLE_RATES[rate_index]
+        self.channels = ((header[2] & 1) << 2) | (header[3] >> 6)
+        self.length = ((header[3] & 3) << 11) | (header[4] << 3) | (header[5] >> 5)
+        if self.length < 7:
+            raise ValueError('ADTS frame too short')
+        self.samples = 1024 * ((header[6] & 3) + 1)
+
+
+def _parse_aac(f, size):
+    position, first = _find_frame(f, 0, size, AdtsFrame)
+    if first is None:
+        raise ValueError('no ADTS frame')
+    frames, samples = _count_frames(f, position, size, AdtsFrame)
+    return MediaInfo('aac', samples / first.sample_rate, 'aac', first.sample_rate, first.channels or None,
+                     source='header')
+
+
+# MP4/M4A: nested boxes; moov/mvhd has the duration, the sound track's stsd the codec
+
+MP4_CODECS = {b'mp4a': 'aac', b'alac': 'alac', b'ac-3': 'ac3', b'ec-3': 'eac3', b'Opus': 'opus',
+              b'fLaC': 'flac', b'.mp3': 'mp3'}
+
+
+def _boxes(f, start, end):
+    """Yield (type, payload start, payload end) for the boxes between start and end"""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        box_size, box_type = struct.unpack('>I4s', _read(f, 8))
+        header_size = 8
+        if box_size == 1:
+            box_size, header_size = struct.unpack('>Q', _read(f, 8))[0], 16
+        elif box_size == 0:
+            box_size = end - position  # Runs to the end of the file
+        if box_size < header_size:
+            raise ValueError('invalid MP4 box size')
+        yield box_type, position + header_size, min(position + box_size, end)
+        position += box_size
+
+
+def _child(f, start, end, box_type):
+    for child_type, child_start, child_end in _boxes(f, start, end):
+        if child_type == box_type:
+            return child_start, child_end
+    return None
+
+
+def _sound_entry(f, moov_start, moov_end):
+    # The first sample entry of the first sound track
+    for box_type, start, end in _boxes(f, moov_start, moov_end):
+        if box_type != b'trak':
+            continue
+        mdia = _child(f, start, end, b'mdia')
+        hdlr = mdia and _child(f, *mdia, b'hdlr')
+        if not hdlr:
+            continue
+        f.seek(hdlr[0] + 8)
+        if f.read(4) != b'soun':
+            continue
+        minf = _child(f, *mdia, b'minf')
+        stbl = minf and _child(f, *minf, b'stbl')
+        stsd = stbl and _child(f, *stbl, b'stsd')
+        if not stsd:
+            return None
+        # stsd: version/flags and entry count, then the entries themselves
+        entry_type, entry_start, _ = next(_boxes(f, stsd[0] + 8, stsd[1]))
+        f.seek(entry_start + 16)
+        channels, _, _, _, rate = struct.unpack('>HHHHI', _read(f, 12))
+        return MP4_CODECS.get(entry_type, entry_type.decode('latin-1').strip()), rate >> 16, channels
+    return None
+
+
+def _parse_mp4(f, size):
+    moov = _child(f, 0, size, b'moov')
+    mvhd = moov and _child(f, *moov, b'mvhd')
+    if not mvhd:
+        raise ValueError('no movie header')
+    f.seek(mvhd[0])
+    if _read(f, 1)[0] == 1:
+        f.seek(mvhd[0] + 20)
+        timescale, duration = struct.unpack('>IQ', _read(f, 12))
+    else:
+        f.seek(mvhd[0] + 12)
+        timescale, duration = struct.unpack('>II', _read(f, 8))
+    if not timescale or not duration:
+        raise ValueError('no duration in the movie header')  # Fragmented files keep it elsewhere
+    codec = sample_rate = channels = None
+    entry = _sound_entry(f, *moov)
+    if entry:
+        codec, sample_rate, channels = entry
+    return MediaInfo('m4a', duration / timescale, codec, sample_rate, channels, source='header')
+
+
+# Images: dimensions from the first header that has them
+
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xDA)}
+
+
+def _parse_png(f, size):
+    header = _read(f, 24)
+    if header[12:16] != b'IHDR':
+        raise ValueError('PNG without IHDR')
+    width, height = struct.unpack('>II', header[16:24])
+    return MediaInfo('png', codec='png', width=width, height=height, source='header')
+
+
+def _parse_jpeg(f, size):
+    f.seek(2)
+    while True:
+        if _read(f, 1) != b'\xff':
+            raise ValueError('invalid JPEG marker')
+        marker = _read(f, 1)[0]
+        while marker == 0xFF:  # Fill bytes
+            marker = _read(f, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        length = struct.unpack('>H', _read(f, 2))[0]
+        # Start-of-frame markers; C4, C8 and CC share the range but are not frames
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            _, height, width = struct.unpack('>BHH', _read(f, 5))
+            return MediaInfo('jpg', codec='mjpeg', width=width, height=height, source='header')
+        f.seek(length - 2, 1)
+
+
+def _parse_webp(f, size):
+    header = _read(f, 30)
+    chunk = header[12:16]
+    if chunk == b'VP8X':
+        width = 1 + int.from_bytes(header[24:27], 'little')
+        height = 1 + int.from_bytes(header[27:30], 'little')
+    elif chunk == b'VP8L':
+        bits = struct.unpack('<I', header[21:25])[0]
+        width, height = 1 + (bits & 0x3FFF), 1 + ((bits >> 14) & 0x3FFF)
+    elif chunk == b'VP8 ':
+        width, height = (value & 0x3FFF for value in struct.unpack('<HH', header[26:30]))
+    else:
+        raise ValueError('unknown WebP chunk')
+    return MediaInfo('webp', codec='webp', width=width, height=height, source='header')
+
+
+PARSERS = {
+    'wav': _parse_wav,
+    'mp3': _parse_mp3,
+    'aac': _parse_aac,
+    'm4a': _parse_mp4,
+    'png': _parse_png,
+    'jpg': _parse_jpeg,
+    'webp': _parse_webp,
+}
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def ffprobe(path):
+    """Probe a file with one ffprobe call, for formats the header parsers don't handle"""
+    if not get_capabilities().ffprobe_available:
+        return MediaInfo()
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', path
+        ], capture_output=True, text=True, timeout=FFPROBE_TIMEOUT)
+        data = json.loads(result.stdout or '{}')
+    except (subprocess.TimeoutExpired, OSError, ValueError) as e:
+        logger.warning(f'ffprobe failed for {path}: {str(e)}')
+        return MediaInfo()
+
+    streams = data.get('streams', [])
+    audio = next((stream for stream in streams if stream.get('codec_type') == 'audio'), None)
+    video = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if not audio and not video:
+        return MediaInfo()
+    stream = audio or video
+    info = MediaInfo(data.get('format', {}).get('format_name'), codec=stream.get('codec_name'),
+                     source='ffprobe')
+    if audio:
+        # A still image has a nominal duration of one frame, so only audio gets one
+        info.duration = _float(data.get('format', {}).get('duration')) or _float(audio.get('duration'))
+        info.sample_rate = int(_float(audio.get('sample_rate')) or 0) or None
+        info.channels = audio.get('channels')
+    if video:
+        info.width, info.height = video.get('width'), video.get('height')
+    return info
+
+
+def _probe_file(path):
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            parser = PARSERS.get(sniff_format(f.read(SNIFF_SIZE)))
+            if parser:
+                f.seek(0)
+                return parser(f, size)
+    except (OSError, ValueError, struct.error, StopIteration) as e:
+        logger.info(f'Could not read the header of {path}, trying ffprobe: {str(e)}')
+    return ffprobe(path)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def probe(path, digest=None):
+    """Duration, codec, sample rate, channels and dimensions of a media file.
+
+    Pass ``digest`` when the file's SHA-256 is already known to save hashing
+    it again. Results are memoized by digest; a file nothing could be read
+    from is not memoized, so it is tried again once ffprobe is available.
+    """
+    digest = digest or file_digest(path)
+    with _cache_lock:
+        info = _cache.get(digest)
+        if info is not None:
+            _cache.move_to_end(digest)
+    if info is not None:
+        PROBES.inc(source='memo')
+        return info
+
+    with STAGE_SECONDS.time(stage='probe'):
+        info = _probe_file(path)
+    PROBES.inc(source=info.source or 'failed')
+    if info.source:
+        with _cache_lock:
+            _cache[digest] = info
+            while len(_cache) > PROBE_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return info
+
+
+def media_duration(path):
+    """Length of an audio file in seconds, or None if it can't be found"""
+    return probe(path).duration
@@ -0,0 +1,80 @@
+import os
+
+from resources import cpu_count
+
+
+class EncoderProfile:
+    """A named set of H.264/AAC encode settings trading speed against quality"""
+
+    def __init__(self, name, description, preset, crf, audio_bitrate, video_bitrate,
+                 tune='stillimage', max_threads=None):
+        self.name = name
+        self.description = description
+        self.preset = preset
+        self.crf = crf
+        self.audio_bitrate = audio_bitrate
+        self.video_bitrate = video_bitrate  # For encoders without libx264's CRF mode
+        self.tune = tune
+        self.max_threads = max_threads
+
+    def video_args(self, threads=1, encoder='libx264'):
+        if encoder == 'libx264':
+            args = ['-c:v', 'libx264', '-preset', self.preset, '-crf', str(self.crf)]
+            if self.tune:
+                args += ['-tune', self.tune]
+        else:
+            args = ['-c:v', encoder, '-b:v', self.video_bitrate]
+        if self.max_threads:
+            threads = min(threads, self.max_threads)
+        return args + ['-threads', str(threads)]
+
+    def audio_args(self, encoder='aac'):
+        return ['-c:a', encoder, '-b:a', self.audio_bitrate]
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            'preset': self.preset,
+            'crf': self.crf,
+            'audio_bitrate': self.audio_bitrate,
+            'video_bitrate': self.video_bitrate,
+            'tune': self.tune,
+        }
+
+
+PROFILES = {}
+
+
+def register_profile(profile):
+    """Add or replace a profile in the registry"""
+    PROFILES[profile.name] = profile
+    return profile
+
+
+register_profile(EncoderProfile(
+    'draft', 'Fastest encode for previews', preset='ultrafast', crf=30, audio_bitrate='96k',
+    video_bitrate='1M'))
+register_profile(EncoderProfile(
+    'standard', 'Balanced speed and quality', preset='fast', crf=23, audio_bitrate='128k',
+    video_bitrate='2500k'))
+register_profile(EncoderProfile(
+    'archive', 'High quality, slow encode', preset='slow', crf=18, audio_bitrate='192k',
+    video_bitrate='6M'))
+
+DEFAULT_PROFILE = os.environ.get('ENCODER_PROFILE', 'standard')
+
+
+def get_profile(name=None):
+    """Look up a profile by name, falling back to the default; raise ValueError if unknown"""
+    name = (name or DEFAULT_PROFILE).strip().lower()
+    if name not in PROFILES:
+        raise ValueError(f'Unknown encoder profile: {name}. Use {", ".join(sorted(PROFILES))}')
+    return PROFILES[name]
+
+
+def encoder_threads(concurrency=1):
+    """Split the machine's cores between the encodes that may run at once"""
+    if os.environ.get('ENCODER_THREADS'):
+        return max(1, int(os.environ['ENCODER_THREADS']))
+    return max(1, cpu_count() // max(1, concurrency))
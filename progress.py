@@ -0,0 +1,264 @@
+"""Run FFmpeg with live progress and a bounded stderr log.
+
+FFmpeg writes ``-progress`` key=value blocks to a dedicated pipe, separate
+from both the video on stdout and the log on stderr. A monitor thread reads
+both pipes as data arrives, updates a Progress object that other threads -
+or coroutines on an event loop - can wait on, and keeps only the last lines
+of stderr for error reports.
+"""
+import asyncio
+import collections
+import os
+import selectors
+import subprocess
+import threading
+
+STDERR_LINES = 200       # Lines of FFmpeg's log kept for diagnostics
+STDERR_LINE_LENGTH = 1000
+
+
+class StderrRing:
+    """The last ``max_lines`` lines written to stderr"""
+
+    def __init__(self, max_lines=STDERR_LINES):
+        self._lines = collections.deque(maxlen=max_lines)
+
+    def append(self, line):
+        if line:
+            self._lines.append(line[:STDERR_LINE_LENGTH])
+
+    def tail(self, lines=None):
+        selected = list(self._lines)[-lines:] if lines else list(self._lines)
+        return '\n'.join(selected)
+
+
+def _parse_seconds(fields):
+    # out_time_us is microseconds; older builds only have out_time_ms, which
+    # despite its name is also microseconds
+    for key in ('out_time_us', 'out_time_ms'):
+        try:
+            return max(0.0, int(fields[key]) / 1000000)
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def _parse_speed(value):
+    try:
+        return float(value.strip().rstrip('x'))
+    except (AttributeError, ValueError):
+        return None  # 'N/A' until the first frames are out
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class Progress:
+    """Latest progress of one encode, shared between threads.
+
+    ``total_seconds`` is the expected length of the output and is needed for
+    percent complete and ETA. Readers call ``wait`` to block until the next
+    update instead of polling. Work split over several FFmpeg processes
+    reports through ``child`` objects whose updates add up here.
+    """
+
+    def __init__(self, total_seconds=None, parent=None):
+        self.total_seconds = total_seconds
+        self.parent = parent
+        self.children = []
+        self.out_seconds = 0.0
+        self.speed = None
+        self.frame = None
+        self.ended = False      # FFmpeg reported progress=end
+        self.finished = False   # No more updates will come
+        self.succeeded = False
+        self.version = 0
+        self._condition = threading.Condition()
+        self._waiters = []  # (loop, future) of wait_async calls
+
+    def _changed(self):
+        self.version += 1
+        self._condition.notify_all()
+        for loop, waiter in self._waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # The loop has closed
+        self._waiters.clear()
+
+    def update(self, fields):
+        """Apply one block of -progress output"""
+        with self._condition:
+            seconds = _parse_seconds(fields)
+            if seconds is not None:
+                self.out_seconds = seconds
+            speed = _parse_speed(fields.get('speed'))
+            if speed is not None:
+                self.speed = speed
+            if fields.get('frame', '').isdigit():
+                self.frame = int(fields['frame'])
+            if fields.get('progress') == 'end':
+                self.ended = True
+            self._changed()
+        if self.parent:
+            self.parent._add_up()
+
+    def child(self, total_seconds=None):
+        """A Progress for one part of this work, e.g. one segment of the timeline"""
+        child = Progress(total_seconds, parent=self)
+        with self._condition:
+            self.children.append(child)
+        return child
+
+    def _add_up(self):
+        # Parts run side by side, so their output times and speeds add up
+        with self._condition:
+            self.out_seconds = sum(child.out_seconds for child in self.children)
+            self.speed = sum(child.speed or 0 for child in self.children) or None
+            self.frame = sum(child.frame or 0 for child in self.children)
+            self._changed()
+
+    def finish(self, succeeded):
+        """Mark the work this progress belongs to as over"""
+        with self._condition:
+            self.finished = True
+            self.succeeded = succeeded
+            self._changed()
+
+    def wait(self, version, timeout=None):
+        """Block until the version moves past ``version`` or timeout; return the current version"""
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    async def wait_async(self, version, timeout=None):
+        """``wait`` for an event loop: waits for the next update without holding a thread"""
+        with self._condition:
+            if self.version != version:
+                return self.version
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append((waiter.get_loop(), waiter))
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._condition:
+                self._waiters = [entry for entry in self._waiters if entry[1] is not waiter]
+        return self.version
+
+    def to_dict(self):
+        with self._condition:
+            percent = eta = None
+            if self.ended or (self.finished and self.succeeded):
+                percent, eta = 100.0, 0.0
+            elif self.total_seconds:
+                percent = round(min(100.0, self.out_seconds / self.total_seconds * 100), 1)
+                if self.speed:
+                    eta = round(max(0.0, self.total_seconds - self.out_seconds) / self.speed, 1)
+            return {
+                'percent': percent,
+                'speed': round(self.speed, 3) if self.speed else self.speed,
+                'eta_seconds': eta,
+                'out_time_seconds': round(self.out_seconds, 3),
+                'total_seconds': round(self.total_seconds, 3) if self.total_seconds else self.total_seconds,
+                'frame': self.frame,
+            }
+
+
+class FFmpegRun:
+    """A running FFmpeg process whose progress and stderr are read in the background"""
+
+    def __init__(self, ffmpeg_cmd, progress=None, stdout=subprocess.DEVNULL):
+        self.progress = progress
+        self.stderr = StderrRing()
+        read_fd, write_fd = os.pipe()
+        # -progress is a global option, so it goes straight after the binary;
+        # -hide_banner and -nostats keep the build info and \r status line out
+        # of the stderr log
+        cmd = [ffmpeg_cmd[0], '-hide_banner', '-nostats', '-progress', f'pipe:{write_fd}', *ffmpeg_cmd[1:]]
+        self.args = cmd
+        try:
+            self.process = subprocess.Popen(cmd, stdout=stdout, stderr=subprocess.PIPE, pass_fds=(write_fd,))
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self._monitor = threading.Thread(target=self._read_output, args=(read_fd,), daemon=True)
+        self._monitor.start()
+
+    @property
+    def returncode(self):
+        return self.process.returncode
+
+    @property
+    def stdout(self):
+        return self.process.stdout
+
+    def _on_progress_line(self, line, block):
+        if '=' not in line:
+            return
+        key, _, value = line.partition('=')
+        block[key.strip()] = value.strip()
+        if key.strip() == 'progress':
+            if self.progress:
+                self.progress.update(block)
+            block.clear()
+
+    def _read_output(self, progress_fd):
+        block = {}
+        handlers = {
+            progress_fd: lambda line: self._on_progress_line(line, block),
+            self.process.stderr.fileno(): self.stderr.append,
+        }
+        partial = {fd: b'' for fd in handlers}
+        selector = selectors.DefaultSelector()
+        for fd in handlers:
+            selector.register(fd, selectors.EVENT_READ)
+        try:
+            while handlers:
+                for key, _ in selector.select():
+                    data = os.read(key.fd, 65536)
+                    if not data:
+                        selector.unregister(key.fd)
+                        handlers.pop(key.fd)(partial[key.fd].decode('utf-8', 'replace').strip())
+                        continue
+                    *lines, partial[key.fd] = (partial[key.fd] + data).replace(b'\r', b'\n').split(b'\n')
+                    for line in lines:
+                        handlers[key.fd](line.decode('utf-8', 'replace').rstrip())
+        finally:
+            selector.close()
+            os.close(progress_fd)
+            self.process.stderr.close()
+
+    def wait(self, timeout=None):
+        """Wait for FFmpeg to exit and its output to be read; return the exit code"""
+        self.process.wait(timeout)
+        self._monitor.join()
+        return self.process.returncode
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+
+    def stderr_tail(self, lines=None):
+        return self.stderr.tail(lines)
+
+
+def run_ffmpeg(ffmpeg_cmd, progress=None, timeout=None):
+    """Run FFmpeg to completion and return the finished FFmpegRun.
+
+    Raises subprocess.TimeoutExpired (after killing FFmpeg) if it runs longer
+    than ``timeout`` seconds.
+    """
+    run = FFmpegRun(ffmpeg_cmd, progress)
+    try:
+        run.wait(timeout)
+    except subprocess.TimeoutExpired:
+        run.kill()
+        run.wait()
+        raise
+    return run
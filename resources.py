@@ -0,0 +1,49 @@
+"""How much memory and CPU this process may actually use.
+
+Inside a container os.cpu_count() and the physical memory describe the host,
+not the slice the container gets, so both are capped by the cgroup limits
+(v2 first, then v1) and, for CPUs, by the process's affinity mask.
+"""
+import math
+import os
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def memory_limit():
+    """Bytes of memory available: the cgroup limit, or the machine's physical memory"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        value = _read(path)
+        if value and value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def _cpu_quota():
+    # CPUs' worth of time per period, or None when unlimited
+    value = _read('/sys/fs/cgroup/cpu.max')  # "<quota> <period>" or "max <period>"
+    if value:
+        quota, _, period = value.partition(' ')
+        return int(quota) / int(period) if quota.isdigit() and period.isdigit() else None
+    quota, period = _read('/sys/fs/cgroup/cpu/cpu.cfs_quota_us'), _read('/sys/fs/cgroup/cpu/cpu.cfs_period_us')
+    if quota and period and quota.isdigit() and period.isdigit():  # -1 means unlimited
+        return int(quota) / int(period)
+    return None
+
+
+def cpu_count():
+    """CPUs this process may run on, capped by the cgroup CPU quota (at least 1)"""
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        count = os.cpu_count() or 1
+    quota = _cpu_quota()
+    if quota:
+        count = min(count, math.ceil(quota))
+    return max(1, count)
@@ -0,0 +1,129 @@
+"""Encode a long slideshow as parallel segments and join them without re-encoding.
+
+The timeline is split at image boundaries into contiguous segments. Each
+segment is encoded to its own video-only MP4 by a separate FFmpeg process,
+while the audio is encoded once in another. The concat demuxer then joins
+the segments with stream copy and muxes in the audio. Wall-clock time falls
+roughly with the number of cores, because x264 has few frames to spread over
+threads when every image is a single frame.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from progress import Progress, run_ffmpeg
+from timeline import timeline_input_args, write_concat_script
+
+logger = logging.getLogger(__name__)
+
+MAX_SEGMENTS = int(os.environ.get('MAX_SEGMENTS', 8))
+MIN_SEGMENT_SECONDS = 30  # Shorter segments cost more in process start-up than they save
+
+# Segments are concatenated by stream copy, so their timestamps must line up
+# exactly; without B-frames decode order equals display order and no segment
+# starts with a negative decode timestamp
+SEGMENT_VIDEO_ARGS = ['-bf', '0']
+
+
+def segment_count(image_count, total_seconds, cores):
+    """How many segments a timeline is worth splitting into"""
+    by_length = int(total_seconds // MIN_SEGMENT_SECONDS)
+    return max(1, min(MAX_SEGMENTS, cores, image_count, by_length))
+
+
+def split_timeline(image_paths, durations, count):
+    """Split the timeline at image boundaries into ``count`` runs of similar length.
+
+    Returns a list of (image_paths, durations) pairs.
+    """
+    total = sum(durations)
+    segments = []
+    start = 0
+    elapsed = 0.0
+    for index in range(1, count + 1):
+        if index == count:
+            end = len(durations)
+        else:
+            # Close this segment at the image boundary nearest its share of
+            # the total, leaving at least one image per remaining segment
+            target = total * index / count
+            end = start + 1
+            position = elapsed + durations[start]
+            while (end < len(durations) - (count - index)
+                   and abs(position + durations[end] - target) < abs(position - target)):
+                position += durations[end]
+                end += 1
+        segments.append((image_paths[start:end], durations[start:end]))
+        elapsed += sum(durations[start:end])
+        start = end
+    return segments
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(0.1, deadline - time.monotonic())
+
+
+def encode_segmented(folder, image_paths, durations, audio_path, output_path,
+                     video_args, audio_args, segments, threads, progress=None, timeout=None):
+    """Encode the timeline in ``segments`` parallel pieces and join them into ``output_path``.
+
+    ``video_args(threads)`` returns the filter, encoder and pixel format
+    arguments for one segment. ``threads`` is the total to share between the
+    segment encoders. Returns the FFmpegRun of the first step that failed, or
+    of the final join. Raises subprocess.TimeoutExpired if the whole encode
+    takes longer than ``timeout`` seconds.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pieces = split_timeline(image_paths, durations, segments)
+    segment_threads = max(1, threads // len(pieces))
+
+    commands = []
+    segment_paths = []
+    for index, (paths, lengths) in enumerate(pieces):
+        script = write_concat_script(os.path.join(folder, f'segment{index:03d}.txt'), paths, lengths)
+        segment_path = os.path.join(folder, f'segment{index:03d}.mp4')
+        cmd = ['ffmpeg', '-y', *timeline_input_args(script), '-an',
+               *video_args(segment_threads), *SEGMENT_VIDEO_ARGS]
+        if index < len(pieces) - 1:
+            # Drop the repeated final image; the join list gives the segment
+            # its exact length and the next segment starts right after it
+            cmd += ['-t', f'{sum(lengths):.3f}']
+        commands.append(cmd + [segment_path])
+        segment_paths.append(segment_path)
+
+    audio_output = os.path.join(folder, 'segment_audio.m4a')
+    audio_progress = Progress()
+    audio_cmd = ['ffmpeg', '-y', '-i', audio_path, '-vn', *audio_args, audio_output]
+
+    logger.info(f'Encoding {len(pieces)} segments with {segment_threads} threads each')
+    with ThreadPoolExecutor(max_workers=len(pieces) + 1) as executor:
+        futures = [
+            executor.submit(run_ffmpeg, cmd,
+                            progress.child(sum(lengths)) if progress else None, _remaining(deadline))
+            for cmd, (_, lengths) in zip(commands, pieces)
+        ]
+        futures.append(executor.submit(run_ffmpeg, audio_cmd, audio_progress, _remaining(deadline)))
+        runs = [future.result() for future in futures]
+
+    for run in runs:
+        if run.returncode != 0:
+            return run
+
+    join_list = os.path.join(folder, 'segments.txt')
+    lines = ['ffconcat version 1.0']
+    for segment_path, (_, lengths) in zip(segment_paths, pieces):
+        lines.append(f"file '{os.path.basename(segment_path)}'")
+        lines.append(f'duration {sum(lengths):.3f}')
+    with open(join_list, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    # -shortest drops the sparse still frames when stream copying, so the
+    # output is cut explicitly at the end of the audio or of the images
+    length = sum(durations)
+    if audio_progress.out_seconds:
+        length = min(length, audio_progress.out_seconds)
+    join_cmd = ['ffmpeg', '-y', '-f', 'concat', '-i', join_list, '-i', audio_output,
+                '-map', '0:v', '-map', '1:a', '-c', 'copy', '-t', f'{length:.3f}',
+                '-movflags', '+faststart', output_path]
+    return run_ffmpeg(join_cmd, timeout=_remaining(deadline))
@@ -0,0 +1,267 @@
+"""ASGI front end for the video pipeline: ``uvicorn server:app``.
+
+It serves the handlers in handlers.py, the same API as main.py. Uploads
+are parsed on the event loop as they arrive from the receive channel, and
+progress events wait for updates on it, so neither holds a thread. Handlers
+block on admission and FFmpeg, so each one runs in one of HANDLER_THREADS
+worker threads once its upload is in, and so does every read from a
+blocking iterator such as a streamed encode. A sync or streamed encode
+holds its thread until FFmpeg exits, which makes HANDLER_THREADS the cap on
+encodes that are waiting for admission or running, on top of the short
+handlers for status, downloads and metrics.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+from werkzeug.datastructures import MultiDict
+
+from handlers import ROUTES, begin_upload, failed, json_reply, upload_options
+from metrics import STAGE_SECONDS
+from pipeline import MAX_REQUEST_SIZE, UPLOAD_RULES, sessions
+from streaming import aiter_file
+from uploads import receive_multipart_async
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# A sync encode holds its handler's thread for the whole run, so there have
+# to be threads left over for status polls and downloads
+HANDLER_THREADS = int(os.environ.get('HANDLER_THREADS', 32))
+executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS, thread_name_prefix='handler')
+
+
+def in_thread(func, *args, **kwargs):
+    """Run a blocking call in a handler thread; returns an awaitable future"""
+    return asyncio.get_running_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+class Request:
+    """The parts of an ASGI HTTP request the handlers use"""
+
+    def __init__(self, scope, receive):
+        self.receive = receive
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope.get('headers', [])}
+        self.args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+
+    @property
+    def content_length(self):
+        try:
+            return int(self.headers['content-length'])
+        except (KeyError, ValueError):
+            return None
+
+
+async def receive_upload(request):
+    """handlers.receive_upload on the event loop; only creating the session runs in a thread"""
+    session = await in_thread(begin_upload, request)
+    try:
+        with STAGE_SECONDS.time(stage='upload'):
+            form, files = await receive_multipart_async(
+                request.receive, request.headers.get('content-type', ''), session.path, UPLOAD_RULES,
+                MAX_REQUEST_SIZE
+            )
+    except BaseException:
+        await asyncio.shield(in_thread(sessions.release, session))
+        raise
+    return session, upload_options(request, form), files
+
+
+_END = object()
+
+
+class ThreadedIterator:
+    """Read a blocking iterator from the event loop, one item per handler thread call.
+
+    ``aclose`` waits for a read still running in its thread before closing
+    the iterator, since a generator can't be closed while it runs.
+    """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._pending = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self._pending = in_thread(next, self._iterator, _END)
+        item = await asyncio.shield(self._pending)
+        if item is _END:
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self):
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+        if hasattr(self._iterator, 'close'):
+            await in_thread(self._iterator.close)
+
+
+async def _disconnected(receive):
+    # Drain whatever is left of the request until the client goes away
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _send_chunks(body, send, receive):
+    # Stop reading the body as soon as the client disconnects
+    disconnect = asyncio.ensure_future(_disconnected(receive))
+    try:
+        async for chunk in body:
+            if disconnect.done():
+                return
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnect.cancel()
+
+
+async def _close(reply, body, start):
+    if body is not None:
+        await body.aclose()  # Kills a streaming FFmpeg that is still running
+    if reply.download_name:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='response')
+    if reply.on_close:
+        await in_thread(reply.on_close)
+
+
+async def send_reply(reply, send, receive):
+    """Send a handler's Reply, then close it"""
+    start = time.perf_counter()
+    headers = {'Content-Type': reply.mimetype, **reply.headers}
+    body = content = None
+    if reply.download_name:
+        headers['Content-Disposition'] = f'attachment; filename={reply.download_name}'
+    try:
+        if reply.path:
+            headers['Content-Length'] = await in_thread(os.path.getsize, reply.path)
+            body = aiter_file(reply.path)
+        elif reply.async_chunks is not None:
+            body = reply.async_chunks
+        elif reply.chunks is not None:
+            body = ThreadedIterator(reply.chunks)
+        else:
+            content = reply.body.encode('utf-8') if isinstance(reply.body, str) else reply.body
+            headers['Content-Length'] = len(content)
+
+        await send({
+            'type': 'http.response.start',
+            'status': reply.status,
+            'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                        for name, value in headers.items()],
+        })
+        if body is None:
+            await send({'type': 'http.response.body', 'body': content})
+        else:
+            await _send_chunks(body, send, receive)
+    finally:
+        # Shielded, so a cancelled request still stops FFmpeg and frees its session
+        await asyncio.shield(_close(reply, body, start))
+
+
+def _close_abandoned(future):
+    # The request was cancelled while its handler ran; close the reply it made
+    if future.cancelled() or future.exception() is not None:
+        return
+    reply = future.result()
+
+    def close():
+        if hasattr(reply.chunks, 'close'):
+            reply.chunks.close()
+        if reply.on_close:
+            reply.on_close()
+    executor.submit(close)
+
+
+async def run_handler(handler, request, args):
+    """Run a handler in a worker thread and return its Reply.
+
+    If the request is cancelled meanwhile, the handler still finishes in its
+    thread and its reply is closed, so the session and admission ticket it
+    holds are released.
+    """
+    future = in_thread(handler, request, **args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(_close_abandoned)
+        raise
+    except Exception as e:
+        logger.error(f'Request error: {str(e)}')
+        return json_reply({'error': f'Request error: {str(e)}'}, 500)
+
+
+def compile_rule(rule):
+    """A regex for a handlers.py URL rule, and the converters of its ``<int:name>`` parts"""
+    converters = {}
+
+    def group(match):
+        kind, name = match.groups()
+        if kind == 'int':
+            converters[name] = int
+            return f'(?P<{name}>[0-9]+)'
+        return f'(?P<{name}>[^/]+)'
+
+    return re.compile('^' + re.sub(r'<(?:(\w+):)?(\w+)>', group, rule) + '$'), converters
+
+
+routes = [(*compile_rule(rule), methods, handler, upload) for rule, methods, handler, upload in ROUTES]
+
+
+async def dispatch(request):
+    """Find the handler for a request and run it"""
+    allowed = False
+    for pattern, converters, methods, handler, upload in routes:
+        match = pattern.match(request.path)
+        if match is None:
+            continue
+        if request.method not in methods:
+            allowed = True
+            continue
+        args = {name: converters.get(name, str)(value) for name, value in match.groupdict().items()}
+        if upload:
+            try:
+                args['upload'] = await receive_upload(request)
+            except Exception as e:
+                return failed(e)
+        return await run_handler(handler, request, args)
+    if allowed:
+        return json_reply({'error': 'Method not allowed'}, 405)
+    return json_reply({'error': 'Not found'}, 404)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    request = Request(scope, receive)
+    reply = await dispatch(request)
+    await send_reply(reply, send, receive)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)), timeout_keep_alive=2)
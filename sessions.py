@@ -0,0 +1,189 @@
+"""Lifecycle of per-request session folders.
+
+Every request works in its own folder. The SessionManager keeps an
+in-memory index of the folders with a reference count per session. A folder
+is deleted as soon as the last reference goes - typically when the response
+body is closed - instead of being found later by scanning the tree.
+Finished job results can be retained for a while after that. Retained
+sessions are the first to go, oldest first, when the disk quota runs out,
+and they expire lazily whenever a session is created or released.
+"""
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from metrics import folder_size
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+TMPFS_ROOT = '/dev/shm'
+
+
+class SessionQuotaError(Exception):
+    """Raised when a new session does not fit in the disk quota"""
+
+
+class Session:
+    """One request's working folder"""
+
+    def __init__(self, root, reserved_bytes=0, session_id=None):
+        self.id = session_id or str(uuid.uuid4())
+        self.path = os.path.join(root, self.id)
+        self.created_at = time.time()
+        self.size = reserved_bytes
+        self.refs = 1
+        self.expires_at = None  # Set while retained with no references
+
+    @property
+    def idle(self):
+        return self.refs == 0
+
+
+def session_root(folder, use_tmpfs=False):
+    """Where session folders go: ``folder``, or a folder of that name on tmpfs"""
+    if use_tmpfs and os.path.isdir(TMPFS_ROOT) and os.access(TMPFS_ROOT, os.W_OK):
+        return os.path.join(TMPFS_ROOT, os.path.basename(os.path.normpath(folder)))
+    return folder
+
+
+class SessionManager:
+    """Reference-counted session folders under one root with a shared disk quota"""
+
+    def __init__(self, root, quota_bytes=0):
+        self.root = root
+        self.quota_bytes = quota_bytes  # 0 means unlimited
+        self.evicted = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._adopt_leftovers()
+
+    def _adopt_leftovers(self):
+        # Folders left by a previous process are indexed as retained sessions,
+        # so the quota counts them and they are evicted first. This is the only
+        # directory scan the manager ever does.
+        os.makedirs(self.root, exist_ok=True)
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            session = Session(self.root, session_id=name)
+            session.created_at = os.path.getmtime(path)
+            session.size = folder_size(path)
+            session.refs = 0
+            session.expires_at = time.time()
+            self._sessions[name] = session
+
+    def used_bytes(self):
+        with self._lock:
+            return sum(session.size for session in self._sessions.values())
+
+    def count(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _delete(self, session):
+        # Called with the lock held; the folder itself is removed outside it
+        self._sessions.pop(session.id, None)
+        return session.path
+
+    def _remove_folders(self, paths):
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _expire(self, now):
+        return [self._delete(session) for session in list(self._sessions.values())
+                if session.idle and session.expires_at is not None and session.expires_at <= now]
+
+    def _evict_for(self, needed):
+        # Oldest retained sessions go first; sessions in use are never touched,
+        # and nothing is evicted if evicting everything would not be enough
+        used = sum(session.size for session in self._sessions.values())
+        victims = []
+        for session in sorted(self._sessions.values(), key=lambda s: s.created_at):
+            if used + needed <= self.quota_bytes:
+                break
+            if session.idle:
+                used -= session.size
+                victims.append(session)
+        if used + needed > self.quota_bytes:
+            return [], False
+        self.evicted += len(victims)
+        if victims:
+            logger.info(f'Evicting {len(victims)} retained sessions to make room for {needed} bytes')
+        return [self._delete(session) for session in victims], True
+
+    def create(self, expected_bytes=0):
+        """Create a session holding one reference, reserving ``expected_bytes`` of the quota"""
+        with self._lock:
+            removed = self._expire(time.time())
+            fits = True
+            if self.quota_bytes:
+                evicted, fits = self._evict_for(expected_bytes)
+                removed += evicted
+            if fits:
+                session = Session(self.root, expected_bytes)
+                self._sessions[session.id] = session
+        self._remove_folders(removed)
+
+        if not fits:
+            raise SessionQuotaError(f'Temporary storage is full ({self.quota_bytes // MB} MB quota)')
+        os.makedirs(session.path, exist_ok=True)
+        return session
+
+    def get(self, session_id):
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def acquire(self, session):
+        """Take another reference; returns False if the session is already gone"""
+        with self._lock:
+            if session.id not in self._sessions:
+                return False
+            session.refs += 1
+            return True
+
+    def release(self, session, retain=None):
+        """Drop a reference. The folder is deleted when none are left, unless
+        ``retain`` seconds of retention were asked for"""
+        with self._lock:
+            if session.id not in self._sessions:
+                return
+            session.refs = max(0, session.refs - 1)
+            if retain:
+                session.expires_at = max(session.expires_at or 0, time.time() + retain)
+            removed = self._expire(time.time())
+            if session.idle and session.expires_at is None:
+                removed.append(self._delete(session))
+        self._remove_folders(removed)
+
+    def discard(self, session):
+        """End retention early; the folder goes now, or when the last reference is released"""
+        with self._lock:
+            if session.id not in self._sessions:
+                return
+            session.expires_at = None
+            removed = [self._delete(session)] if session.idle else []
+        self._remove_folders(removed)
+
+    def measure(self, session):
+        """Update the session's quota usage from what is actually on disk"""
+        size = folder_size(session.path)
+        with self._lock:
+            session.size = size
+        return size
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        return {
+            'root': self.root,
+            'sessions': len(sessions),
+            'in_use': sum(1 for session in sessions if not session.idle),
+            'used_bytes': sum(session.size for session in sessions),
+            'quota_bytes': self.quota_bytes,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+import time
+
+from flask import Response
+from werkzeug.wsgi import ClosingIterator
+
+from capabilities import invalidate as invalidate_capabilities
+from metrics import FAILURES, FFMPEG_ACTIVE, STAGE_SECONDS
+from progress import FFmpegRun
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Fragmented MP4 needs no seek back to write the moov atom, so it can be
+# written to a pipe. Fragments are cut every 2 seconds (or at keyframes) so
+# the first bytes leave the server long before the encode finishes.
+FRAGMENTED_MP4_ARGS = [
+    '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+    '-frag_duration', '2000000',
+    '-f', 'mp4'
+]
+
+
+def stream_response(body, download_name, on_close=None, content_length=None, mimetype='video/mp4'):
+    """Wrap an iterable of MP4 bytes in a download response.
+
+    ``on_close`` runs when the server closes the response body - after the
+    last byte is sent or when the client disconnects - even if iteration
+    never started.
+    """
+    headers = {'Content-Disposition': f'attachment; filename={download_name}'}
+    if content_length is not None:
+        headers['Content-Length'] = str(content_length)
+
+    start = time.perf_counter()
+    callbacks = [lambda: STAGE_SECONDS.observe(time.perf_counter() - start, stage='response')]
+    if on_close:
+        callbacks.append(on_close)
+    return Response(ClosingIterator(body, callbacks), mimetype=mimetype, headers=headers)
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """Yield a file's contents in chunks"""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+
+def file_response(path, download_name, on_close=None, mimetype='video/mp4'):
+    """Send a file from disk and run ``on_close`` once the response is closed"""
+    return stream_response(iter_file(path), download_name, on_close, os.path.getsize(path), mimetype)
+
+
+async def aiter_file(path, chunk_size=CHUNK_SIZE):
+    """iter_file for the ASGI server; each read runs in a worker thread"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = await asyncio.to_thread(f.read, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_ffmpeg(ffmpeg_cmd, timeout, copy_path=None, on_success=None, chunk_size=CHUNK_SIZE):
+    """Run an FFmpeg command that writes to stdout and yield its output as produced.
+
+    The output is optionally mirrored to ``copy_path`` and ``on_success`` runs
+    only if FFmpeg exits cleanly. FFmpeg is killed after ``timeout`` seconds,
+    or as soon as the generator is closed early (the client went away). Only
+    the tail of FFmpeg's stderr is kept, for the error log.
+    """
+    start = time.perf_counter()
+    try:
+        run = FFmpegRun(ffmpeg_cmd, stdout=subprocess.PIPE)
+    except OSError:
+        invalidate_capabilities()  # The binary went missing since it was probed
+        raise
+    FFMPEG_ACTIVE.inc()
+    timed_out = threading.Event()
+
+    def kill_on_timeout():
+        timed_out.set()
+        run.kill()
+
+    timer = threading.Timer(timeout, kill_on_timeout)
+    timer.start()
+    copy_file = open(copy_path, 'wb') if copy_path else None
+    succeeded = False
+
+    try:
+        for chunk in iter(lambda: run.stdout.read1(chunk_size), b''):
+            if copy_file:
+                copy_file.write(chunk)
+            yield chunk
+
+        run.wait()
+        succeeded = run.returncode == 0
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='encode')
+        if not succeeded:
+            FAILURES.inc(reason='timeout' if timed_out.is_set() else 'ffmpeg')
+            logger.error(f'Streaming FFmpeg failed with return code {run.returncode}: {run.stderr_tail(40)}')
+    finally:
+        timer.cancel()
+        run.kill()
+        run.wait()
+        FFMPEG_ACTIVE.dec()
+        run.stdout.close()
+        if copy_file:
+            copy_file.close()
+        if succeeded and on_success:
+            on_success()
@@ -0,0 +1,265 @@
+"""Subtitles from plain text: cue splitting, timing, line wrapping and output.
+
+The text is split into sentences, and sentences too long for two lines are
+split again at word boundaries. Each cue gets a share of the audio in
+proportion to how long it takes to read - its characters plus a pause per
+word and per sentence end - instead of an equal slot per sentence. Cues are
+written as ASS with a preset style for burning in, or as SRT to be muxed as a
+soft mov_text track that needs no re-encode of the video.
+"""
+import math
+import re
+
+# Reading-time weights, in characters
+WORD_PAUSE = 2
+SENTENCE_PAUSE = 8
+
+MAX_LINES = 2
+PLAY_RES = (1920, 1080)  # ASS coordinate space; libass scales it to the video
+# The concat demuxer times still images in steps of 1/25 s, so cues start
+# and end on that grid to line up with the frames cut for them. ASS events
+# begin a centisecond early so that a frame whose timestamp rounds down on
+# its way to libass still lands inside the right cue.
+FRAME_STEP = 0.04
+ASS_LEAD = 0.01
+SUBTITLE_MODES = ('burn', 'soft')  # Rendered into the picture, or a mov_text track
+
+
+class SubtitleStyle:
+    """A named ASS style preset for burned-in subtitles"""
+
+    def __init__(self, name, description, font_size, line_chars, primary='&H00FFFFFF',
+                 outline_colour='&H00000000', back_colour='&H80000000', bold=False,
+                 border_style=1, outline=3, shadow=0, margin_v=60, font='Arial'):
+        self.name = name
+        self.description = description
+        self.font_size = font_size
+        self.line_chars = line_chars  # Characters per line before wrapping
+        self.primary = primary
+        self.outline_colour = outline_colour
+        self.back_colour = back_colour
+        self.bold = bold
+        self.border_style = border_style  # 1 outline and shadow, 3 opaque box
+        self.outline = outline
+        self.shadow = shadow
+        self.margin_v = margin_v
+        self.font = font
+
+    def ass_style(self):
+        return ('Style: Default,'
+                f'{self.font},{self.font_size},{self.primary},&H000000FF,{self.outline_colour},'
+                f'{self.back_colour},{-1 if self.bold else 0},0,0,0,100,100,0,0,'
+                f'{self.border_style},{self.outline},{self.shadow},2,60,60,{self.margin_v},1')
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            'font_size': self.font_size,
+            'line_chars': self.line_chars,
+        }
+
+
+STYLES = {}
+
+
+def register_style(style):
+    """Add or replace a style in the registry"""
+    STYLES[style.name] = style
+    return style
+
+
+register_style(SubtitleStyle('default', 'White text with a black outline', font_size=54, line_chars=42))
+register_style(SubtitleStyle('boxed', 'White text on a translucent box', font_size=50, line_chars=44,
+                             back_colour='&H60000000', border_style=3, outline=8))
+register_style(SubtitleStyle('large', 'Large bold text for small screens', font_size=72, line_chars=32,
+                             bold=True, outline=4))
+
+
+def get_style(name=None):
+    """Look up a style by name, falling back to the default; raise ValueError if unknown"""
+    name = (name or 'default').strip().lower()
+    if name not in STYLES:
+        raise ValueError(f'Unknown subtitle style: {name}. Use {", ".join(sorted(STYLES))}')
+    return STYLES[name]
+
+
+def get_subtitle_mode(name=None):
+    """Check a subtitle mode, defaulting to burn; raise ValueError if unknown"""
+    mode = (name or 'burn').strip().lower()
+    if mode not in SUBTITLE_MODES:
+        raise ValueError(f'Unknown subtitle mode: {mode}. Use burn or soft')
+    return mode
+
+
+class Cue:
+    """One subtitle: its display interval in seconds and its wrapped lines"""
+
+    def __init__(self, start, end, lines):
+        self.start = start
+        self.end = end
+        self.lines = lines
+
+    @property
+    def text(self):
+        return ' '.join(self.lines)
+
+
+def _split_words(words, parts):
+    # Break a run of words into ``parts`` pieces of similar length
+    total = sum(len(word) + 1 for word in words)
+    pieces, current, length = [], [], 0
+    for word in words:
+        target = total * (len(pieces) + 1) / parts
+        if current and len(pieces) < parts - 1 and length + (len(word) + 1) / 2 > target:
+            pieces.append(current)
+            current = []
+        current.append(word)
+        length += len(word) + 1
+    pieces.append(current)
+    return [' '.join(piece) for piece in pieces]
+
+
+class SubtitleTrack:
+    """Cues to add to an encode, burned in with ``style`` or muxed as a soft track"""
+
+    def __init__(self, cues, style, mode='burn'):
+        self.cues = cues
+        self.style = style
+        self.mode = mode
+
+    def key_parts(self):
+        """What distinguishes this track in a cache key"""
+        return [self.mode, self.style.name, *(f'{cue.start}:{cue.end}:{cue.text}' for cue in self.cues)]
+
+
+def split_cues(text, line_chars):
+    """Split text into sentences, and sentences into pieces that fit MAX_LINES lines"""
+    limit = line_chars * MAX_LINES
+    cues = []
+    for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+        words = sentence.split()
+        if not words:
+            continue
+        length = len(' '.join(words))
+        cues.extend(_split_words(words, math.ceil(length / limit)) if length > limit else [' '.join(words)])
+    return cues
+
+
+def wrap_lines(text, line_chars):
+    """Wrap a cue onto up to MAX_LINES lines of similar length"""
+    if len(text) <= line_chars:
+        return [text]
+    words = text.split()
+    lines = _split_words(words, min(MAX_LINES, len(words)))
+    return [line for line in lines if line]
+
+
+def reading_weight(text):
+    """How long a piece of text takes to read, in characters"""
+    weight = len(text.replace(' ', '')) + WORD_PAUSE * len(text.split())
+    if text.rstrip().endswith(('.', '!', '?')):
+        weight += SENTENCE_PAUSE
+    return weight
+
+
+def build_cues(text, duration, style):
+    """Cues covering ``duration`` seconds, each lasting in proportion to its reading weight.
+
+    Times are rounded to FRAME_STEP.
+    """
+    pieces = split_cues(text, style.line_chars)
+    if not pieces or duration <= 0:
+        return []
+    weights = [reading_weight(piece) for piece in pieces]
+    total = sum(weights)
+    cues = []
+    elapsed = 0
+    start = 0.0
+    for piece, weight in zip(pieces, weights):
+        elapsed += weight
+        end = round(round(duration * elapsed / total / FRAME_STEP) * FRAME_STEP, 2)
+        if end > start:
+            cues.append(Cue(start, end, wrap_lines(piece, style.line_chars)))
+            start = end
+    return cues
+
+
+def trim_cues(cues, length):
+    """Drop cues that start after ``length`` seconds and cut the rest off there.
+
+    With -shortest, a subtitle packet beyond the end of the output holds
+    back the video until nothing of it is written.
+    """
+    return [Cue(cue.start, min(cue.end, round(length, 2)), cue.lines) for cue in cues if cue.start < length]
+
+
+def _srt_time(seconds):
+    millis = int(round(seconds * 1000))
+    return f'{millis // 3600000:02d}:{millis // 60000 % 60:02d}:{millis // 1000 % 60:02d},{millis % 1000:03d}'
+
+
+def _ass_time(seconds):
+    centis = int(round(seconds * 100))
+    return f'{centis // 360000}:{centis // 6000 % 60:02d}:{centis // 100 % 60:02d}.{centis % 100:02d}'
+
+
+def _ass_escape(line):
+    # Braces start override blocks and a backslash starts an escape in ASS
+    return line.replace('\\', '\\\\').replace('{', '\\{').replace('}', '\\}')
+
+
+def write_srt(cues, path):
+    """Write cues as SubRip, the input FFmpeg converts to a mov_text track"""
+    blocks = [f'{index}\n{_srt_time(cue.start)} --> {_srt_time(cue.end)}\n' + '\n'.join(cue.lines)
+              for index, cue in enumerate(cues, 1)]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n\n'.join(blocks) + '\n')
+    return path
+
+
+def write_ass(cues, path, style):
+    """Write cues as an ASS script using ``style``, for the ass filter"""
+    lines = [
+        '[Script Info]',
+        'ScriptType: v4.00+',
+        f'PlayResX: {PLAY_RES[0]}',
+        f'PlayResY: {PLAY_RES[1]}',
+        'WrapStyle: 2',  # Lines are already wrapped here; libass must not rewrap them
+        'ScaledBorderAndShadow: yes',
+        '',
+        '[V4+ Styles]',
+        'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, '
+        'Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, '
+        'Shadow, Alignment, MarginL, MarginR, MarginV, Encoding',
+        style.ass_style(),
+        '',
+        '[Events]',
+        'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text',
+    ]
+    for cue in cues:
+        text = '\\N'.join(_ass_escape(line) for line in cue.lines)
+        start, end = max(0, cue.start - ASS_LEAD), cue.end - ASS_LEAD
+        lines.append(f'Dialogue: 0,{_ass_time(start)},{_ass_time(end)},Default,,0,0,0,,{text}')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def subtitle_track(text, style, mode, duration, length=None, can_burn=True):
+    """Cues for ``text`` timed over ``duration`` seconds as a SubtitleTrack, or None without any.
+
+    Cues are cut off at ``length``, where the video ends. Burned-in
+    subtitles become a soft track when ``can_burn`` is false.
+    """
+    cues = build_cues(text, duration, style) if text else []
+    if length is not None:
+        cues = trim_cues(cues, length)
+    if not cues:
+        return None
+    return SubtitleTrack(cues, style, mode if can_burn else 'soft')
+
+
+def cue_boundaries(cues):
+    """Times after the start at which a subtitle appears or disappears"""
+    return sorted({time for cue in cues for time in (cue.start, cue.end) if time > 0})
@@ -0,0 +1,55 @@
+import os
+import struct
+import sys
+import wave
+import zlib
+
+import pytest
+
+FAKE_FFMPEG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fake_ffmpeg.py')
+
+
+def write_wav(path, seconds, rate=8000):
+    """A silent mono 16-bit WAV of ``seconds``"""
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b'\0\0' * int(seconds * rate))
+    return str(path)
+
+
+def write_png(path, width=64, height=36):
+    """A black RGB PNG"""
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress((b'\0' + b'\0\0\0' * width) * height)))
+        f.write(chunk(b'IEND', b''))
+    return str(path)
+
+
+@pytest.fixture
+def media(tmp_path):
+    """Factory for (audio path, image paths) of a given audio length and image count"""
+    def make(audio_seconds, image_count):
+        audio = write_wav(tmp_path / 'audio.wav', audio_seconds)
+        images = [write_png(tmp_path / f'image{i}.png') for i in range(image_count)]
+        return audio, images
+    return make
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Put fake_ffmpeg.py on PATH as ``ffmpeg``, finishing at once; returns the wrapper's path"""
+    folder = tmp_path / 'bin'
+    folder.mkdir()
+    wrapper = folder / 'ffmpeg'
+    wrapper.write_text(f'#!/bin/sh\nexec {sys.executable} {FAKE_FFMPEG} "$@"\n')
+    wrapper.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{folder}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setenv('FAKE_FFMPEG_PROFILE', 'instant')
+    return str(wrapper)
@@ -0,0 +1,126 @@
+import threading
+import time
+
+import pytest
+
+from admission import MB, AdmissionController, AdmissionError, EncodeCost
+
+
+def cost(threads=1, memory_mb=100, seconds=60):
+    return EncodeCost(memory_mb * MB, threads, seconds)
+
+
+def acquire_in_thread(controller, encode_cost, admitted, name, timeout=5):
+    """Wait for admission in a thread, appending ``name`` to ``admitted`` once in"""
+    def run():
+        ticket = controller.acquire(encode_cost, timeout)
+        admitted.append((name, ticket))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def test_encodes_are_admitted_in_arrival_order():
+    controller = AdmissionController(memory_budget=1000 * MB, thread_budget=4)
+    running = controller.acquire(cost(threads=2))
+    admitted = []
+    big = acquire_in_thread(controller, cost(threads=4), admitted, 'big')
+    wait_until(lambda: controller.waiting() == 1)
+    small = acquire_in_thread(controller, cost(threads=1), admitted, 'small')
+    wait_until(lambda: controller.waiting() == 2)
+
+    # The small encode would fit beside the running one, but waits its turn
+    time.sleep(0.05)
+    assert admitted == []
+
+    controller.release(running)
+    big.join(5)
+    assert [name for name, _ in admitted] == ['big']
+    controller.release(admitted[0][1])
+    small.join(5)
+    assert [name for name, _ in admitted] == ['big', 'small']
+
+
+def test_an_encode_is_admitted_when_nothing_else_runs():
+    controller = AdmissionController(memory_budget=1000 * MB, thread_budget=2)
+    ticket = controller.acquire(cost(threads=8), timeout=0)
+    assert controller.stats()['committed_threads'] == 8
+    controller.release(ticket)
+    assert controller.stats()['committed_threads'] == 0
+
+
+def test_memory_is_committed_and_released():
+    controller = AdmissionController(memory_budget=250 * MB, thread_budget=8)
+    with controller.admit(cost(memory_mb=100)):
+        with controller.admit(cost(memory_mb=100)):
+            assert controller.stats()['committed_memory_mb'] == 200
+            with pytest.raises(AdmissionError):
+                controller.acquire(cost(memory_mb=100), timeout=0.01)
+    assert controller.stats()['committed_memory_mb'] == 0
+
+
+def test_full_line_is_rejected_with_429():
+    controller = AdmissionController(memory_budget=1000 * MB, thread_budget=1, max_waiting=1)
+    running = controller.acquire(cost())
+    admitted = []
+    waiter = acquire_in_thread(controller, cost(), admitted, 'waiter')
+    wait_until(lambda: controller.waiting() == 1)
+
+    with pytest.raises(AdmissionError) as error:
+        controller.acquire(cost(), timeout=5)
+    assert error.value.status == 429
+    assert error.value.retry_after
+    assert controller.stats()['rejected'] == 1
+
+    controller.release(running)
+    waiter.join(5)
+    assert admitted
+
+
+def test_timeout_is_rejected_with_503_and_retry_after():
+    controller = AdmissionController(memory_budget=1000 * MB, thread_budget=1)
+    controller.acquire(cost(seconds=40))
+    with pytest.raises(AdmissionError, match='not admitted within') as error:
+        controller.acquire(cost(), timeout=0.05)
+    assert error.value.status == 503
+    # Predicted from when the running encode should finish
+    assert 30 <= error.value.retry_after <= 40
+    assert controller.waiting() == 0
+
+
+def test_release_wakes_the_next_waiter():
+    controller = AdmissionController(memory_budget=1000 * MB, thread_budget=1)
+    running = controller.acquire(cost())
+    admitted = []
+    waiter = acquire_in_thread(controller, cost(), admitted, 'waiter')
+    wait_until(lambda: controller.waiting() == 1)
+
+    controller.release(running)
+    waiter.join(1)
+    assert [name for name, _ in admitted] == ['waiter']
+    assert controller.stats()['active'] == 1
+
+
+def test_releasing_twice_changes_nothing():
+    controller = AdmissionController(memory_budget=1000 * MB, thread_budget=4)
+    ticket = controller.acquire(cost(threads=2))
+    controller.release(ticket)
+    controller.release(ticket)
+    assert controller.stats()['committed_threads'] == 0
+
+
+def test_encode_over_the_memory_budget_is_rejected_with_413():
+    controller = AdmissionController(memory_budget=100 * MB, thread_budget=4)
+    with pytest.raises(AdmissionError, match='more than the 100 MB budget') as error:
+        controller.check(cost(memory_mb=101))
+    assert error.value.status == 413
+    with pytest.raises(AdmissionError):
+        controller.acquire(cost(memory_mb=101))
+    assert controller.waiting() == 0
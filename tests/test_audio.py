@@ -0,0 +1,86 @@
+import pytest
+
+from audio import COPY_HEADROOM, _parse_loudnorm, plan_audio
+from conftest import write_wav
+from profiles import get_profile
+
+PROFILE = get_profile('standard')  # 128k, so AAC up to 192 kbit/s is copied
+
+
+def write_adts(path, frame_length, frames=100):
+    """AAC LC at 44.1 kHz in ADTS frames of ``frame_length`` bytes: 1024 samples each"""
+    header = bytes([0xFF, 0xF1, 0x50, 0x80 | (frame_length >> 11), (frame_length >> 3) & 0xFF,
+                    ((frame_length & 7) << 5) | 0x1F, 0xFC])
+    with open(path, 'wb') as f:
+        f.write((header + b'\0' * (frame_length - 7)) * frames)
+    return str(path)
+
+
+def frame_length_for(bits_per_second):
+    return bits_per_second * 1024 / 44100 / 8
+
+
+def test_aac_within_the_headroom_is_copied(tmp_path):
+    limit = 128000 * COPY_HEADROOM
+    path = write_adts(tmp_path / 'a.aac', int(frame_length_for(limit)))
+    audio = plan_audio(path, str(tmp_path), PROFILE)
+    assert audio.mode == 'copy'
+    assert audio.output_path == path
+    assert audio.mux_args() == ['-c:a', 'copy']
+
+
+def test_aac_just_over_the_headroom_is_transcoded(tmp_path):
+    limit = 128000 * COPY_HEADROOM
+    path = write_adts(tmp_path / 'a.aac', int(frame_length_for(limit)) + 1)
+    audio = plan_audio(path, str(tmp_path), PROFILE)
+    assert audio.mode == 'transcode'
+    assert audio.output_path == str(tmp_path / 'audio_standard.m4a')
+    assert audio.encoder_args == ['-c:a', 'aac', '-b:a', '128k']
+
+
+def test_other_codecs_are_transcoded(tmp_path):
+    audio = plan_audio(write_wav(tmp_path / 'a.wav', 1), str(tmp_path), PROFILE, encoder='libfdk_aac')
+    assert audio.mode == 'transcode'
+    assert audio.encoder_args == ['-c:a', 'libfdk_aac', '-b:a', '128k']
+
+
+def test_normalizing_transcodes_even_copyable_aac(tmp_path):
+    path = write_adts(tmp_path / 'a.aac', 100)
+    audio = plan_audio(path, str(tmp_path), PROFILE, normalize=True)
+    assert (audio.mode, audio.normalize) == ('transcode', True)
+    assert audio.encoder_args[-2:] == ['-ar', '44100']  # Never above the source rate
+    assert audio.output_path.endswith('audio_normalized_standard.m4a')
+    assert 'loudnorm=I=-16:TP=-1.5:LRA=11' in audio.key_parts()
+
+
+LOUDNORM_LOG = '''size=N/A time=00:00:10.00 bitrate=N/A speed= 512x
+[Parsed_loudnorm_0 @ 0x55d5c8c0] 
+{
+	"input_i" : "-23.54",
+	"input_tp" : "-7.12",
+	"input_lra" : "3.90",
+	"input_thresh" : "-34.01",
+	"output_i" : "-16.02",
+	"output_tp" : "-1.50",
+	"output_lra" : "3.50",
+	"output_thresh" : "-26.44",
+	"normalization_type" : "dynamic",
+	"target_offset" : "0.02"
+}'''
+
+
+def test_parse_loudnorm_keeps_the_second_pass_fields():
+    assert _parse_loudnorm(LOUDNORM_LOG) == {'input_i': '-23.54', 'input_tp': '-7.12', 'input_lra': '3.90',
+                                             'input_thresh': '-34.01', 'target_offset': '0.02'}
+
+
+@pytest.mark.parametrize('stderr', [
+    LOUDNORM_LOG.replace('"-23.54"', '"-inf"').replace('"-7.12"', '"-inf"'),  # Silence
+    LOUDNORM_LOG.replace('"target_offset" : "0.02"', '"target_offset" : "inf"'),
+    LOUDNORM_LOG.replace('"input_lra" : "3.90",\n', ''),
+    LOUDNORM_LOG[:-1],  # Cut off before the closing brace
+    'Conversion failed!',
+    '',
+])
+def test_parse_loudnorm_rejects_unusable_measurements(stderr):
+    assert _parse_loudnorm(stderr) is None
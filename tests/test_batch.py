@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+from batch import parse_variants
+from profiles import get_profile
+
+
+def test_variant_is_clipped_to_the_audio():
+    variant, = parse_variants('[{"images": [2, 0, 1], "durations": [30, 30, 30]}]', 3)
+    variant.clip(45)
+    assert variant.image_indices == [2, 0]
+    assert variant.durations == [30, 15]
+
+
+@pytest.mark.parametrize('field', ['profile', 'subtitle_style', 'subtitle_mode', 'subtitle_text'])
+def test_text_fields_must_be_strings(field):
+    with pytest.raises(ValueError, match=f'Variant 0: {field} must be a string'):
+        parse_variants(json.dumps([{'name': 'a', field: 3}]), 1)
+
+
+def test_null_text_fields_use_the_defaults():
+    variant, = parse_variants('[{"name": "a", "profile": null, "subtitle_style": null}]', 1)
+    assert variant.profile.name == get_profile().name
+    assert variant.subtitle_text == ''
@@ -0,0 +1,128 @@
+import os
+import shutil
+
+import cache as cache_module
+from cache import ContentCache, make_key
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+def test_hit_is_a_hard_link(tmp_path):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=1000)
+    src = write(tmp_path / 'src', 10)
+    cache.put('video-a', src)
+
+    dest = str(tmp_path / 'dest')
+    assert cache.get('video-a', dest)
+    assert os.path.samefile(dest, os.path.join(cache.root, 'video-a'))
+    assert cache.stats()['hits'] == {'video': 1}
+
+
+def test_copies_across_filesystems_run_outside_the_lock(tmp_path, monkeypatch):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=1000)
+    copies = []
+
+    def copy_only(src, dest):
+        # As when the cache and the session folders are on different filesystems
+        copies.append(cache._lock.locked())
+        shutil.copyfile(src, dest)
+
+    monkeypatch.setattr(cache_module, '_link_or_copy', copy_only)
+    cache.put('image-a', write(tmp_path / 'src', 10))
+    dest = str(tmp_path / 'dest')
+    assert cache.get('image-a', dest)
+    assert copies == [False, False]
+    assert not os.path.samefile(dest, os.path.join(cache.root, 'image-a'))
+    assert [name for name in os.listdir(cache.root)] == ['image-a']
+
+
+def test_racing_puts_of_one_key_count_it_once(tmp_path, monkeypatch):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=1000)
+    link = cache_module._link_or_copy
+
+    def put_again_meanwhile(src, dest):
+        monkeypatch.setattr(cache_module, '_link_or_copy', link)
+        cache.put('image-a', src)
+        link(src, dest)
+
+    monkeypatch.setattr(cache_module, '_link_or_copy', put_again_meanwhile)
+    cache.put('image-a', write(tmp_path / 'src', 10))
+    assert cache.stats()['size_bytes'] == 10
+    assert os.listdir(cache.root) == ['image-a']
+
+
+def test_entry_evicted_during_a_hit_is_a_miss(tmp_path, monkeypatch):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=1000)
+    cache.put('image-a', write(tmp_path / 'src', 10))
+    os.remove(os.path.join(cache.root, 'image-a'))
+    assert not cache.get('image-a', str(tmp_path / 'dest'))
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['size_bytes'] == 0
+
+
+def test_miss(tmp_path):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=1000)
+    assert not cache.get('video-a', str(tmp_path / 'dest'))
+    assert not os.path.exists(tmp_path / 'dest')
+    assert cache.stats()['misses'] == {'video': 1}
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=25)
+    for key in ('image-a', 'image-b'):
+        cache.put(key, write(tmp_path / key, 10))
+    cache.get('image-a', str(tmp_path / 'used'))  # b is now the oldest
+
+    cache.put('image-c', write(tmp_path / 'image-c', 10))
+
+    assert sorted(os.listdir(cache.root)) == ['image-a', 'image-c']
+    assert cache.stats()['size_bytes'] == 20
+
+
+def test_eviction_leaves_linked_copies_intact(tmp_path):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=15)
+    cache.put('video-a', write(tmp_path / 'a', 10))
+    dest = str(tmp_path / 'served')
+    cache.get('video-a', dest)
+
+    cache.put('video-b', write(tmp_path / 'b', 10))
+
+    assert not os.path.exists(os.path.join(cache.root, 'video-a'))
+    assert os.path.getsize(dest) == 10
+
+
+def test_files_over_the_limit_are_not_stored(tmp_path):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=5)
+    cache.put('video-a', write(tmp_path / 'a', 10))
+    assert cache.stats()['entries'] == 0
+
+
+def test_disabled_cache_does_nothing(tmp_path):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=0)
+    cache.put('video-a', write(tmp_path / 'a', 10))
+    assert not cache.get('video-a', str(tmp_path / 'dest'))
+    assert not os.path.exists(cache.root)
+
+
+def test_index_is_rebuilt_oldest_first_after_a_restart(tmp_path):
+    root = str(tmp_path / 'cache')
+    first = ContentCache(root, max_bytes=25)
+    for i, key in enumerate(('image-a', 'image-b')):
+        first.put(key, write(tmp_path / key, 10))
+        os.utime(os.path.join(root, key), (1000 + i, 1000 + i))
+    write(os.path.join(root, '.tmp-leftover'), 10)
+
+    second = ContentCache(root, max_bytes=25)
+    second.put('image-c', write(tmp_path / 'image-c', 10))
+
+    assert sorted(os.listdir(root)) == ['image-b', 'image-c']
+
+
+def test_keys_depend_on_every_part():
+    assert make_key('video', 'a', 'b') == make_key('video', 'a', 'b')
+    assert make_key('video', 'a', 'b') != make_key('video', 'ab')
+    assert make_key('video', 'a').startswith('video-')
@@ -0,0 +1,115 @@
+import pytest
+
+import capabilities
+from capabilities import RETRY_INTERVAL, Capabilities, _list_names, get_capabilities, probe_capabilities
+
+# Trimmed from `ffmpeg -hide_banner -encoders` and `-filters` of FFmpeg 7
+ENCODERS = '''Encoders:
+ V..... = Video
+ A..... = Audio
+ S..... = Subtitle
+ .F.... = Frame-level multithreading
+ ..S... = Slice-level multithreading
+ ...X.. = Codec is experimental
+ ....B. = Supports draw_horiz_band
+ .....D = Supports direct rendering method 1
+ ------
+ V....D a64multi             Multicolor charset for Commodore 64 (codec a64_multi)
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ V....D libx264rgb           libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 RGB (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+ S..... mov_text             3GPP Timed Text subtitle
+'''
+FILTERS = '''Filters:
+  T.. = Timeline support
+  .S. = Slice threading
+  ..C = Command support
+  A = Audio input/output
+  V = Video input/output
+  N = Dynamic number and/or type of input/output
+  | = Source or sink filter
+ TSC aap               AA->A      Apply Affine Projection algorithm to first audio stream.
+ ..C amix              N->A       Audio mixing.
+ ... loudnorm          A->A       EBU R128 loudness normalization
+ ... anullsrc          |->A       Null audio source, return empty audio frames.
+ ... ass               V->V       Render ASS subtitles onto input video using the libass library.
+'''
+
+
+def test_encoder_rows_are_read_and_the_legend_skipped():
+    assert _list_names(ENCODERS) == {'a64multi', 'libx264', 'libx264rgb', 'aac', 'mov_text'}
+
+
+def test_filter_rows_are_read_and_the_legend_skipped():
+    assert _list_names(FILTERS) == {'aap', 'amix', 'loudnorm', 'anullsrc', 'ass'}
+
+
+def test_preferred_encoders():
+    assert Capabilities('ffmpeg', encoders={'mpeg4', 'libopenh264'}).video_encoder() == 'libopenh264'
+    assert Capabilities('ffmpeg', encoders={'mpeg4'}).video_encoder() == 'mpeg4'
+    assert Capabilities('ffmpeg', encoders={'libfdk_aac'}).audio_encoder() == 'libfdk_aac'
+    assert Capabilities().video_encoder() == 'libx264'  # Unknown until probed
+
+
+def test_probe_runs_the_binary(fake_ffmpeg):
+    probed = probe_capabilities()
+    assert probed.ffmpeg_available
+    assert probed.ffmpeg_version.startswith('ffmpeg version 6.0-fake')
+    assert probed.video_encoder() == 'libx264'
+    assert probed.has_filter('ass') and probed.has_filter('loudnorm')
+
+
+def test_probe_without_ffmpeg(monkeypatch, tmp_path):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    probed = probe_capabilities()
+    assert not probed.ffmpeg_available
+    assert probed.error
+
+
+@pytest.fixture
+def probes(monkeypatch):
+    """Count probes; the next result is whatever ``probes.result`` holds"""
+    class Probes:
+        count = 0
+        result = Capabilities('ffmpeg version 7')
+
+    def probe():
+        Probes.count += 1
+        return Probes.result
+
+    monkeypatch.setattr(capabilities, 'probe_capabilities', probe)
+    monkeypatch.setattr(capabilities, '_capabilities', None)
+    monkeypatch.setattr(capabilities, '_stale', False)
+    return Probes
+
+
+def test_table_is_probed_once(probes):
+    assert get_capabilities() is get_capabilities()
+    assert probes.count == 1
+
+
+def test_invalidate_probes_again_on_the_next_lookup(probes):
+    get_capabilities()
+    capabilities.invalidate()
+    assert probes.count == 1  # Not until someone asks
+    get_capabilities()
+    get_capabilities()
+    assert probes.count == 2
+
+
+def test_missing_ffmpeg_is_probed_again_after_the_retry_interval(probes):
+    probes.result = Capabilities(error='ffmpeg: not found')
+    missing = get_capabilities()
+    get_capabilities()
+    assert probes.count == 1
+
+    missing.probed_at -= RETRY_INTERVAL + 1
+    probes.result = Capabilities('ffmpeg version 7')
+    assert get_capabilities().ffmpeg_available
+    assert probes.count == 2
+
+
+def test_a_working_ffmpeg_is_not_probed_again_on_a_timer(probes):
+    get_capabilities().probed_at -= RETRY_INTERVAL + 1
+    get_capabilities()
+    assert probes.count == 1
@@ -0,0 +1,29 @@
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import JobQueue, QueueFullError
+
+
+def test_full_queue_rejects_the_job_and_forgets_it():
+    release = threading.Event()
+    job_queue = JobQueue(workers=1, max_pending=1)
+    running = job_queue.submit(release.wait)
+    while running.state != jobs.JOB_RUNNING:
+        time.sleep(0.01)
+    job_queue.submit(release.wait)
+    with pytest.raises(QueueFullError):
+        job_queue.submit(release.wait)
+    assert len(job_queue._jobs) == 2
+    release.set()
+
+
+def test_expired_jobs_are_pruned_without_new_submissions(monkeypatch):
+    monkeypatch.setattr(jobs, 'PRUNE_INTERVAL', 0.05)
+    expired = threading.Event()
+    job_queue = JobQueue(workers=1, ttl=0)
+    job = job_queue.submit(lambda: None, on_expire=lambda job: expired.set())
+    assert expired.wait(5)
+    assert job_queue.get(job.id) is None
@@ -0,0 +1,43 @@
+import threading
+
+import pytest
+
+from progress import Progress
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    # pipeline creates its session root in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    import main
+    return main
+
+
+def test_event_streams_over_the_limit_get_429(main, monkeypatch):
+    import handlers
+    monkeypatch.setattr(main, 'event_streams', threading.BoundedSemaphore(1))
+    release = threading.Event()
+    job = handlers.job_queue.submit(release.wait, progress=Progress())
+    client = main.app.test_client()
+    try:
+        first = client.get(f'/jobs/{job.id}/events')
+        assert first.status_code == 200
+
+        second = client.get(f'/jobs/{job.id}/events')
+        assert second.status_code == 429
+        assert second.headers['Retry-After']
+
+        # Closing a stream frees its slot
+        first.close()
+        third = client.get(f'/jobs/{job.id}/events')
+        assert third.status_code == 200
+        third.close()
+    finally:
+        release.set()
+
+
+def test_missing_jobs_do_not_take_a_slot(main, monkeypatch):
+    monkeypatch.setattr(main, 'event_streams', threading.BoundedSemaphore(1))
+    client = main.app.test_client()
+    assert client.get('/jobs/missing/events').status_code == 404
+    assert main.event_streams.acquire(blocking=False)
@@ -0,0 +1,90 @@
+from werkzeug.datastructures import MultiDict
+
+from uploads import UploadedFile
+
+
+class FakeSession:
+    def __init__(self, path):
+        self.id = 'session'
+        self.path = str(path)
+
+
+def plan(tmp_path, monkeypatch, media, audio_seconds, image_count, **options):
+    # pipeline creates its session root in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    from pipeline import plan_render
+
+    audio, images = media(audio_seconds, image_count)
+    files = MultiDict([('audio', UploadedFile('audio', 'audio.wav', audio, 'wav'))]
+                      + [('images', UploadedFile('images', 'image.png', path, 'png')) for path in images])
+    return plan_render(FakeSession(tmp_path), MultiDict(options), files)
+
+
+def test_timeline_is_clipped_to_the_audio(tmp_path, monkeypatch, media):
+    render = plan(tmp_path, monkeypatch, media, 70, 4, durations='30,30,30,30')
+    assert render.durations == [30, 30, 10]
+    assert len(render.image_paths) == 3
+    assert render.output_seconds == 70
+
+
+def test_chunked_timeline_is_clipped_to_the_audio(tmp_path, monkeypatch, media):
+    render = plan(tmp_path, monkeypatch, media, 70, 4, durations='30,30,30,30', chunked='true')
+    assert sum(render.durations) == 70
+
+
+def test_timeline_shorter_than_the_audio_is_kept(tmp_path, monkeypatch, media):
+    render = plan(tmp_path, monkeypatch, media, 70, 3, durations='3,4,5')
+    assert render.durations == [3, 4, 5]
+
+
+def test_images_default_to_two_seconds(tmp_path, monkeypatch, media):
+    render = plan(tmp_path, monkeypatch, media, 12, 3)
+    assert render.durations == [2, 2, 2]
+
+
+def test_spread_over_audio_shares_the_audio_between_images(tmp_path, monkeypatch, media):
+    render = plan(tmp_path, monkeypatch, media, 12, 3, spread_over_audio='true')
+    assert render.durations == [4, 4, 4]
+
+
+def maps(cmd):
+    return [cmd[i + 1] for i, arg in enumerate(cmd) if arg == '-map']
+
+
+def test_copied_audio_never_brings_its_own_video(tmp_path, monkeypatch, media):
+    # An MP4 upload with a video track is copied as it is; only its audio may be used
+    render = plan(tmp_path, monkeypatch, media, 6, 2)
+    from audio import AudioPlan
+    from pipeline import prepare_encode
+    copy = AudioPlan(str(tmp_path / 'upload.m4a'), str(tmp_path / 'upload.m4a'), 'copy', 'digest')
+    cmd, _ = prepare_encode(str(tmp_path), copy, render.image_paths, render.durations, render.profile,
+                            ['out.mp4'])
+    assert maps(cmd) == ['0:v', '1:a']
+
+
+def test_soft_subtitles_add_one_track(tmp_path, monkeypatch, media):
+    render = plan(tmp_path, monkeypatch, media, 6, 2, subtitle_text='Hello there.', subtitle_mode='soft')
+    from pipeline import prepare_encode
+    cmd, _ = prepare_encode(str(tmp_path), render.audio, render.image_paths, render.durations, render.profile,
+                            ['out.mp4'], subtitles=render.subtitles)
+    assert maps(cmd) == ['0:v', '1:a', '2:s']
+    # Output options come after every input
+    assert cmd.index('-map') > max(i for i, arg in enumerate(cmd) if arg == '-i')
+
+
+def test_chunked_encode_falls_back_to_one_segment_over_the_memory_budget(tmp_path, monkeypatch, media):
+    monkeypatch.chdir(tmp_path)
+    import pipeline
+    from admission import admission
+    monkeypatch.setattr(pipeline, 'segment_count', lambda *args: 4)
+    monkeypatch.setattr(admission, 'memory_budget', 10 ** 12)
+    render = plan(tmp_path, monkeypatch, media, 120, 4, durations='30,30,30,30', chunked='true')
+    assert render.segments == 4
+
+    # Four parallel encoders need more than the budget, one still fits
+    single = pipeline.predict_cost(render.audio.source_path, render.image_paths, render.durations, render.profile)
+    assert render.cost.memory_bytes > single.memory_bytes
+    monkeypatch.setattr(admission, 'memory_budget', single.memory_bytes)
+    render = plan(tmp_path, monkeypatch, media, 120, 4, durations='30,30,30,30', chunked='true')
+    assert render.segments == 1
+    assert render.cost.memory_bytes == single.memory_bytes
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import preprocess
+from cache import ContentCache
+from conftest import write_png
+from preprocess import fit_size, normalize_image, preprocess_images
+from probe import probe
+
+
+@pytest.mark.parametrize('size, expected', [
+    ((4000, 3000), (1440, 1080)),
+    ((1080, 1920), (606, 1080)),  # 607.5 rounds down to even
+    ((640, 360), (1920, 1080)),  # Small images are scaled up to the box
+    ((1001, 563), (1920, 1078)),
+    ((1921, 1081), (1918, 1080)),
+    ((1, 10000), (2, 1080)),  # Never below 2 pixels
+])
+def test_fit_size_keeps_the_aspect_ratio_in_even_numbers(size, expected):
+    assert fit_size(*size) == expected
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ContentCache(str(tmp_path / 'cache'), max_bytes=10 * 1024 * 1024)
+    monkeypatch.setattr(preprocess, 'media_cache', cache)
+    return cache
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_images_become_jpegs_that_fill_the_box(tmp_path, cache):
+    path = write_png(tmp_path / 'a.png', width=320, height=240)
+    record = normalize_image(path)
+    assert (record['method'], record['cached'], record['width'], record['height']) == ('pillow', False, 1440, 1080)
+    info = probe(path)
+    assert (info.format, info.width, info.height) == ('jpg', 1440, 1080)
+    assert not os.path.exists(path + '_opt.jpg')
+
+
+def test_the_same_image_again_is_a_cache_hit(tmp_path, cache):
+    first = write_png(tmp_path / 'a.png', width=320, height=240)
+    second = write_png(tmp_path / 'b.png', width=320, height=240)
+    normalize_image(first)
+    record = normalize_image(second)
+    assert record['cached'] is True
+    assert read(first) == read(second)
+    assert cache.stats()['hits'] == {'image': 1}
+
+
+def test_a_broken_image_is_left_untouched(tmp_path, cache):
+    path = str(tmp_path / 'broken.png')
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\nnot really')
+    record = normalize_image(path)
+    assert 'error' in record
+    assert read(path) == b'\x89PNG\r\n\x1a\nnot really'
+    assert sorted(os.listdir(tmp_path)) == ['broken.png', 'cache']
+    assert cache.stats()['entries'] == 0
+
+
+def test_records_come_back_in_order(tmp_path, cache):
+    paths = [write_png(tmp_path / f'{i}.png', width=32 + 2 * i, height=18) for i in range(5)]
+    records = preprocess_images(paths, max_workers=3)
+    assert [record['path'] for record in records] == paths
+    assert all('error' not in record for record in records)
+
+
+def test_without_pillow_ffmpeg_converts_the_image(tmp_path, cache, monkeypatch, fake_ffmpeg):
+    monkeypatch.setattr(preprocess, 'Image', None)
+    path = write_png(tmp_path / 'a.png')
+    record = normalize_image(path)
+    assert (record['method'], record['cached']) == ('ffmpeg', False)
+    assert 'error' not in record
+
+
+def test_a_failed_ffmpeg_conversion_leaves_the_original(tmp_path, cache, monkeypatch, fake_ffmpeg):
+    monkeypatch.setattr(preprocess, 'Image', None)
+    monkeypatch.setenv('FAKE_FFMPEG_FAILURE_RATE', '1')
+    path = write_png(tmp_path / 'a.png')
+    original = read(path)
+    record = normalize_image(path)
+    assert 'Conversion failed' in record['error']
+    assert read(path) == original
+    assert not os.path.exists(path + '_opt.jpg')
@@ -0,0 +1,111 @@
+import struct
+
+import pytest
+
+import probe as probe_module
+from conftest import write_png, write_wav
+from probe import MediaInfo, probe
+
+MP3_FRAME = b'\xff\xfb\x90\x00'  # MPEG-1 layer 3, 128 kbit/s, 44.1 kHz, stereo
+MP3_FRAME_LENGTH = 417  # 144 * 128000 // 44100
+
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def box(kind, *children):
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def adts_frame(length=100):
+    # AAC LC, 44.1 kHz, stereo, one raw block
+    return bytes([0xFF, 0xF1, 0x50, 0x80 | (length >> 11), (length >> 3) & 0xFF,
+                  ((length & 7) << 5) | 0x1F, 0xFC]) + b'\0' * (length - 7)
+
+
+def test_wav(tmp_path):
+    info = probe(write_wav(tmp_path / 'a.wav', 2.5, rate=16000))
+    assert info.to_dict() == {'format': 'wav', 'duration': 2.5, 'codec': 'pcm_s16le', 'sample_rate': 16000,
+                              'channels': 1, 'width': None, 'height': None, 'source': 'header'}
+
+
+def test_wav_with_a_streaming_data_size_runs_to_the_end(tmp_path):
+    with open(write_wav(tmp_path / 'a.wav', 1), 'rb') as f:
+        data = bytearray(f.read())
+    data[40:44] = b'\xff\xff\xff\xff'
+    assert probe(write(tmp_path / 'b.wav', data)).duration == pytest.approx(1)
+
+
+def test_mp3_frames_are_counted(tmp_path):
+    frame = MP3_FRAME + b'\0' * (MP3_FRAME_LENGTH - 4)
+    id3 = b'ID3\x04\0\0\0\0\0\x0a' + b'\0' * 10
+    info = probe(write(tmp_path / 'a.mp3', id3 + frame * 100 + b'TAG' + b'\0' * 125))
+    assert (info.format, info.codec, info.sample_rate, info.channels) == ('mp3', 'mp3', 44100, 2)
+    assert info.duration == pytest.approx(100 * 1152 / 44100)
+
+
+def test_mp3_frame_count_is_read_from_a_xing_header(tmp_path):
+    # Side information for stereo MPEG-1 is 32 bytes, then the Xing tag
+    xing = b'Xing' + struct.pack('>II', 1, 5000)
+    first = MP3_FRAME + b'\0' * 32 + xing
+    first += b'\0' * (MP3_FRAME_LENGTH - len(first))
+    info = probe(write(tmp_path / 'a.mp3', first + MP3_FRAME + b'\0' * (MP3_FRAME_LENGTH - 4)))
+    assert info.duration == pytest.approx(5000 * 1152 / 44100)
+
+
+def test_adts(tmp_path):
+    info = probe(write(tmp_path / 'a.aac', adts_frame() * 43))
+    assert (info.format, info.codec, info.sample_rate, info.channels) == ('aac', 'aac', 44100, 2)
+    assert info.duration == pytest.approx(43 * 1024 / 44100)
+
+
+def test_mp4(tmp_path):
+    mvhd = box(b'mvhd', struct.pack('>IIIII', 0, 0, 0, 1000, 12345))
+    hdlr = box(b'hdlr', struct.pack('>II4s', 0, 0, b'soun'))
+    entry = box(b'mp4a', b'\0' * 16, struct.pack('>HHHHI', 2, 16, 0, 0, 48000 << 16))
+    stsd = box(b'stsd', struct.pack('>II', 0, 1), entry)
+    trak = box(b'trak', box(b'mdia', hdlr, box(b'minf', box(b'stbl', stsd))))
+    data = box(b'ftyp', b'M4A \0\0\0\0') + box(b'moov', mvhd, trak) + box(b'mdat', b'\0' * 64)
+    info = probe(write(tmp_path / 'a.m4a', data))
+    assert (info.format, info.codec, info.sample_rate, info.channels) == ('m4a', 'aac', 48000, 2)
+    assert info.duration == pytest.approx(12.345)
+
+
+def test_png(tmp_path):
+    info = probe(write_png(tmp_path / 'a.png', width=640, height=360))
+    assert (info.format, info.width, info.height, info.pixels) == ('png', 640, 360, 640 * 360)
+
+
+def test_jpeg_dimensions_come_from_the_frame_header(tmp_path):
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0' + b'\0' * 9
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, 480, 720, 1) + b'\0' * 3
+    info = probe(write(tmp_path / 'a.jpg', b'\xff\xd8' + app0 + sof + b'\xff\xd9'))
+    assert (info.format, info.codec, info.width, info.height) == ('jpg', 'mjpeg', 720, 480)
+
+
+@pytest.mark.parametrize('chunk', [
+    b'VP8X' + struct.pack('<II', 10, 0) + (799).to_bytes(3, 'little') + (599).to_bytes(3, 'little'),
+    b'VP8L' + struct.pack('<IB', 5, 0x2F) + struct.pack('<I', 799 | (599 << 14)) + b'\0' * 5,
+    b'VP8 ' + struct.pack('<I', 10) + b'\0\0\0\x9d\x01\x2a' + struct.pack('<HH', 800, 600),
+])
+def test_webp(tmp_path, chunk):
+    info = probe(write(tmp_path / 'a.webp', b'RIFF' + struct.pack('<I', 4 + len(chunk)) + b'WEBP' + chunk))
+    assert (info.format, info.width, info.height) == ('webp', 800, 600)
+
+
+def test_unparsable_header_falls_back_to_ffprobe(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(probe_module, 'ffprobe', lambda path: calls.append(path) or MediaInfo(source='ffprobe'))
+    path = write(tmp_path / 'a.png', b'\x89PNG\r\n\x1a\n' + b'\0' * 4)
+    assert probe(path).source == 'ffprobe'
+    assert calls == [path]
+
+
+def test_results_are_memoized_by_digest(tmp_path, monkeypatch):
+    first = probe(write_wav(tmp_path / 'a.wav', 1))
+    monkeypatch.setattr(probe_module, '_probe_file', lambda path: pytest.fail('probed again'))
+    assert probe(write_wav(tmp_path / 'copy.wav', 1)) is first
@@ -0,0 +1,118 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+from progress import FFmpegRun, Progress, StderrRing, _parse_seconds, run_ffmpeg
+
+
+@pytest.mark.parametrize('fields, expected', [
+    ({'out_time_us': '2500000', 'out_time_ms': '1'}, 2.5),
+    ({'out_time_ms': '1500000'}, 1.5),  # Microseconds, despite the name
+    ({'out_time_us': 'N/A', 'out_time_ms': '3000000'}, 3.0),
+    ({'out_time_us': '-40000'}, 0.0),
+    ({'out_time_us': 'N/A'}, None),
+    ({}, None),
+])
+def test_parse_seconds(fields, expected):
+    assert _parse_seconds(fields) == expected
+
+
+def test_update_applies_a_progress_block():
+    progress = Progress(total_seconds=10)
+    progress.update({'out_time_us': '4000000', 'speed': '2.0x', 'frame': '100', 'progress': 'continue'})
+    assert progress.version == 1
+    assert progress.to_dict() == {'percent': 40.0, 'speed': 2.0, 'eta_seconds': 3.0, 'out_time_seconds': 4.0,
+                                  'total_seconds': 10, 'frame': 100}
+
+
+def test_update_keeps_values_a_block_does_not_have():
+    progress = Progress(total_seconds=10)
+    progress.update({'out_time_us': '4000000', 'speed': '2x', 'frame': '100'})
+    progress.update({'out_time_us': 'N/A', 'speed': 'N/A', 'frame': ''})
+    assert (progress.out_seconds, progress.speed, progress.frame) == (4.0, 2.0, 100)
+
+
+def test_to_dict_is_complete_once_ffmpeg_reports_the_end():
+    progress = Progress(total_seconds=10)
+    progress.update({'out_time_us': '9960000', 'speed': '1x', 'progress': 'end'})
+    info = progress.to_dict()
+    assert (info['percent'], info['eta_seconds']) == (100.0, 0.0)
+
+
+def test_to_dict_without_a_total_has_no_percent():
+    progress = Progress()
+    progress.update({'out_time_us': '1000000', 'speed': '1x'})
+    assert (progress.to_dict()['percent'], progress.to_dict()['eta_seconds']) == (None, None)
+
+
+def test_children_add_up():
+    progress = Progress(total_seconds=20)
+    first, second = progress.child(10), progress.child(10)
+    first.update({'out_time_us': '5000000', 'speed': '2x', 'frame': '125'})
+    second.update({'out_time_us': '3000000', 'speed': '1x', 'frame': '75'})
+    assert (progress.out_seconds, progress.speed, progress.frame) == (8.0, 3.0, 200)
+
+
+def test_wait_returns_on_the_next_update():
+    progress = Progress()
+    threading.Timer(0.05, progress.finish, (True,)).start()
+    assert progress.wait(0, timeout=5) == 1
+    assert progress.wait(1, timeout=0.01) == 1
+
+
+def test_wait_async_is_woken_from_another_thread():
+    progress = Progress()
+
+    async def scenario():
+        threading.Timer(0.05, progress.update, ({'out_time_us': '1'},)).start()
+        woken = await progress.wait_async(0, timeout=5)
+        timed_out = await progress.wait_async(woken, timeout=0.01)
+        return woken, timed_out
+
+    assert asyncio.run(scenario()) == (1, 1)
+    assert progress._waiters == []
+
+
+def test_stderr_ring_keeps_the_last_lines():
+    ring = StderrRing(max_lines=2)
+    for line in ('one', '', 'two', 'three'):
+        ring.append(line)
+    assert ring.tail() == 'two\nthree'
+    assert ring.tail(1) == 'three'
+
+
+def test_ffmpeg_run_reads_progress_and_stderr(fake_ffmpeg):
+    progress = Progress(total_seconds=2)
+    run = run_ffmpeg(['ffmpeg', '-t', '2', '-f', 'null', '-'], progress, timeout=30)
+    assert run.returncode == 0
+    assert progress.ended and progress.out_seconds == 2.0
+    assert 'Input #0, fake' in run.stderr_tail()
+
+
+EMITTER = '''
+import os, sys, time
+fd = int(sys.argv[sys.argv.index('-progress') + 1][5:])
+os.write(fd, b'frame=1\\nout_time_us=5')
+time.sleep(0.05)
+os.write(fd, b'00000\\nprogress=continue\\nframe=2\\nout_time_us=900000\\nprogress=end\\n')
+sys.stderr.write('frame=1 size=0kB\\rframe=2 size=1kB\\rdone\\nno newline at the end')
+'''
+
+
+def test_ffmpeg_run_joins_split_reads_and_splits_carriage_returns(tmp_path):
+    # Progress blocks can arrive across reads, and stderr status lines end in \r
+    emitter = tmp_path / 'emitter'
+    emitter.write_text(f'#!{sys.executable}\n{EMITTER}')
+    emitter.chmod(0o755)
+    updates = []
+    progress = Progress()
+    progress.update = lambda fields: updates.append(dict(fields))
+    run = FFmpegRun([str(emitter)], progress)
+    assert run.wait(30) == 0
+    assert updates == [{'frame': '1', 'out_time_us': '500000', 'progress': 'continue'},
+                       {'frame': '2', 'out_time_us': '900000', 'progress': 'end'}]
+    assert run.stderr_tail().split('\n') == ['frame=1 size=0kB', 'frame=2 size=1kB', 'done',
+                                             'no newline at the end']
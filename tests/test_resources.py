@@ -0,0 +1,36 @@
+import pytest
+
+import resources
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """A 64-core host whose cgroup files are given as a dict"""
+    files = {}
+    monkeypatch.setattr(resources, '_read', files.get)
+    monkeypatch.setattr(resources.os, 'sched_getaffinity', lambda pid: set(range(64)), raising=False)
+    return files
+
+
+def test_cgroup_v2_quota_caps_the_host_cores(host):
+    host['/sys/fs/cgroup/cpu.max'] = '150000 100000'
+    assert resources.cpu_count() == 2
+
+
+def test_cgroup_v1_quota_caps_the_host_cores(host):
+    host['/sys/fs/cgroup/cpu/cpu.cfs_quota_us'] = '50000'
+    host['/sys/fs/cgroup/cpu/cpu.cfs_period_us'] = '100000'
+    assert resources.cpu_count() == 1
+
+
+@pytest.mark.parametrize('files', [{}, {'/sys/fs/cgroup/cpu.max': 'max 100000'},
+                                   {'/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '-1',
+                                    '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000'}])
+def test_without_a_quota_the_affinity_mask_counts(host, files):
+    host.update(files)
+    assert resources.cpu_count() == 64
+
+
+def test_cgroup_memory_limit(host):
+    host['/sys/fs/cgroup/memory.max'] = str(512 * 1024 * 1024)
+    assert resources.memory_limit() == 512 * 1024 * 1024
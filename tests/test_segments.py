@@ -0,0 +1,38 @@
+import pytest
+
+from segments import MAX_SEGMENTS, MIN_SEGMENT_SECONDS, segment_count, split_timeline
+
+
+@pytest.mark.parametrize('image_count, seconds, cores, expected', [
+    (20, 300, 4, 4),                            # Limited by cores
+    (3, 300, 8, 3),                             # One image per segment at most
+    (20, MIN_SEGMENT_SECONDS * 2 - 1, 8, 1),    # Too short to be worth a second segment
+    (100, 3600, 64, MAX_SEGMENTS),
+    (20, 10, 8, 1),
+])
+def test_segment_count(image_count, seconds, cores, expected):
+    assert segment_count(image_count, seconds, cores) == expected
+
+
+def test_split_cuts_at_the_image_boundary_nearest_each_share():
+    paths = list('abcdef')
+    segments = split_timeline(paths, [10, 10, 10, 10, 10, 10], 3)
+    assert [p for p, _ in segments] == [['a', 'b'], ['c', 'd'], ['e', 'f']]
+
+
+def test_split_follows_uneven_durations():
+    segments = split_timeline(list('abcd'), [50, 10, 10, 30], 2)
+    assert segments == [(['a'], [50]), (['b', 'c', 'd'], [10, 10, 30])]
+
+
+def test_split_leaves_an_image_for_every_segment():
+    segments = split_timeline(list('abc'), [100, 1, 1], 3)
+    assert [p for p, _ in segments] == [['a'], ['b'], ['c']]
+
+
+def test_split_keeps_every_image_in_order():
+    durations = [3.5, 1, 7, 2, 2, 9, 4, 0.5, 6]
+    segments = split_timeline(list(range(9)), durations, 4)
+    assert len(segments) == 4
+    assert [i for p, _ in segments for i in p] == list(range(9))
+    assert [d for _, lengths in segments for d in lengths] == durations
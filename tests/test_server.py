@@ -0,0 +1,137 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from progress import Progress
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # pipeline creates its session root in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    import server
+    return server
+
+
+def get(server, method, path):
+    """Send a bodiless request to the ASGI app; returns (status, headers, body)"""
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'', 'headers': []}
+    asyncio.run(server.app(scope, receive, send))
+    return messages[0]['status'], dict(messages[0]['headers']), b''.join(m.get('body', b'') for m in messages[1:])
+
+
+def test_rules_become_patterns(server):
+    pattern, converters = server.compile_rule('/jobs/<job_id>/variants/<int:index>')
+    match = pattern.match('/jobs/abc/variants/3')
+    assert match.groupdict() == {'job_id': 'abc', 'index': '3'}
+    assert converters == {'index': int}
+    assert pattern.match('/jobs/abc/variants/x') is None
+    assert pattern.match('/jobs/abc/variants/3/more') is None
+
+
+def test_handlers_are_served(server):
+    status, headers, body = get(server, 'GET', '/profiles')
+    assert status == 200
+    assert headers[b'content-type'] == b'application/json'
+    assert json.loads(body)['default']
+
+
+def test_unknown_routes_and_methods(server):
+    assert get(server, 'GET', '/nowhere')[0] == 404
+    assert get(server, 'POST', '/profiles')[0] == 405
+    status, _, body = get(server, 'GET', '/jobs/missing/variants/1')
+    assert status == 404
+    assert json.loads(body) == {'error': 'Batch job not found'}
+
+
+async def open_stream(server, path, sent):
+    """Keep a GET open until its response is over; the client never disconnects"""
+    requested = []
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'headers': []}
+    await server.app(scope, receive, send)
+
+
+def test_event_streams_hold_no_handler_thread(server, monkeypatch):
+    import handlers
+    monkeypatch.setattr(server, 'executor', ThreadPoolExecutor(max_workers=1))
+    release = threading.Event()
+    job = handlers.job_queue.submit(release.wait, progress=Progress())
+
+    async def scenario():
+        streams = [[], []]
+        watchers = [asyncio.ensure_future(open_stream(server, f'/jobs/{job.id}/events', sent)) for sent in streams]
+        while not all(len(sent) > 1 for sent in streams):
+            await asyncio.sleep(0.01)
+
+        # Both streams wait for updates, so the only handler thread is free
+        start = time.perf_counter()
+        status = (await asyncio.wait_for(asyncio.to_thread(get, server, 'GET', '/profiles'), 2))[0]
+        elapsed = time.perf_counter() - start
+
+        release.set()
+        await asyncio.wait_for(asyncio.gather(*watchers), 5)
+        return status, elapsed, streams
+
+    status, elapsed, streams = asyncio.run(scenario())
+    assert status == 200
+    assert elapsed < 1
+    for sent in streams:
+        assert b'event: done' in b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_uploads_are_received_without_a_handler_thread(server, monkeypatch):
+    import handlers
+    monkeypatch.setattr(server, 'executor', ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(handlers, 'get_capabilities', lambda: type('Capabilities', (), {'ffmpeg_available': True}))
+    sessions_before = handlers.sessions.count()
+    # Half an upload arrives, then the client stalls
+    messages = [{'type': 'http.request', 'more_body': True,
+                 'body': b'--b\r\nContent-Disposition: form-data; name="audio"; filename="a.wav"\r\n\r\nRIFF'}]
+    gone = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await gone.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    async def scenario():
+        scope = {'type': 'http', 'method': 'POST', 'path': '/create-video', 'query_string': b'',
+                 'headers': [(b'content-type', b'multipart/form-data; boundary=b')]}
+        upload = asyncio.ensure_future(server.app(scope, receive, send))
+        while messages:
+            await asyncio.sleep(0.01)
+        status = (await asyncio.wait_for(asyncio.to_thread(get, server, 'GET', '/profiles'), 2))[0]
+        gone.set()
+        await asyncio.wait_for(upload, 5)
+        return status
+
+    assert asyncio.run(scenario()) == 200
+    assert sent[0]['status'] == 400
+    assert handlers.sessions.count() == sessions_before
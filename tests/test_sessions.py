@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+from sessions import SessionManager, SessionQuotaError
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return SessionManager(str(tmp_path / 'sessions'), quota_bytes=100)
+
+
+def test_folder_goes_with_the_last_reference(manager):
+    session = manager.create(10)
+    assert os.path.isdir(session.path)
+    assert manager.acquire(session)
+
+    manager.release(session)
+    assert os.path.isdir(session.path)
+    manager.release(session)
+    assert not os.path.exists(session.path)
+    assert not manager.acquire(session)
+    assert manager.count() == 0
+
+
+def test_retained_session_outlives_its_references(manager, monkeypatch):
+    session = manager.create(10)
+    manager.release(session, retain=60)
+    assert os.path.isdir(session.path)
+    assert manager.get(session.id) is session
+
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+    manager.release(manager.create(0))  # Expiry runs on the next create or release
+    assert not os.path.exists(session.path)
+
+
+def test_discard_ends_retention(manager):
+    session = manager.create(10)
+    manager.release(session, retain=60)
+    manager.discard(session)
+    assert not os.path.exists(session.path)
+
+
+def test_discard_waits_for_a_download_in_progress(manager):
+    session = manager.create(10)
+    manager.release(session, retain=60)
+    manager.acquire(session)  # A download holds the result
+    manager.discard(session)
+    assert os.path.isdir(session.path)
+    manager.release(session)
+    assert not os.path.exists(session.path)
+
+
+def test_quota_evicts_the_oldest_retained_sessions(manager):
+    old, newer = manager.create(40), manager.create(40)
+    newer.created_at = old.created_at + 1
+    manager.release(old, retain=600)
+    manager.release(newer, retain=600)
+
+    manager.create(30)
+    assert not os.path.exists(old.path)
+    assert os.path.isdir(newer.path)
+    assert manager.evicted == 1
+
+
+def test_sessions_in_use_are_never_evicted(manager):
+    busy = manager.create(60)
+    retained = manager.create(30)
+    manager.release(retained, retain=600)
+
+    with pytest.raises(SessionQuotaError):
+        manager.create(50)
+    # Evicting the retained session would not have been enough, so it stays
+    assert os.path.isdir(retained.path)
+    assert os.path.isdir(busy.path)
+    assert manager.evicted == 0
+
+
+def test_measure_updates_the_reservation(manager):
+    session = manager.create(90)
+    with open(os.path.join(session.path, 'video.mp4'), 'wb') as f:
+        f.write(b'x' * 5)
+    manager.measure(session)
+    assert manager.used_bytes() == 5
+    manager.create(90)  # Fits now that the real size is known
+
+
+def test_leftover_folders_are_adopted_and_cleaned_up(tmp_path):
+    root = tmp_path / 'sessions'
+    (root / 'old').mkdir(parents=True)
+    (root / 'old' / 'output.mp4').write_bytes(b'x' * 80)
+
+    manager = SessionManager(str(root), quota_bytes=100)
+    assert manager.used_bytes() == 80
+    manager.create(50)
+    assert not (root / 'old').exists()
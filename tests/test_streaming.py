@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+import streaming
+from progress import FFmpegRun
+from streaming import stream_ffmpeg
+
+COMMAND = ['ffmpeg', '-t', '2', '-f', 'mp4', 'pipe:1']
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """The FFmpegRuns stream_ffmpeg starts"""
+    started = []
+
+    class RecordedRun(FFmpegRun):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            started.append(self)
+
+    monkeypatch.setattr(streaming, 'FFmpegRun', RecordedRun)
+    return started
+
+
+def test_output_is_streamed_and_copied(tmp_path, fake_ffmpeg, runs):
+    finished = []
+    copy_path = str(tmp_path / 'copy.mp4')
+    body = b''.join(stream_ffmpeg(COMMAND, 30, copy_path, on_success=lambda: finished.append(True)))
+    assert body
+    with open(copy_path, 'rb') as f:
+        assert f.read() == body
+    assert finished == [True]
+    assert runs[0].returncode == 0
+
+
+def test_on_success_waits_for_a_clean_exit(fake_ffmpeg, monkeypatch, runs):
+    monkeypatch.setenv('FAKE_FFMPEG_FAILURE_RATE', '1')
+    finished = []
+    assert b''.join(stream_ffmpeg(COMMAND, 30, on_success=lambda: finished.append(True)))
+    assert runs[0].returncode == 1
+    assert finished == []
+
+
+def test_closing_the_stream_kills_ffmpeg(fake_ffmpeg, monkeypatch, runs):
+    # A client that goes away after the first bytes
+    monkeypatch.setenv('FAKE_FFMPEG_PROFILE', 'hang')
+    monkeypatch.setenv('FAKE_FFMPEG_MEMORY_MB', '0')
+    finished = []
+    body = stream_ffmpeg(COMMAND, 30, on_success=lambda: finished.append(True))
+    assert next(body)
+    start = time.perf_counter()
+    body.close()
+    assert time.perf_counter() - start < 5
+    assert runs[0].process.poll() is not None
+    assert runs[0].returncode < 0
+    assert finished == []
+
+
+def test_ffmpeg_is_killed_after_the_timeout(fake_ffmpeg, monkeypatch, runs):
+    monkeypatch.setenv('FAKE_FFMPEG_PROFILE', 'hang')
+    monkeypatch.setenv('FAKE_FFMPEG_MEMORY_MB', '0')
+    finished = []
+    start = time.perf_counter()
+    list(stream_ffmpeg(COMMAND, 0.5, on_success=lambda: finished.append(True)))
+    assert time.perf_counter() - start < 10
+    assert runs[0].returncode < 0
+    assert finished == []
+
+
+def test_a_missing_binary_invalidates_the_capabilities(monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(streaming, 'invalidate_capabilities', lambda: invalidated.append(True))
+    with pytest.raises(OSError):
+        next(stream_ffmpeg(['/nonexistent/ffmpeg', 'pipe:1'], 30))
+    assert invalidated == [True]
@@ -0,0 +1,59 @@
+import pytest
+
+from subtitles import (FRAME_STEP, SENTENCE_PAUSE, WORD_PAUSE, build_cues, cue_boundaries, get_style,
+                       reading_weight, split_cues, subtitle_track, wrap_lines)
+
+STYLE = get_style('default')
+
+
+def test_reading_weight_counts_characters_words_and_sentence_ends():
+    assert reading_weight('Hi there') == 7 + 2 * WORD_PAUSE
+    assert reading_weight('Hi there.') == 8 + 2 * WORD_PAUSE + SENTENCE_PAUSE
+
+
+def test_cues_last_in_proportion_to_their_reading_weight():
+    short, long = 'Yes.', 'This sentence takes a good deal longer to read.'
+    cues = build_cues(f'{short} {long}', 10, STYLE)
+    assert [cue.text for cue in cues] == [short, long]
+    share = reading_weight(short) / (reading_weight(short) + reading_weight(long))
+    assert cues[0].end == pytest.approx(10 * share, abs=FRAME_STEP / 2)
+    assert cues[1].start == cues[0].end
+    assert cues[1].end == 10
+
+
+def test_cue_times_are_on_the_frame_grid():
+    cues = build_cues('One. Two words. Three words here. And four more words.', 7.3, STYLE)
+    for cue in cues:
+        assert round(cue.end / FRAME_STEP, 6) == round(cue.end / FRAME_STEP)
+
+
+def test_long_sentences_are_split_to_fit_two_lines():
+    text = ' '.join(['word'] * 40) + '.'
+    pieces = split_cues(text, STYLE.line_chars)
+    assert len(pieces) > 1
+    assert ' '.join(pieces) == text
+    assert all(len(wrap_lines(piece, STYLE.line_chars)) <= 2 for piece in pieces)
+
+
+def test_no_cues_without_text_or_time():
+    assert build_cues('   ', 10, STYLE) == []
+    assert build_cues('Hello.', 0, STYLE) == []
+    assert subtitle_track('', STYLE, 'burn', 10) is None
+
+
+def test_track_is_cut_off_where_the_video_ends():
+    track = subtitle_track('First one. Second one. Third one.', STYLE, 'burn', 9, length=4)
+    assert track.cues[-1].end == 4
+    assert all(cue.start < 4 for cue in track.cues)
+
+
+def test_track_falls_back_to_soft_without_burn_in():
+    assert subtitle_track('Hello.', STYLE, 'burn', 5, can_burn=False).mode == 'soft'
+
+
+def test_cue_boundaries_are_sorted_and_skip_the_start():
+    cues = build_cues('One. Two. Three.', 6, STYLE)
+    boundaries = cue_boundaries(cues)
+    assert boundaries == sorted(set(boundaries))
+    assert 0 not in boundaries
+    assert boundaries[-1] == 6
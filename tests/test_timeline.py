@@ -0,0 +1,82 @@
+import pytest
+
+from timeline import DEFAULT_IMAGE_DURATION, clip_timeline, cut_timeline, parse_durations, write_concat_script
+
+
+def test_clip_timeline_drops_images_after_the_end_and_shortens_the_last():
+    items, durations = clip_timeline(['a', 'b', 'c', 'd'], [30, 30, 30, 30], 70)
+    assert items == ['a', 'b', 'c']
+    assert durations == [30, 30, 10]
+
+
+def test_clip_timeline_keeps_a_shorter_timeline_as_it_is():
+    assert clip_timeline([0, 1], [2.0, 3.0], 70) == ([0, 1], [2.0, 3.0])
+
+
+def test_clip_timeline_ending_on_an_image_boundary_drops_the_next_image():
+    assert clip_timeline(['a', 'b', 'c'], [5, 5, 5], 10.0004) == (['a', 'b'], [5, 5])
+
+
+def test_clip_timeline_keeps_the_first_image_of_a_very_short_audio():
+    assert clip_timeline(['a', 'b'], [5, 5], 0.5) == (['a'], [0.5])
+
+
+@pytest.mark.parametrize('value', ['3,2.5,4', ' 3, 2.5 ,4 ', '[3, 2.5, 4]'])
+def test_parse_durations_accepts_lists_and_json(value):
+    assert parse_durations(value, 3) == [3.0, 2.5, 4.0]
+
+
+def test_parse_durations_defaults_every_image():
+    assert parse_durations('', 2) == [DEFAULT_IMAGE_DURATION] * 2
+
+
+@pytest.mark.parametrize('value, message', [
+    ('3,4', 'Expected 3 durations, got 2'),
+    ('3,x,4', 'numbers of seconds'),
+    ('{"a": 1}', 'numbers of seconds'),
+    ('[3, null, 4]', 'numbers of seconds'),
+    ('3,0.01,4', 'between'),
+    ('3,601,4', 'between'),
+])
+def test_parse_durations_rejects_bad_lists(value, message):
+    with pytest.raises(ValueError, match=message):
+        parse_durations(value, 3)
+
+
+def concat_durations(path):
+    with open(path, encoding='utf-8') as f:
+        return [float(line.split()[1]) for line in f if line.startswith('duration ')]
+
+
+def test_concat_script_lists_the_last_image_twice(tmp_path):
+    script = write_concat_script(str(tmp_path / 'timeline.txt'), [str(tmp_path / 'a.jpg'), str(tmp_path / 'b.jpg')],
+                                 [2, 3])
+    with open(script, encoding='utf-8') as f:
+        assert f.read() == ("ffconcat version 1.0\nfile 'a.jpg'\nduration 2.000\n"
+                            "file 'b.jpg'\nduration 3.000\nfile 'b.jpg'\n")
+
+
+def test_concat_script_rounds_the_running_total(tmp_path):
+    # A third of a second rounds to 0.333 each time; rounding every entry
+    # would leave the end 30 ms early after 100 images
+    images = [str(tmp_path / f'{i}.jpg') for i in range(100)]
+    durations = concat_durations(write_concat_script(str(tmp_path / 'timeline.txt'), images, [1 / 3] * 100))
+    assert round(sum(durations), 3) == 33.333
+    assert max(durations) - min(durations) == pytest.approx(0.001)
+
+
+def test_cut_timeline_splits_images_at_each_cut():
+    paths, durations = cut_timeline(['a', 'b'], [4, 4], [1.5, 6, 4])
+    assert paths == ['a', 'a', 'b', 'b']
+    assert durations == pytest.approx([1.5, 2.5, 2, 2])
+
+
+def test_cut_timeline_ignores_cuts_on_boundaries_and_past_the_end():
+    assert cut_timeline(['a', 'b'], [4, 4], [4, 4.0005, 0, 8, 12]) == (['a', 'b'], [4, 4])
+
+
+def test_cut_timeline_keeps_the_total_length():
+    cuts = [i * 0.04 for i in range(1, 250)]
+    paths, durations = cut_timeline(['a', 'b', 'c'], [3.3, 3.3, 3.4], cuts)
+    assert sum(durations) == pytest.approx(10)
+    assert paths[0] == 'a' and paths[-1] == 'c'
@@ -0,0 +1,138 @@
+import asyncio
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+
+from uploads import MAX_FORM_FIELD_SIZE, MultipartReceiver, UploadError, receive_multipart_async, sniff_format
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\0' * 100
+JPEG = b'\xff\xd8\xff\xe0' + b'\0' * 100
+WAV = b'RIFF\0\0\0\0WAVEfmt ' + b'\0' * 100
+
+RULES = {
+    'audio': {'max_size': 1000, 'max_count': 1, 'formats': {'wav', 'mp3'}, 'name': 'audio.{ext}'},
+    'images': {'max_size': 200, 'max_count': 2, 'formats': {'png', 'jpg'}, 'name': 'img{index:03d}.jpg'},
+}
+
+
+@pytest.mark.parametrize('head, expected', [
+    (JPEG, 'jpg'),
+    (PNG, 'png'),
+    (b'RIFF\0\0\0\0WEBPVP8 ', 'webp'),
+    (WAV, 'wav'),
+    (b'\0\0\0\x20ftypM4A ', 'm4a'),
+    (b'ID3\x04\0\0\0\0\0\0\0\0', 'mp3'),
+    (b'\xff\xfb\x90\x00' + b'\0' * 8, 'mp3'),
+    (b'\xff\xf1\x50\x80' + b'\0' * 8, 'aac'),
+    (b'GIF89a' + b'\0' * 6, None),
+    (b'\xff', None),
+    (b'', None),
+])
+def test_formats_are_sniffed_from_magic_bytes(head, expected):
+    assert sniff_format(head) == expected
+
+
+def body(*parts, **fields):
+    """A multipart body with (field, filename, data) file parts; returns (content type, bytes)"""
+    form = MultiDict(fields)
+    for field, filename, data in parts:
+        form.add(field, FileStorage(io.BytesIO(data), filename))
+    boundary, data = encode_multipart(form)
+    return f'multipart/form-data; boundary={boundary}', data
+
+
+def receive(tmp_path, content_type, data, chunk_size=7):
+    receiver = MultipartReceiver(content_type, str(tmp_path), RULES)
+    try:
+        for i in range(0, len(data), chunk_size):
+            if receiver.feed(data[i:i + chunk_size]):
+                break
+        else:
+            receiver.feed(b'')
+    finally:
+        receiver.close()
+    return receiver.result()
+
+
+def test_files_are_spooled_under_their_rule_names(tmp_path):
+    form, files = receive(tmp_path, *body(('audio', 'song.mp3', WAV), ('images', 'a.png', PNG),
+                                          ('images', 'b.png', JPEG), durations='3,4'))
+    assert form['durations'] == '3,4'
+    assert files['audio'].format == 'wav'  # From the contents, not the filename
+    assert [f.format for f in files.getlist('images')] == ['png', 'jpg']
+    assert sorted(os.listdir(tmp_path)) == ['audio.wav', 'img000.jpg', 'img001.jpg']
+    with open(files['audio'].path, 'rb') as f:
+        assert f.read() == WAV
+    assert files['audio'].size == len(WAV)
+
+
+def test_wrong_format_is_rejected(tmp_path):
+    with pytest.raises(UploadError, match='Invalid file format') as error:
+        receive(tmp_path, *body(('images', 'fake.png', WAV)))
+    assert error.value.status == 400
+
+
+def test_file_over_its_limit_is_rejected(tmp_path):
+    with pytest.raises(UploadError, match='too large') as error:
+        receive(tmp_path, *body(('images', 'big.png', PNG + b'\0' * 200)))
+    assert error.value.status == 413
+
+
+def test_too_many_files(tmp_path):
+    with pytest.raises(UploadError, match='Too many images'):
+        receive(tmp_path, *body(*[('images', f'{i}.png', PNG) for i in range(3)]))
+
+
+def test_empty_file(tmp_path):
+    data = (b'--b\r\nContent-Disposition: form-data; name="audio"; filename="a.wav"\r\n\r\n'
+            b'\r\n--b--\r\n')
+    with pytest.raises(UploadError, match='is empty'):
+        receive(tmp_path, 'multipart/form-data; boundary=b', data)
+
+
+def test_form_field_over_the_limit(tmp_path):
+    with pytest.raises(UploadError) as error:
+        receive(tmp_path, *body(subtitle_text='x' * (MAX_FORM_FIELD_SIZE + 1)), chunk_size=4096)
+    assert error.value.status == 413
+
+
+def test_unknown_file_fields_are_discarded(tmp_path):
+    form, files = receive(tmp_path, *body(('other', 'x.png', PNG)))
+    assert not files
+    assert os.listdir(tmp_path) == []
+
+
+def test_truncated_body(tmp_path):
+    content_type, data = body(('audio', 'a.wav', WAV))
+    with pytest.raises(UploadError, match='Malformed upload'):
+        receive(tmp_path, content_type, data[:-20])
+
+
+def test_body_cut_off_by_a_disconnect(tmp_path):
+    content_type, data = body(('audio', 'a.wav', WAV))
+    receiver = MultipartReceiver(content_type, str(tmp_path), RULES)
+    receiver.feed(data[:-20])
+    receiver.close()
+    with pytest.raises(UploadError, match='ended before'):
+        receiver.result()
+
+
+def test_not_multipart(tmp_path):
+    with pytest.raises(UploadError, match='Expected a multipart'):
+        MultipartReceiver('application/json', str(tmp_path), RULES)
+
+
+def test_async_receive_enforces_the_request_limit(tmp_path):
+    content_type, data = body(('audio', 'a.wav', WAV))
+    messages = [{'type': 'http.request', 'body': data[i:i + 50], 'more_body': i + 50 < len(data)}
+                for i in range(0, len(data), 50)]
+
+    async def next_message():
+        return messages.pop(0)
+
+    with pytest.raises(UploadError) as error:
+        asyncio.run(receive_multipart_async(next_message, content_type, str(tmp_path), RULES, max_size=100))
+    assert error.value.status == 413
@@ -0,0 +1,137 @@
+import json
+import os
+
+DEFAULT_IMAGE_DURATION = 2.0  # Seconds per image when the client gives no durations
+MIN_IMAGE_DURATION = 0.1
+MAX_IMAGE_DURATION = 600.0
+KEYFRAME_INTERVAL = 10  # Seconds of timeline between forced keyframes
+
+
+def timeline_video_args():
+    """Video encoder arguments for a concat timeline of stills.
+
+    Each still is decoded and encoded exactly once: the concat demuxer gives
+    every image one frame whose timestamp carries its duration, and vfr
+    output keeps FFmpeg from duplicating frames to fill a constant rate.
+    """
+    return [
+        '-vsync', 'vfr',
+        # Long GOPs, but still a keyframe every few seconds so players can seek
+        '-force_key_frames', f'expr:gte(t,n_forced*{KEYFRAME_INTERVAL})',
+    ]
+
+
+def parse_durations(value, image_count):
+    """Parse per-image durations from a form field.
+
+    Accepts a comma separated list ("3,2.5,4") or a JSON array. An empty value
+    gives every image DEFAULT_IMAGE_DURATION. Raises ValueError when the list
+    is malformed or does not have one entry per image.
+    """
+    if not value or not value.strip():
+        return [DEFAULT_IMAGE_DURATION] * image_count
+
+    value = value.strip()
+    if value.startswith('['):
+        items = json.loads(value)
+        if not isinstance(items, list):
+            raise ValueError('durations must be a list of seconds')
+    else:
+        items = value.split(',')
+
+    try:
+        durations = [float(item) for item in items]
+    except (TypeError, ValueError):
+        raise ValueError('durations must be numbers of seconds')
+
+    if len(durations) != image_count:
+        raise ValueError(f'Expected {image_count} durations, got {len(durations)}')
+    for duration in durations:
+        if not MIN_IMAGE_DURATION <= duration <= MAX_IMAGE_DURATION:
+            raise ValueError(f'Each duration must be between {MIN_IMAGE_DURATION} '
+                             f'and {MAX_IMAGE_DURATION:g} seconds')
+    return durations
+
+
+def spread_durations(total_duration, image_count):
+    """Split a total duration evenly across the images"""
+    return [total_duration / image_count] * image_count
+
+
+def clip_timeline(items, durations, seconds):
+    """Drop the part of a timeline that runs past ``seconds``.
+
+    With one frame per still, -shortest can only stop the video at an image
+    boundary, so a timeline longer than the audio is clipped to it first:
+    entries that start after the end are dropped and the last one that
+    remains is shortened. ``items`` are the images (paths or indices) the
+    durations belong to. Returns new (items, durations) lists.
+    """
+    clipped_items, clipped = [], []
+    start = 0.0
+    for item, duration in zip(items, durations):
+        # Pieces shorter than a millisecond would round away in the script
+        if clipped and start + 0.001 >= seconds:
+            break
+        clipped_items.append(item)
+        clipped.append(min(duration, seconds - start))
+        start += duration
+    return clipped_items, clipped
+
+
+def cut_timeline(image_paths, durations, cut_times):
+    """Split image entries at ``cut_times`` (seconds from the start).
+
+    The same image is listed once per piece, so with vfr output FFmpeg emits
+    a new frame exactly at each cut and nowhere else - enough for an overlay
+    such as burned-in subtitles that changes at known times. Returns new
+    (image_paths, durations) lists.
+    """
+    cuts = sorted(cut_times)
+    paths, lengths = [], []
+    start = 0.0
+    for path, duration in zip(image_paths, durations):
+        end = start + duration
+        position = start
+        for cut in cuts:
+            # Pieces shorter than a millisecond would round away in the script
+            if position + 0.001 < cut < end - 0.001:
+                paths.append(path)
+                lengths.append(cut - position)
+                position = cut
+        paths.append(path)
+        lengths.append(end - position)
+        start = end
+    return paths, lengths
+
+
+def write_concat_script(script_path, image_paths, durations):
+    """Write an ffconcat script that shows each image for its duration"""
+    folder = os.path.dirname(os.path.abspath(script_path))
+    lines = ['ffconcat version 1.0']
+    # Durations are written so their running total is rounded, not each one,
+    # which keeps long timelines from drifting away from their cut points
+    elapsed = written = 0.0
+    for path, duration in zip(image_paths, durations):
+        elapsed += duration
+        lines.append(f"file '{os.path.relpath(os.path.abspath(path), folder)}'")
+        lines.append(f'duration {round(elapsed, 3) - written:.3f}')
+        written = round(elapsed, 3)
+    # The demuxer ignores the duration of the final entry unless another
+    # entry follows it, so the last image is listed once more
+    lines.append(f"file '{os.path.relpath(os.path.abspath(image_paths[-1]), folder)}'")
+
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return script_path
+
+
+def timeline_input_args(script_path):
+    """FFmpeg input arguments for a concat script written by write_concat_script"""
+    return ['-f', 'concat', '-i', script_path]
+
+
+def frame_filter(width, height):
+    """Letterbox every image onto the same canvas so sizes never mix mid-stream"""
+    return (f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+            f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1')
@@ -0,0 +1,240 @@
+import os
+
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+
+CHUNK_SIZE = 64 * 1024
+MAX_FORM_FIELD_SIZE = 64 * 1024  # Plain text fields are kept in memory
+SNIFF_SIZE = 12                   # Bytes needed to recognise every supported format
+
+
+class UploadError(Exception):
+    """Raised when an upload is malformed, too large or of an unsupported type"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadedFile:
+    """A file part that has been written to disk"""
+
+    def __init__(self, field, filename, path, format):
+        self.field = field
+        self.filename = filename
+        self.path = path
+        self.format = format
+        self.size = 0
+
+
+def sniff_format(head):
+    """Identify a media format from its first bytes, or return None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[4:8] == b'ftyp':
+        return 'm4a'
+    if head.startswith(b'ID3'):
+        return 'mp3'
+    if len(head) >= 2 and head[0] == 0xFF:
+        # MPEG audio frame sync is 11 set bits; ADTS AAC uses layer 00
+        if head[1] & 0xF6 == 0xF0:
+            return 'aac'
+        if head[1] & 0xE0 == 0xE0 and head[1] & 0x06:
+            return 'mp3'
+    return None
+
+
+def _mb(size):
+    return size // 1024 // 1024
+
+
+class _FileWriter:
+    """Spool one file part to disk, sniffing its format and enforcing its size limit"""
+
+    def __init__(self, field, filename, index, rule, folder):
+        self.field = field
+        self.filename = filename
+        self.index = index
+        self.rule = rule
+        self.folder = folder
+        self.head = bytearray()
+        self.upload = None
+        self.file = None
+
+    def _open(self):
+        fmt = sniff_format(bytes(self.head))
+        if fmt not in self.rule['formats']:
+            raise UploadError(f'Invalid file format: {self.filename}. '
+                              f'Use {", ".join(sorted(self.rule["formats"])).upper()}')
+        name = self.rule['name'].format(index=self.index, ext=fmt)
+        path = os.path.join(self.folder, name)
+        self.upload = UploadedFile(self.field, self.filename, path, fmt)
+        self.file = open(path, 'wb')
+        self.file.write(self.head)
+        self.upload.size = len(self.head)
+
+    def write(self, data):
+        if self.file is None:
+            self.head.extend(data)
+            if len(self.head) > self.rule['max_size']:
+                self._too_large()
+            if len(self.head) >= SNIFF_SIZE:
+                self._open()
+            return
+
+        self.upload.size += len(data)
+        if self.upload.size > self.rule['max_size']:
+            self._too_large()
+        self.file.write(data)
+
+    def _too_large(self):
+        raise UploadError(f'{self.filename} too large. Maximum {_mb(self.rule["max_size"])}MB allowed',
+                          status=413)
+
+    def finish(self):
+        if self.file is None:
+            if not self.head:
+                raise UploadError(f'{self.filename} is empty')
+            self._open()
+        self.file.close()
+        return self.upload
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            self.file.close()
+
+
+class MultipartReceiver:
+    """Parse a multipart/form-data body fed to it chunk by chunk, spooling files to disk.
+
+    ``rules`` maps each accepted file field to a dict with ``max_size`` (bytes
+    per file), ``max_count``, ``formats`` (allowed sniffed formats) and
+    ``name`` (a template taking ``index`` and ``ext``). Files are never held
+    in memory: limits are enforced chunk by chunk and the format comes from
+    magic bytes rather than the client's filename. Parts with no filename
+    and file fields without a rule are discarded.
+    """
+
+    def __init__(self, content_type, folder, rules):
+        mimetype, options = parse_options_header(content_type or '')
+        boundary = options.get('boundary', '').encode('latin-1')
+        if mimetype != 'multipart/form-data' or not boundary:
+            raise UploadError('Expected a multipart/form-data request')
+        self.folder = folder
+        self.rules = rules
+        self.form = MultiDict()
+        self.files = MultiDict()
+        self.complete = False
+        self._decoder = MultipartDecoder(boundary)
+        self._counts = {}
+        self._part = None
+        self._writer = None
+        self._field_data = None
+
+    def feed(self, chunk):
+        """Parse the next chunk of the body; an empty chunk marks its end.
+
+        Returns True once the closing boundary has been seen.
+        """
+        try:
+            self._decoder.receive_data(chunk or None)
+            event = self._decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                self._on_event(event)
+                event = self._decoder.next_event()
+        except ValueError as e:
+            raise UploadError(f'Malformed upload: {str(e)}')
+        if isinstance(event, Epilogue):
+            self.complete = True
+        return self.complete
+
+    def _on_event(self, event):
+        if isinstance(event, Field):
+            self._part, self._writer, self._field_data = event, None, []
+        elif isinstance(event, File):
+            self._part, self._writer, self._field_data = event, None, None
+            rule = self.rules.get(event.name)
+            if rule and event.filename:
+                index = self._counts.get(event.name, 0)
+                if index >= rule['max_count']:
+                    raise UploadError(f'Too many {event.name}. Maximum {rule["max_count"]} allowed')
+                self._counts[event.name] = index + 1
+                self._writer = _FileWriter(event.name, event.filename, index, rule, self.folder)
+        elif isinstance(event, Data):
+            if self._writer is not None:
+                self._writer.write(event.data)
+            elif self._field_data is not None:
+                self._field_data.append(event.data)
+                if sum(len(data) for data in self._field_data) > MAX_FORM_FIELD_SIZE:
+                    raise UploadError(f'Form field {self._part.name} too large', status=413)
+            if not event.more_data:
+                if self._writer is not None:
+                    self.files.add(self._part.name, self._writer.finish())
+                    self._writer = None
+                elif self._field_data is not None:
+                    self.form.add(self._part.name, b''.join(self._field_data).decode('utf-8', 'replace'))
+
+    def close(self):
+        """Close any half-written file"""
+        if self._writer is not None:
+            self._writer.close()
+
+    def result(self):
+        """Return ``(form, files)``, or raise UploadError if the body was cut short"""
+        if not self.complete:
+            raise UploadError('Upload ended before the multipart body was complete')
+        return self.form, self.files
+
+
+def receive_multipart(request, folder, rules, chunk_size=CHUNK_SIZE):
+    """Stream a WSGI request's multipart/form-data body straight into ``folder``.
+
+    See MultipartReceiver for ``rules``. Returns ``(form, files)`` as
+    MultiDicts of strings and UploadedFile objects.
+    """
+    receiver = MultipartReceiver(request.headers.get('Content-Type', ''), folder, rules)
+    try:
+        stream = request.stream
+        while True:
+            chunk = stream.read(chunk_size)
+            if receiver.feed(chunk) or not chunk:
+                break
+    except RequestEntityTooLarge:
+        raise UploadError('Request too large', status=413)
+    finally:
+        receiver.close()
+    return receiver.result()
+
+
+async def receive_multipart_async(receive, content_type, folder, rules, max_size=None):
+    """receive_multipart for an ASGI request: read the body from ``receive`` messages.
+
+    Bodies over ``max_size`` bytes are rejected with a 413 UploadError.
+    """
+    receiver = MultipartReceiver(content_type, folder, rules)
+    received = 0
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            received += len(chunk)
+            if max_size is not None and received > max_size:
+                raise UploadError('Request too large', status=413)
+            if chunk and receiver.feed(chunk):
+                break
+            if not message.get('more_body', False):
+                receiver.feed(b'')
+                break
+    finally:
+        receiver.close()
+    return receiver.result()